@@ -0,0 +1,65 @@
+"""
+Benchmark of the ASE query paths: in-process vector mirror vs. ChromaDB HTTP client.
+
+Both paths receive the same precomputed query embeddings, so only the nearest-neighbor
+lookup (and the HTTP hop) is measured. It also reports how often both paths agree on the top result.
+
+Usage (from aig/src, inside the aig-server container so ChromaDB is reachable):
+    python -m database.bench_vector_mirror --iterations 500 --n-results 3
+"""
+import time
+import argparse
+import numpy as np
+from database.version import AseServerMetadata
+from database.vector_mirror import VectorMirror
+
+QUERIES = [
+    "oranges and fresh juice",
+    "bread and butter",
+    "meat beef and barbecue sauce",
+    "water and lemons",
+    "vegetables and olive oil",
+    "dairy milk and cereals",
+    "chicken and rice",
+    "fruits and yogurt",
+]
+
+def percentiles(samples: list) -> str:
+    values = np.asarray(samples) * 1000
+    return f"p50 {np.percentile(values, 50):7.3f} ms   p99 {np.percentile(values, 99):7.3f} ms   mean {values.mean():7.3f} ms"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--n-results", type=int, default=3)
+    args = parser.parse_args()
+
+    server = AseServerMetadata()
+    collection = server.collection
+    if collection is None:
+        raise SystemExit("ChromaDB collection is not available")
+
+    mirror = VectorMirror()
+    if not mirror.load(collection):
+        raise SystemExit("Vector mirror could not be loaded")
+    embeddings = server.embedding_cache.embed(QUERIES)
+
+    mirror_times, http_times, agreements = [], [], 0
+    for iteration in range(args.iterations):
+        embedding = [embeddings[iteration % len(embeddings)]]
+
+        start_time = time.perf_counter()
+        mirror_results = mirror.query(embedding, args.n_results)
+        mirror_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        http_results = collection.query(query_embeddings=embedding, n_results=args.n_results)
+        http_times.append(time.perf_counter() - start_time)
+
+        if mirror_results['ids'][0][:1] == list(http_results['ids'][0][:1]):
+            agreements += 1
+
+    print(f"{args.iterations} queries, {len(mirror)} embeddings ({mirror.space}), n_results={args.n_results}")
+    print(f"mirror   {percentiles(mirror_times)}")
+    print(f"chromadb {percentiles(http_times)}")
+    print(f"same top result in {agreements / args.iterations * 100:.1f}% of the queries")
@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import OrderedDict
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+class LruCache:
+    """
+    Thread-safe LRU cache bounded by the number of entries and, optionally, by the total size in bytes.
+    Entries older than ttl seconds are treated as misses (ttl=0 disables the expiration).
+    """
+    def __init__(self, max_entries: int = 128, max_bytes: int = 0, ttl: float = 0, name: str = "cache"):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (value, size, timestamp)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, timestamp = entry
+            if self.ttl > 0 and time.time() - timestamp > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int = 0):
+        """
+        Add or replace an entry. Entries bigger than max_bytes are not cached.
+        """
+        if self.max_entries <= 0 or (self.max_bytes > 0 and size > self.max_bytes):
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time())
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or (self.max_bytes > 0 and self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def invalidate_if(self, predicate) -> int:
+        """
+        Remove every entry whose key matches the predicate. It returns the number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        """
+        The caller must hold the lock.
+        """
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / requests) if requests > 0 else 0.0
+        }
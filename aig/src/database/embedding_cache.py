@@ -0,0 +1,155 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+from database.cache import LruCache
+
+class EmbeddingCache:
+    """
+    Cache in front of the ChromaDB embedding function, keyed by (model path, text).
+    Texts missing from the cache are embedded together in one batched call.
+    It has an in-memory LRU tier and an optional disk tier: a memory-mapped ring buffer of
+    vectors (embeddings.f32) with their keys (keys.bin), so the cache survives restarts.
+    """
+    key_size = 64 # sha256 hex digest
+
+    def __init__(self, embedding_function, model_path: str, max_entries: int = 1024, disk_dir: str = None, disk_entries: int = 4096):
+        self.embedding_function = embedding_function
+        self.model_path = model_path if model_path else "default"
+        self.memory = LruCache(max_entries=max_entries, name="ase-embeddings")
+        self.disk_dir = disk_dir
+        self.disk_entries = disk_entries
+        self.embedded = 0 # Texts sent to the embedding function
+        self.batches = 0 # Calls to the embedding function
+        self.disk_hits = 0
+        self._disk_index = {} # key -> row
+        self._disk_vectors = None
+        self._disk_keys = None
+        self._disk_next = 0
+        self._lock = threading.Lock()
+
+        if self.disk_dir and self.disk_entries > 0:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._disk_open()
+            except Exception as e:
+                logger.error(f"[ASE] Embedding cache directory {self.disk_dir} is not usable, disk tier disabled: {e}")
+                self.disk_dir = None
+
+    def make_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_path}\n{text}".encode('utf-8')).hexdigest()
+
+    def embed(self, texts: list) -> list:
+        """
+        Returns the embeddings (float32 vectors) of the texts, in the same order.
+        """
+        keys = [self.make_key(text) for text in texts]
+        embeddings = [None] * len(texts)
+        missing = {} # key -> text, duplicates are embedded once
+
+        for index, key in enumerate(keys):
+            vector = self.memory.get(key)
+            if vector is None and self.disk_dir:
+                vector = self._disk_get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self.memory.put(key, vector)
+            if vector is None:
+                missing[key] = texts[index]
+            embeddings[index] = vector
+
+        if len(missing) > 0:
+            missing_keys = list(missing.keys())
+            vectors = self.embedding_function(list(missing.values()))
+            self.embedded += len(missing_keys)
+            self.batches += 1
+            computed = {}
+            for key, vector in zip(missing_keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                computed[key] = vector
+                self.memory.put(key, vector)
+                if self.disk_dir:
+                    self._disk_put(key, vector)
+            embeddings = [vector if vector is not None else computed[key] for key, vector in zip(keys, embeddings)]
+
+        return embeddings
+
+    def _disk_open(self, dimension: int = None):
+        """
+        Map the disk tier files. The tier is created on the first put, when the vector dimension is known.
+        Files written by another model or with another size are discarded.
+        """
+        meta_path = os.path.join(self.disk_dir, "meta.json")
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            if meta.get('model_path') != self.model_path or meta.get('entries') != self.disk_entries or \
+                    (dimension is not None and meta.get('dimension') != dimension):
+                logger.warning(f"[ASE] Embedding cache at {self.disk_dir} does not match the current model, it is reset")
+                meta = None
+
+        if meta is None:
+            if dimension is None:
+                return
+            meta = {'model_path': self.model_path, 'entries': self.disk_entries, 'dimension': dimension}
+            mode = 'w+'
+        else:
+            mode = 'r+'
+
+        self._disk_vectors = np.memmap(os.path.join(self.disk_dir, "embeddings.f32"), dtype=np.float32, mode=mode,
+                                       shape=(meta['entries'], meta['dimension']))
+        self._disk_keys = np.memmap(os.path.join(self.disk_dir, "keys.bin"), dtype=f"S{EmbeddingCache.key_size}", mode=mode,
+                                    shape=(meta['entries'],))
+        if mode == 'w+':
+            with open(meta_path, 'w') as meta_file:
+                json.dump(meta, meta_file)
+
+        self._disk_index = {key.decode('ascii'): row for row, key in enumerate(self._disk_keys) if key}
+        self._disk_next = len(self._disk_index) % self.disk_entries
+        logger.info(f"[ASE] Embedding cache on disk at {self.disk_dir} ({len(self._disk_index)} embeddings)")
+
+    def _disk_get(self, key: str):
+        with self._lock:
+            row = self._disk_index.get(key)
+            if row is None or self._disk_vectors is None:
+                return None
+            return np.array(self._disk_vectors[row])
+
+    def _disk_put(self, key: str, vector: np.ndarray):
+        try:
+            with self._lock:
+                if self._disk_vectors is None:
+                    self._disk_open(dimension=vector.shape[0])
+                if key in self._disk_index:
+                    return
+                row = self._disk_next
+                previous = self._disk_keys[row]
+                if previous:
+                    self._disk_index.pop(previous.decode('ascii'), None) # Ring buffer: the oldest entry is overwritten
+                self._disk_vectors[row] = vector
+                self._disk_keys[row] = key.encode('ascii')
+                self._disk_index[key] = row
+                self._disk_next = (row + 1) % self.disk_entries
+                self._disk_vectors.flush()
+                self._disk_keys.flush()
+        except Exception as e:
+            logger.warning(f"[ASE] Embedding cache entry could not be written to disk: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "model_path": self.model_path,
+            "memory": self.memory.stats(),
+            "disk": {
+                "path": self.disk_dir,
+                "entries": len(self._disk_index),
+                "max_entries": self.disk_entries,
+                "hits": self.disk_hits
+            },
+            "embedded": self.embedded,
+            "batches": self.batches
+        }
@@ -0,0 +1,206 @@
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+class ImageVariantStore:
+    """
+    Downscaled JPEG variants of the stored ad images, rendered on the first request for a preset width.
+    A variant file is named after the source image, its modification time and the preset width
+    ({name}_{width}w_{mtime_ns}.jpg), so a replaced image never serves stale variants.
+    The directory is bounded by max_bytes: the least recently served variants are removed first.
+    """
+    def __init__(self, directory: str, widths: list, max_bytes: int, quality: int = 85):
+        self.directory = directory
+        self.widths = sorted(set(width for width in widths if width > 0))
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.hits = 0
+        self.misses = 0
+        self.originals = 0 # Requests served with the original image (no smaller preset fits)
+        self.evictions = 0
+        self._files = OrderedDict() # path -> size, least recently served first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._render_locks = {} # path -> (lock, waiting requests), a variant is rendered once even with concurrent requests
+        self._sizes = OrderedDict() # (path, mtime_ns) -> (width, height) of the images without known size
+        self.max_sizes = 4096
+
+        if self.directory and len(self.widths) > 0:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self._scan()
+            except Exception as e:
+                logger.error(f"[ASE] Image variants directory {self.directory} is not usable, variants disabled: {e}")
+                self.directory = None
+        else:
+            self.directory = None
+
+    def _scan(self):
+        """
+        Index the variants rendered by previous runs, oldest access first.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_atime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._bytes += size
+        logger.info(f"[ASE] Image variants at {self.directory} ({len(self._files)} files, {self._bytes / (1024 * 1024):.1f} MB)")
+
+    def select_width(self, img_width: int, img_height: int, width: int = None, height: int = None) -> int:
+        """
+        Smallest preset width that still fills the requested box (the image keeps its aspect ratio).
+        It returns None when the original image should be served (no target size or no smaller preset).
+        """
+        if (not width and not height) or not img_width or not img_height:
+            return None
+        scale = min(width / img_width if width else float('inf'), height / img_height if height else float('inf'))
+        needed = img_width * scale
+        for preset in self.widths:
+            if preset >= needed:
+                return preset if preset < img_width else None
+        return None
+
+    def get_path(self, img_path: str, width: int = None, height: int = None, img_size: tuple = None) -> str:
+        """
+        Path of the closest variant of img_path for the requested display size (rendered if needed).
+        img_size is the (width, height) of the stored image when the caller knows it (ChromaDB metadata); otherwise
+        it is read once per image version. It falls back to img_path when variants are disabled, not smaller than
+        the original or they cannot be rendered.
+        """
+        if self.directory is None or img_path is None or (not width and not height):
+            return img_path
+        try:
+            mtime_ns = os.stat(img_path).st_mtime_ns
+            img_width, img_height = img_size if img_size and all(img_size) else self.image_size(img_path, mtime_ns)
+        except FileNotFoundError:
+            return img_path
+        except Exception as e:
+            logger.warning(f"[ASE] Image {img_path} could not be inspected for variants: {e}")
+            return img_path
+
+        preset = self.select_width(img_width, img_height, width, height)
+        if preset is None:
+            self.originals += 1
+            return img_path
+
+        name, _ = os.path.splitext(os.path.basename(img_path))
+        path = os.path.join(self.directory, f"{name}_{preset}w_{mtime_ns}.jpg")
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return path
+            render_lock, waiters = self._render_locks.get(path, (threading.Lock(), 0))
+            self._render_locks[path] = (render_lock, waiters + 1)
+
+        try:
+            with render_lock:
+                with self._lock:
+                    if path in self._files: # Rendered by a concurrent request
+                        self._files.move_to_end(path)
+                        self.hits += 1
+                        return path
+                try:
+                    size = self._render(img_path, path, preset, round(img_height * preset / img_width))
+                except Exception as e:
+                    logger.error(f"[ASE] Variant {preset}w of {img_path} could not be rendered: {e}")
+                    return img_path
+
+                with self._lock:
+                    self.misses += 1
+                    self._files[path] = size
+                    self._bytes += size
+                    self._evict(keep=path)
+                return path
+        finally:
+            with self._lock:
+                # The lock is dropped once no request waits for this variant
+                render_lock, waiters = self._render_locks[path]
+                if waiters <= 1:
+                    del self._render_locks[path]
+                else:
+                    self._render_locks[path] = (render_lock, waiters - 1)
+
+    def image_size(self, img_path: str, mtime_ns: int) -> tuple:
+        """
+        (width, height) of the image, read from its header once per (path, modification time).
+        """
+        key = (img_path, mtime_ns)
+        with self._lock:
+            size = self._sizes.get(key)
+            if size is not None:
+                self._sizes.move_to_end(key)
+                return size
+        with Image.open(img_path) as img: # Only the header is read
+            size = img.size
+        with self._lock:
+            self._sizes[key] = size
+            while len(self._sizes) > self.max_sizes:
+                self._sizes.popitem(last=False)
+        return size
+
+    def _render(self, img_path: str, path: str, width: int, height: int) -> int:
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with Image.open(img_path) as img:
+                img.draft('RGB', (width, height)) # JPEG: decode directly at a reduced scale when possible
+                variant = img.convert('RGB').resize((width, max(1, height)), Image.LANCZOS)
+            variant.save(tmp_path, format='JPEG', quality=self.quality, optimize=True)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    def _evict(self, keep: str = None):
+        while self._bytes > self.max_bytes and len(self._files) > 0:
+            path, size = next(iter(self._files.items()))
+            if path == keep:
+                break
+            self._remove(path, size)
+            self.evictions += 1
+
+    def _remove(self, path: str, size: int):
+        self._files.pop(path, None)
+        self._bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[ASE] Image variant {path} could not be removed: {e}")
+
+    def discard(self, img_path: str):
+        """
+        Remove every variant of img_path (after the image is replaced or removed).
+        """
+        if self.directory is None or img_path is None:
+            return
+        prefix = os.path.join(self.directory, f"{os.path.splitext(os.path.basename(img_path))[0]}_")
+        with self._lock:
+            for path in [path for path in self._files if path.startswith(prefix)]:
+                self._remove(path, self._files[path])
+
+    def stats(self) -> dict:
+        return {
+            "path": self.directory,
+            "widths": self.widths,
+            "files": len(self._files),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "originals": self.originals,
+            "evictions": self.evictions
+        }
@@ -32,44 +32,52 @@ class SharedUtils:
         return unique_files
 
     @staticmethod
-    def load_sampledata(collection,namedir):
-        if collection is None or namedir is None:
-            return None
-        
-        if not os.path.exists(namedir):
+    def list_sampledata(namedir):
+        """
+        Walk the sample data directory without opening any file.
+        It yields {"id", "source", "name", "jpg_path", "txt_path"} for each known category.
+        """
+        if namedir is None or not os.path.exists(namedir):
             logger.error(f"[SharedUtils] Directory {namedir} does not exist.")
-            return None
-        
+            return
+
         directory = os.path.expanduser(namedir)
-        filenames = SharedUtils.get_unique_filenames(directory)
-        rdos=[]
-        for filename in filenames:
-            mydic={}
-            try:
-                # Image processing
-                filepath_jpg = os.path.join(directory, f"{filename}.jpg")            
-                im=Image.open(filepath_jpg)
-                mydic['image'] = im
-                
-                #Source and ID
-                myID = SharedUtils.categories.get(filename, -1)  # Use the filename as the id if it exists in categories, else -1
-                if myID == -1:
-                    print(f"Warning: Category '{filename}' not found in predefined categories. Using -1 as id.")
-                    continue  # Skip this file if the category is not found
-                else:
-                    mydic['id'] = myID
-                    mydic['source'] = "marketing"
-                
-                # Description processing
-                filepath_txt = os.path.join(directory, f"{filename}.txt")
-                with open(filepath_txt, 'r') as f:
-                    description = f.read().strip()            
-                mydic['description'] = description if description else "No description available."
-                
-                rdos.append(mydic)
-            except Exception as e:
-                logger.error(f"[SharedUtils] Error processing file {filename}: {e}")
+        for filename in SharedUtils.get_unique_filenames(directory):
+            myID = SharedUtils.categories.get(filename, -1)
+            if myID == -1:
+                logger.warning(f"[SharedUtils] Category '{filename}' not found in predefined categories, it is skipped.")
                 continue
-        
-        return rdos
+            yield {
+                "id": myID,
+                "source": "marketing",
+                "name": filename,
+                "jpg_path": os.path.join(directory, f"{filename}.jpg"),
+                "txt_path": os.path.join(directory, f"{filename}.txt")
+            }
+
+    @staticmethod
+    def read_sampledata(entry: dict) -> dict:
+        """
+        Read one entry of list_sampledata: the description and the JPEG bytes with the image size.
+        JPEG files are kept as they are, other formats are converted to JPEG.
+        """
+        with open(entry['jpg_path'], 'rb') as img_file:
+            img_bytes = img_file.read()
+        with Image.open(io.BytesIO(img_bytes)) as im:
+            img_width, img_height = im.size
+            if im.format != 'JPEG':
+                img_io = io.BytesIO()
+                im.convert('RGB').save(img_io, format='JPEG')
+                img_bytes = img_io.getvalue()
+
+        with open(entry['txt_path'], 'r') as f:
+            description = f.read().strip()
 
+        return {
+            "id": entry['id'],
+            "source": entry['source'],
+            "description": description if description else "No description available.",
+            "img_bytes": img_bytes,
+            "img_width": img_width,
+            "img_height": img_height
+        }
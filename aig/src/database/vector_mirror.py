@@ -0,0 +1,188 @@
+import time
+import threading
+import numpy as np
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+class VectorMirror:
+    """
+    In-process mirror of a ChromaDB collection: a contiguous float32 matrix with the embeddings
+    plus the ids, metadatas and documents in the same row order.
+    Queries are answered with an exact, vectorized top-k in the collection distance space
+    (l2, cosine or ip), so the distances compare with ASE_DISTANCE_MAX_THRESHOLD as the ChromaDB ones.
+    Writes through AseServerMetadata are applied incrementally; the row count is verified against
+    the collection every verify_interval seconds and the mirror is reloaded when they differ.
+    """
+    def __init__(self, verify_interval: float = 30):
+        self.verify_interval = verify_interval
+        self.space = "l2"
+        self.loaded = False
+        self.queries = 0
+        self.fallbacks = 0
+        self.reloads = 0
+        self.last_verified = None
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self._ids = []
+        self._metadatas = []
+        self._documents = []
+        self._rows = {} # id -> row
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def get_space(collection) -> str:
+        """
+        Distance function of the collection ('l2' is the ChromaDB default).
+        """
+        space = (collection.metadata or {}).get('hnsw:space')
+        if space is None:
+            try:
+                space = collection.configuration_json['hnsw']['space']
+            except Exception:
+                space = None
+        return space if space in ("l2", "cosine", "ip") else "l2"
+
+    def load(self, collection) -> bool:
+        """
+        (Re)build the mirror from the whole collection. It returns False when the collection cannot be read.
+        """
+        try:
+            start_time = time.time()
+            space = VectorMirror.get_space(collection)
+            records = collection.get(include=['embeddings', 'metadatas', 'documents'])
+            embeddings = records.get('embeddings')
+            ids = list(records.get('ids', []))
+            matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=np.float32)) if ids else np.zeros((0, 0), dtype=np.float32)
+        except Exception as e:
+            logger.error(f"[ASE] Vector mirror could not be loaded, queries fall back to ChromaDB: {e}")
+            with self._lock:
+                self.loaded = False
+            return False
+
+        with self._lock:
+            self.space = space
+            self._matrix = matrix
+            self._sq_norms = np.einsum('ij,ij->i', matrix, matrix) if len(ids) > 0 else np.zeros(0, dtype=np.float32)
+            self._ids = ids
+            self._metadatas = list(records.get('metadatas') or [None] * len(ids))
+            self._documents = list(records.get('documents') or [None] * len(ids))
+            self._rows = {doc_id: row for row, doc_id in enumerate(ids)}
+            self.loaded = True
+            self.last_verified = time.time()
+            self.reloads += 1
+        logger.info(f"[ASE] Vector mirror loaded: {len(ids)} embeddings ({self.space}) in {time.time() - start_time:.3f}s")
+        return True
+
+    def verify(self, collection):
+        """
+        Reload the mirror when its size differs from the collection (writes done outside this process).
+        It only contacts ChromaDB once per verify_interval.
+        """
+        if self.last_verified is not None and time.time() - self.last_verified < self.verify_interval:
+            return
+        self.last_verified = time.time()
+        try:
+            count = collection.count()
+        except Exception as e:
+            logger.warning(f"[ASE] Vector mirror could not be verified: {e}")
+            return
+        if count != len(self._ids):
+            logger.warning(f"[ASE] Vector mirror has {len(self._ids)} embeddings and the collection {count}, reloading it")
+            self.load(collection)
+
+    def upsert(self, doc_id: str, embedding, metadata: dict, document: str):
+        if not self.loaded:
+            return
+        vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            if self._matrix.shape[0] > 0 and self._matrix.shape[1] != vector.shape[1]:
+                logger.error("[ASE] Vector mirror dimension mismatch, queries fall back to ChromaDB until it is reloaded")
+                self.loaded = False
+                return
+            row = self._rows.get(doc_id)
+            if row is None:
+                self._matrix = np.ascontiguousarray(np.vstack([self._matrix, vector]) if self._matrix.shape[0] > 0 else vector)
+                self._sq_norms = np.append(self._sq_norms, np.float32(vector[0] @ vector[0]))
+                self._ids.append(doc_id)
+                self._metadatas.append(metadata)
+                self._documents.append(document)
+                self._rows[doc_id] = len(self._ids) - 1
+            else:
+                self._matrix[row] = vector[0]
+                self._sq_norms[row] = vector[0] @ vector[0]
+                self._metadatas[row] = metadata
+                self._documents[row] = document
+
+    def remove(self, doc_id: str):
+        if not self.loaded:
+            return
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                return
+            self._matrix = np.ascontiguousarray(np.delete(self._matrix, row, axis=0))
+            self._sq_norms = np.delete(self._sq_norms, row)
+            del self._ids[row]
+            del self._metadatas[row]
+            del self._documents[row]
+            self._rows = {other_id: index for index, other_id in enumerate(self._ids)}
+
+    def distances(self, query: np.ndarray) -> np.ndarray:
+        """
+        Distances between one query vector and every row, as ChromaDB computes them
+        (l2 is the squared euclidean distance).
+        """
+        dots = self._matrix @ query
+        if self.space == "cosine":
+            norms = np.sqrt(self._sq_norms) * np.float32(np.linalg.norm(query))
+            return 1.0 - dots / np.maximum(norms, np.float32(1e-12))
+        if self.space == "ip":
+            return 1.0 - dots
+        return np.maximum(self._sq_norms + np.float32(query @ query) - 2.0 * dots, 0.0)
+
+    def query(self, query_embeddings: list, n_results: int) -> dict:
+        """
+        Top-k nearest rows for each query embedding, with the same layout as a ChromaDB query result.
+        It returns None when the mirror cannot answer (not loaded or dimension mismatch).
+        """
+        with self._lock:
+            if not self.loaded:
+                self.fallbacks += 1
+                return None
+
+            results = {'ids': [], 'distances': [], 'metadatas': [], 'documents': []}
+            count = len(self._ids)
+            for embedding in query_embeddings:
+                query = np.asarray(embedding, dtype=np.float32).ravel()
+                if count > 0 and query.shape[0] != self._matrix.shape[1]:
+                    self.fallbacks += 1
+                    return None
+
+                top = []
+                if count > 0 and n_results > 0:
+                    distances = self.distances(query)
+                    k = min(n_results, count)
+                    top = np.argpartition(distances, k - 1)[:k] if k < count else np.arange(count)
+                    top = top[np.argsort(distances[top], kind='stable')]
+
+                results['ids'].append([self._ids[row] for row in top])
+                results['distances'].append([float(distances[row]) for row in top])
+                results['metadatas'].append([self._metadatas[row] for row in top])
+                results['documents'].append([self._documents[row] for row in top])
+
+            self.queries += 1
+            return results
+
+    def __len__(self):
+        return len(self._ids)
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "space": self.space,
+            "embeddings": len(self._ids),
+            "queries": self.queries,
+            "fallbacks": self.fallbacks,
+            "reloads": self.reloads
+        }
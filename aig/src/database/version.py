@@ -2,8 +2,8 @@ import importlib.metadata
 from datetime import datetime
 from PIL import Image
 import os
-import gc
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # GenAI
 import openvino_genai
 import openvino as ov
@@ -12,11 +12,16 @@ import logging
 logger = logging.getLogger(__name__)
 # ChromaDB
 import chromadb
+from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 # numpy
 import numpy as np
 # Utils 
 from database.utils import SharedUtils
+from database.cache import LruCache
+from database.embedding_cache import EmbeddingCache
+from database.vector_mirror import VectorMirror
+from database.image_variants import ImageVariantStore
 
 class Version_sch(object):
     """
@@ -38,12 +43,6 @@ class AigServerMetadata:
         if not hasattr(self, 'logo'):
             self.logo = Image.open(AigServerMetadata.get_logo_path()) if AigServerMetadata.get_logo_path() else None
             
-            # Model is NOT preloaded - lazy loading instead
-            self.preloadedModel = None
-            self._model_device = None
-            self._model_lock = threading.Lock()
-            logger.info("[AIG] Model will be loaded on-demand (lazy loading enabled)")
-            
 
     def get_logo(self):
         """
@@ -52,49 +51,6 @@ class AigServerMetadata:
         """
         return self.logo
     
-    def get_preloaded_model(self):
-        """
-        Returns the preloaded Text2Image model with lazy loading.
-        If the model is not available, it loads it on-demand.
-        """
-        with self._model_lock:
-            requested_device = AigServerMetadata.get_t2i_model_device()
-            
-            # Load model if not loaded or device changed
-            if self.preloadedModel is None or self._model_device != requested_device:
-                if AigServerMetadata.is_device_available(requested_device):
-                    logger.info(f"[AIG] Loading Text2Image model on device: {requested_device}")
-                    try:
-                        self.preloadedModel = openvino_genai.Text2ImagePipeline(
-                            AigServerMetadata.get_t2i_model_path(), 
-                            requested_device
-                        )
-                        self._model_device = requested_device
-                        logger.info(f"[AIG] Model loaded successfully on {requested_device}")
-                    except Exception as e:
-                        logger.error(f"[AIG] Failed to load model on {requested_device}: {e}")
-                        self.preloadedModel = None
-                        self._model_device = None
-                else:
-                    logger.error(f"[AIG] Device {requested_device} is not available")
-                    self.preloadedModel = None
-            
-            return self.preloadedModel
-    
-    def unload_model(self):
-        """
-        Unload the Text2Image model from memory to free up resources.
-        """
-        with self._model_lock:
-            if self.preloadedModel is not None:
-                logger.info("[AIG] Unloading Text2Image model from memory")
-                del self.preloadedModel
-                self.preloadedModel = None
-                self._model_device = None
-                gc.collect()
-                logger.info("[AIG] Model unloaded successfully")
-            
-    
     """
     Metadata for AIG Server.
     """
@@ -121,6 +77,22 @@ class AigServerMetadata:
         
         return False
         
+    @staticmethod
+    def create_t2i_pipeline(device: str):
+        """
+        Compile the Text2Image model (AIG_MODEL_PATH) on the given device.
+        The compiled blobs are stored in AIG_OV_CACHE_DIR, so later loads (restarts, reloads after an unload) skip the compilation.
+        """
+        properties = {}
+        cache_dir = AigServerMetadata.get_ov_cache_dir()
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                properties['CACHE_DIR'] = cache_dir
+            except OSError as e:
+                logger.error(f"[AIG] OpenVINO model cache directory {cache_dir} is not usable, the model is compiled without cache: {e}")
+        return openvino_genai.Text2ImagePipeline(AigServerMetadata.get_t2i_model_path(), device, **properties)
+
     @staticmethod
     def version():
         return AigServerMetadata.__version__
@@ -188,10 +160,207 @@ class AigServerMetadata:
     def should_keep_model_in_memory():
         """
         Check if the model should be kept in memory after first use.
-        Returns True if model should stay loaded, False to unload after each use.
+        Returns True if model should stay loaded (it is never evicted),
+        False to unload it after AIG_MODEL_IDLE_TIMEOUT seconds without requests or under memory pressure.
         """
         return os.getenv('AIG_KEEP_MODEL_IN_MEMORY', 'false').lower() == 'true'
-    
+
+    @staticmethod
+    def get_model_idle_timeout() -> float:
+        """
+        Get the seconds a pipeline stays loaded without requests before it is evicted.
+        Default is '600'. It does not apply when AIG_KEEP_MODEL_IN_MEMORY is 'true'; '0' disables it.
+        """
+        try:
+            return max(0.0, float(os.getenv('AIG_MODEL_IDLE_TIMEOUT', 600)))
+        except ValueError:
+            return 600.0
+
+    @staticmethod
+    def get_min_available_memory() -> int:
+        """
+        Get the host available memory (AIG_MIN_AVAILABLE_MEMORY_MB) under which idle pipelines are evicted.
+        Default is '0' MB (the memory pressure check is disabled). It does not apply when AIG_KEEP_MODEL_IN_MEMORY is 'true'.
+        """
+        try:
+            return max(0, int(float(os.getenv('AIG_MIN_AVAILABLE_MEMORY_MB', 0)) * 1024 * 1024))
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def get_decoration_workers() -> int:
+        """
+        Get the number of threads drawing the add-ons when a request returns several images.
+        Default is '4'. '1' decorates the images one after another.
+        """
+        try:
+            return max(1, int(os.getenv('AIG_DECORATION_WORKERS', 4)))
+        except ValueError:
+            return 4
+
+    @staticmethod
+    def get_job_queue_size() -> int:
+        """
+        Get the maximum number of generation jobs waiting per device.
+        Default is '8'. New jobs are rejected (503) when the queue is full.
+        """
+        try:
+            return max(1, int(os.getenv('AIG_JOB_QUEUE_SIZE', 8)))
+        except ValueError:
+            return 8
+
+    @staticmethod
+    def get_job_timeout() -> float:
+        """
+        Get the maximum time (seconds) a request waits for its generation job.
+        Default is '400'.
+        """
+        try:
+            return float(os.getenv('AIG_JOB_TIMEOUT', 400))
+        except ValueError:
+            return 400.0
+
+    @staticmethod
+    def get_job_result_ttl() -> float:
+        """
+        Get the time (seconds) a finished asynchronous job and its image are kept for polling.
+        Default is '600'.
+        """
+        try:
+            return float(os.getenv('AIG_JOB_RESULT_TTL', 600))
+        except ValueError:
+            return 600.0
+
+    @staticmethod
+    def get_batch_max_size() -> int:
+        """
+        Get the maximum number of queued requests merged into one generation batch.
+        Default is '4'. '1' disables the batching.
+        """
+        try:
+            return max(1, int(os.getenv('AIG_BATCH_MAX_SIZE', 4)))
+        except ValueError:
+            return 4
+
+    @staticmethod
+    def get_batch_max_wait() -> float:
+        """
+        Get the maximum time (seconds) the worker waits for more requests to fill a batch (AIG_BATCH_MAX_WAIT_MS).
+        Default is '50' ms.
+        """
+        try:
+            return max(0.0, float(os.getenv('AIG_BATCH_MAX_WAIT_MS', 50)) / 1000.0)
+        except ValueError:
+            return 0.05
+
+    @staticmethod
+    def is_img_cache_enabled() -> bool:
+        """
+        Check if generated images are cached by prompt (and generation parameters).
+        Default is 'true'.
+        """
+        return os.getenv('AIG_IMG_CACHE_ENABLED', 'true').lower() == 'true'
+
+    @staticmethod
+    def get_img_cache_mem_items() -> int:
+        """
+        Get the number of generated images kept in the in-memory cache tier.
+        Default is '64'.
+        """
+        try:
+            return int(os.getenv('AIG_IMG_CACHE_MEM_ITEMS', 64))
+        except ValueError:
+            return 64
+
+    @staticmethod
+    def get_img_cache_mem_bytes() -> int:
+        """
+        Get the byte budget of the in-memory cache tier (AIG_IMG_CACHE_MEM_MB), counted on the decoded images.
+        Default is '128' MB.
+        """
+        try:
+            return int(float(os.getenv('AIG_IMG_CACHE_MEM_MB', 128)) * 1024 * 1024)
+        except ValueError:
+            return 128 * 1024 * 1024
+
+    @staticmethod
+    def get_img_cache_dir():
+        """
+        Get the directory of the on-disk cache tier. An empty value disables the disk tier.
+        Default is '/opt/sharedata/cache/t2i'.
+        """
+        return os.getenv('AIG_IMG_CACHE_DIR', '/opt/sharedata/cache/t2i')
+
+    @staticmethod
+    def get_img_cache_disk_bytes() -> int:
+        """
+        Get the byte budget of the on-disk cache tier (AIG_IMG_CACHE_DISK_MB).
+        Default is '512' MB.
+        """
+        try:
+            return int(float(os.getenv('AIG_IMG_CACHE_DISK_MB', 512)) * 1024 * 1024)
+        except ValueError:
+            return 512 * 1024 * 1024
+
+    @staticmethod
+    def get_gc_interval() -> float:
+        """
+        Get the seconds between scheduled garbage collections (the request path does not collect).
+        Default is '60'. '0' leaves the collection to the Python runtime.
+        """
+        try:
+            return max(0.0, float(os.getenv('AIG_GC_INTERVAL', 60)))
+        except ValueError:
+            return 60.0
+
+    @staticmethod
+    def get_ov_cache_dir():
+        """
+        Get the directory where OpenVINO stores the compiled model blobs. An empty value disables the cache.
+        Default is '/opt/sharedata/cache/ov'.
+        """
+        return os.getenv('AIG_OV_CACHE_DIR', '/opt/sharedata/cache/ov')
+
+    @staticmethod
+    def is_warmup_enabled() -> bool:
+        """
+        Check if the pipelines are loaded and run once (1-step throwaway generation) at startup, before readiness is reported.
+        Default is 'true'.
+        """
+        return os.getenv('AIG_WARMUP', 'true').lower() == 'true'
+
+    @staticmethod
+    def get_pool_devices() -> dict:
+        """
+        Get the pipeline pool as device -> number of pipelines, from AIG_POOL_DEVICES (e.g. 'GPU:1,NPU:1,CPU:1').
+        Default is one pipeline on AIG_MODEL_DEVICE.
+        """
+        devices = {}
+        for item in os.getenv('AIG_POOL_DEVICES', '').split(','):
+            item = item.strip().upper()
+            if not item:
+                continue
+            device, _, count = item.partition(':')
+            if device not in ['GPU', 'CPU', 'NPU']:
+                logger.error(f"[AIG] Unknown device {device} in AIG_POOL_DEVICES, it is ignored")
+                continue
+            try:
+                devices[device] = max(1, int(count)) if count else 1
+            except ValueError:
+                devices[device] = 1
+
+        if len(devices) == 0:
+            devices[AigServerMetadata.get_t2i_model_device()] = 1
+        return devices
+
+    @staticmethod
+    def get_pool_fallback() -> list:
+        """
+        Get the ordered devices tried when the requested one is busy or fails (AIG_POOL_FALLBACK, e.g. 'GPU,CPU').
+        Default is '' (no fallback).
+        """
+        return [device.strip().upper() for device in os.getenv('AIG_POOL_FALLBACK', '').split(',') if device.strip()]
+
 class ServerEnvironment:
     @staticmethod
     def get_dependencies() -> list[Version_sch]:
@@ -233,7 +402,23 @@ class AseServerMetadata:
             self._chroma_client = None
             self._collection = None
             self._embedding_function = None
+            self.embedding_cache = None
             self._chromadb_lock = threading.Lock()
+            # Query results cache, invalidated whenever the collection changes
+            self.query_cache = LruCache(max_entries=AseServerMetadata.get_ase_query_cache_size(),
+                                        ttl=AseServerMetadata.get_ase_query_cache_ttl(), name="ase-query")
+            self._collection_version = 0
+            # In-process copy of the collection embeddings to answer queries without the HTTP hop
+            self.vector_mirror = VectorMirror(verify_interval=AseServerMetadata.get_ase_vector_mirror_verify_interval()) \
+                if AseServerMetadata.is_ase_vector_mirror_enabled() else None
+            # Downscaled copies of the stored images for smaller displays
+            self.image_variants = ImageVariantStore(AseServerMetadata.get_ase_img_variants_dir(),
+                                                    AseServerMetadata.get_ase_img_variant_widths(),
+                                                    AseServerMetadata.get_ase_img_variants_max_size() * 1024 * 1024)
+            # Decorated ads (JPEG bytes) keyed by image, modification time and add-on parameters
+            self.rendered_ad_cache = LruCache(max_entries=AseServerMetadata.get_ase_rendered_ad_cache_size(),
+                                              max_bytes=AseServerMetadata.get_ase_rendered_ad_cache_max_size() * 1024 * 1024,
+                                              name="ase-rendered-ads")
             
             #Load the Default Ad image
             self.default_ad_image = None
@@ -268,11 +453,18 @@ class AseServerMetadata:
         """Initialize ChromaDB client and collection (called lazily)"""
         logger.info("[ASE] Initializing ChromaDB client with persistent storage...")
         try:
+            # One pooled keep-alive session is shared by every thread (queries, decoration workers, bulk loads)
             self._chroma_client = chromadb.HttpClient(
                 host=AseServerMetadata.get_ase_chromadb_host(), 
-                port=AseServerMetadata.get_ase_chromadb_port()
+                port=AseServerMetadata.get_ase_chromadb_port(),
+                settings=Settings(
+                    chroma_http_keepalive_secs=AseServerMetadata.get_ase_chromadb_keepalive(),
+                    chroma_http_max_connections=AseServerMetadata.get_ase_chromadb_max_connections(),
+                    chroma_http_max_keepalive_connections=AseServerMetadata.get_ase_chromadb_max_connections()
+                )
             )
-            logger.info(f"[ASE] ChromaDB client connected to {AseServerMetadata.get_ase_chromadb_host()}:{AseServerMetadata.get_ase_chromadb_port()}")
+            logger.info(f"[ASE] ChromaDB client connected to {AseServerMetadata.get_ase_chromadb_host()}:{AseServerMetadata.get_ase_chromadb_port()} "
+                        f"(pool of {AseServerMetadata.get_ase_chromadb_max_connections()} connections, keep-alive {AseServerMetadata.get_ase_chromadb_keepalive()}s)")
         except Exception as e:
             logger.error(f"[ASE] Error initializing ChromaDB client: {e}")
             self._chroma_client = None
@@ -287,6 +479,12 @@ class AseServerMetadata:
                 logger.error(f"[ASE] Error initializing embedding function with model '{local_path}': {e}")
                 logger.warning("[ASE] Falling back to default embedding function.")
                 self._embedding_function = embedding_functions.DefaultEmbeddingFunction()
+                local_path = None
+            # Queries and adds pass precomputed embeddings, the collection function is only a fallback
+            self.embedding_cache = EmbeddingCache(self._embedding_function, local_path,
+                                                  max_entries=AseServerMetadata.get_ase_embedding_cache_size(),
+                                                  disk_dir=AseServerMetadata.get_ase_embedding_cache_dir(),
+                                                  disk_entries=AseServerMetadata.get_ase_embedding_cache_disk_entries())
             
             try:
                 self._collection = self._chroma_client.get_or_create_collection(
@@ -300,6 +498,9 @@ class AseServerMetadata:
             
             # Load sample data after collection is ready
             self.process_sample_data()
+
+            if self.vector_mirror is not None and self._collection is not None:
+                self.vector_mirror.load(self._collection)
         else:
             logger.error("[ASE] Failed to initialize ChromaDB client.")
             self._collection = None
@@ -325,31 +526,39 @@ class AseServerMetadata:
             logger.error(f"[ChromaDB] Sample data directory {path_sample_data} does not exist.")
             return
         
-        results=SharedUtils.load_sampledata(self.collection, path_sample_data)  # Ensure the image path exists
-
-        if results is None:
+        # Only the entries missing from the collection are read, decoded and added
+        entries = list(SharedUtils.list_sampledata(path_sample_data))
+        if len(entries) == 0:
             logger.error("[ChromaDB] No sample data found or failed to load sample data.")
             return
-        
+
+        try:
+            existing = set(self.collection.get(ids=[str(entry['id']) for entry in entries], include=[]).get('ids', []))
+        except Exception as e:
+            logger.error(f"[ChromaDB] Error reading the sample data ids: {e}")
+            return
+        missing = [entry for entry in entries if str(entry['id']) not in existing]
+
         count = 0
-        total = 0
-        for result in results:
-            try:
-                id = result['id'] #int
-                description = result['description']
-                image = result['image']
-                source = result.get('source', 'ase')  # Default source is 'ase'
-                
-                if not self.chromadb_exists(id):
-                    self.chromadb_add(id, description, image, source)
-                    count = count +1
-                
-                total = total + 1
-            except Exception as e:
-                logger.error(f"[ChromaDB] Error processing sample data: {e}")
+        batch_size = AseServerMetadata.get_ase_bulk_batch_size()
+        with ThreadPoolExecutor(max_workers=AseServerMetadata.get_ase_bulk_write_workers()) as executor:
+            for start in range(0, len(missing), batch_size):
+                items = []
+                batch = missing[start:start + batch_size]
+                for entry, future in zip(batch, [executor.submit(SharedUtils.read_sampledata, entry) for entry in batch]):
+                    try:
+                        items.append(future.result())
+                    except Exception as e:
+                        logger.error(f"[ChromaDB] Error processing sample data {entry['name']}: {e}")
+                if len(items) == 0:
+                    continue
+                try:
+                    statuses = self.chromadb_upsert_many(items)
+                    count = count + sum(1 for status in statuses if status['status'] == "ok")
+                except Exception as e:
+                    logger.error(f"[ChromaDB] Error processing sample data: {e}")
 
-        logger.warning(f"[ChromaDB] {count} of {total} Sample data loaded successfully.")
-        
+        logger.warning(f"[ChromaDB] {count} of {len(entries)} Sample data loaded successfully ({len(entries) - len(missing)} already stored).")
 
     @staticmethod
     def get_ase_enable_sampledata() ->  bool:
@@ -376,6 +585,154 @@ class AseServerMetadata:
         except ValueError:
             return 1.5
         
+    @staticmethod
+    def get_ase_query_cache_size() -> int:
+        """
+        Get the maximum number of query results kept in the ASE query cache ('0' disables it).
+        Default is '256'.
+        """
+        try:
+            return int(os.getenv('ASE_QUERY_CACHE_SIZE', 256))
+        except ValueError:
+            return 256
+
+    @staticmethod
+    def get_ase_query_cache_ttl() -> float:
+        """
+        Get the seconds a cached query result is valid ('0' keeps it until the collection changes or it is evicted).
+        Default is '300'.
+        """
+        try:
+            return float(os.getenv('ASE_QUERY_CACHE_TTL', 300))
+        except ValueError:
+            return 300.0
+
+    @staticmethod
+    def get_ase_embedding_cache_size() -> int:
+        """
+        Get the maximum number of text embeddings kept in memory.
+        Default is '1024'.
+        """
+        try:
+            return int(os.getenv('ASE_EMBEDDING_CACHE_SIZE', 1024))
+        except ValueError:
+            return 1024
+
+    @staticmethod
+    def get_ase_embedding_cache_dir():
+        """
+        Get the directory of the memory-mapped embedding cache. An empty value disables the disk tier.
+        Default is '/opt/sharedata/cache/ase-embeddings'.
+        """
+        return os.getenv('ASE_EMBEDDING_CACHE_DIR', '/opt/sharedata/cache/ase-embeddings')
+
+    @staticmethod
+    def get_ase_embedding_cache_disk_entries() -> int:
+        """
+        Get the number of embeddings kept in the disk tier (oldest ones are overwritten).
+        Default is '4096'.
+        """
+        try:
+            return int(os.getenv('ASE_EMBEDDING_CACHE_DISK_ITEMS', 4096))
+        except ValueError:
+            return 4096
+
+    @staticmethod
+    def is_ase_vector_mirror_enabled() -> bool:
+        """
+        Check if queries are answered from the in-process copy of the collection embeddings.
+        Default is 'true'.
+        """
+        return os.getenv('ASE_VECTOR_MIRROR', 'true').lower() == 'true'
+
+    @staticmethod
+    def get_ase_vector_mirror_verify_interval() -> float:
+        """
+        Get the seconds between checks of the mirror size against the collection (reloaded when they differ).
+        Default is '30'.
+        """
+        try:
+            return float(os.getenv('ASE_VECTOR_MIRROR_VERIFY_INTERVAL', 30))
+        except ValueError:
+            return 30.0
+
+    @staticmethod
+    def get_ase_bulk_batch_size() -> int:
+        """
+        Get the number of documents sent in each ChromaDB upsert of a bulk ingestion.
+        Default is '64'.
+        """
+        try:
+            return max(1, int(os.getenv('ASE_BULK_BATCH_SIZE', 64)))
+        except ValueError:
+            return 64
+
+    @staticmethod
+    def get_ase_bulk_write_workers() -> int:
+        """
+        Get the number of threads writing images in a bulk ingestion.
+        Default is '4'.
+        """
+        try:
+            return max(1, int(os.getenv('ASE_BULK_WRITE_WORKERS', 4)))
+        except ValueError:
+            return 4
+
+    @staticmethod
+    def get_ase_img_variant_widths() -> list:
+        """
+        Get the preset widths (pixels, comma separated) of the downscaled image variants. An empty value disables them.
+        Default is '320,480,720,1080'.
+        """
+        widths = []
+        for width in os.getenv('ASE_IMG_VARIANT_WIDTHS', '320,480,720,1080').split(','):
+            try:
+                widths.append(int(width))
+            except ValueError:
+                continue
+        return widths
+
+    @staticmethod
+    def get_ase_img_variants_dir():
+        """
+        Get the directory where the image variants are rendered. An empty value disables them.
+        Default is '/opt/sharedata/cache/ase-variants'.
+        """
+        return os.getenv('ASE_IMG_VARIANTS_DIR', '/opt/sharedata/cache/ase-variants')
+
+    @staticmethod
+    def get_ase_img_variants_max_size() -> int:
+        """
+        Get the maximum size (MB) of the image variants directory, the least recently served variants are removed first.
+        Default is '256'.
+        """
+        try:
+            return int(os.getenv('ASE_IMG_VARIANTS_MAX_MB', 256))
+        except ValueError:
+            return 256
+
+    @staticmethod
+    def get_ase_rendered_ad_cache_size() -> int:
+        """
+        Get the maximum number of decorated ads kept in memory ('0' disables the cache).
+        Default is '256'.
+        """
+        try:
+            return int(os.getenv('ASE_RENDERED_AD_CACHE_SIZE', 256))
+        except ValueError:
+            return 256
+
+    @staticmethod
+    def get_ase_rendered_ad_cache_max_size() -> int:
+        """
+        Get the maximum size (MB) of the decorated ads kept in memory, the least recently used are evicted first.
+        Default is '64'.
+        """
+        try:
+            return int(os.getenv('ASE_RENDERED_AD_CACHE_MB', 64))
+        except ValueError:
+            return 64
+
     @staticmethod
     def get_ase_img_id():
         """
@@ -414,6 +771,28 @@ class AseServerMetadata:
         Default is 'ase-chromadb'.
         """
         return os.getenv('ASE_CHROMADB_HOST', 'ase-chromadb') # Default host for Chroma DB        
+
+    @staticmethod
+    def get_ase_chromadb_keepalive() -> int:
+        """
+        Get the time (seconds) an idle connection to Chroma DB is kept open for reuse.
+        Default is '40'.
+        """
+        try:
+            return int(os.getenv('ASE_CHROMADB_KEEPALIVE_SECS', 40))
+        except ValueError:
+            return 40
+
+    @staticmethod
+    def get_ase_chromadb_max_connections() -> int:
+        """
+        Get the maximum number of pooled connections to Chroma DB.
+        Default is '16'.
+        """
+        try:
+            return int(os.getenv('ASE_CHROMADB_MAX_CONNECTIONS', 16))
+        except ValueError:
+            return 16
     
     @staticmethod
     def get_ase_default_ad_img():
@@ -431,17 +810,51 @@ class AseServerMetadata:
         return os.getenv('ASE_IMG_PATH', '/opt/sharedata/imgs')
 
     @staticmethod
-    def save_image_to_dir(image: Image.Image, id: int):
-        # Ensure the directory exists
+    def get_image_filepath(id) -> str:
         directory=AseServerMetadata.get_ase_img_path()
-        filename = f"img_{str(id)}.jpg"
         os.makedirs(directory, exist_ok=True)
-        # Build the full path
-        filepath = os.path.join(directory, filename)
-        # Save the image
+        return os.path.join(directory, f"img_{str(id)}.jpg")
+
+    @staticmethod
+    def stage_image_bytes(img_bytes: bytes, id) -> tuple[str, str]:
+        """
+        Write already encoded JPEG bytes to a temporary file next to the image of the given ID.
+        The image is replaced when the temporary file is renamed (os.replace), so readers never see a partial file.
+        :return: The temporary path and the final path of the image.
+        """
+        filepath = AseServerMetadata.get_image_filepath(id)
+        tmp_path = f"{filepath}.{threading.get_ident()}.tmp"
         try:
-            image.save(filepath)
+            with open(tmp_path, 'wb') as img_file:
+                img_file.write(img_bytes)
         except Exception as e:
+            AseServerMetadata.discard_staged_image(tmp_path)
+            logger.error(f"[ChromaDB] Error saving image to {tmp_path}: {e}")
+            raise ValueError(f"Could not save image to {filepath}. Error: {e}")
+
+        return tmp_path, filepath
+
+    @staticmethod
+    def discard_staged_image(tmp_path: str):
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"[ChromaDB] Temporary image {tmp_path} could not be removed: {e}")
+
+    @staticmethod
+    def save_image_bytes_to_dir(img_bytes: bytes, id: int) -> str:
+        """
+        Save already encoded JPEG bytes as the image of the given ID, without decoding them.
+        The file is written to a temporary path and renamed, so it is replaced atomically.
+        :return: The full path to the image file.
+        """
+        tmp_path, filepath = AseServerMetadata.stage_image_bytes(img_bytes, id)
+        try:
+            os.replace(tmp_path, filepath)
+        except Exception as e:
+            AseServerMetadata.discard_staged_image(tmp_path)
             logger.error(f"[ChromaDB] Error saving image to {filepath}: {e}")
             raise ValueError(f"Could not save image to {filepath}. Error: {e}")
 
@@ -480,6 +893,23 @@ class AseServerMetadata:
         
         return Image.open(filepath)
 
+    @staticmethod
+    def read_image_bytes(filepath: str) -> bytes:
+        """
+        Get the stored file bytes as they are (JPEG), without decoding and re-encoding the image.
+        :param filepath: The path of the image.
+        :return: The file content or None when the file does not exist.
+        """
+        if filepath is None:
+            return None
+
+        try:
+            with open(filepath, 'rb') as img_file:
+                return img_file.read()
+        except FileNotFoundError:
+            logger.warning(f"Image file not found: {filepath}")
+            return None
+
     @staticmethod
     def remove_image_file(id: int):
         directory = AseServerMetadata.get_ase_img_path()
@@ -504,37 +934,75 @@ class AseServerMetadata:
         """
         return self.logo
 
-    def chromadb_add(self,id:int, description:str,image:Image, source:str="ase"):
+    def invalidate_query_cache(self):
+        """
+        Forget the cached query results after a change in the collection.
+        """
+        self._collection_version += 1
+        self.query_cache.clear()
+
+    def invalidate_rendered_ads(self, id):
+        """
+        Forget the decorated versions of the ad with the given ID after it is updated or removed.
+        """
+        self.rendered_ad_cache.invalidate_if(lambda key: key[0] == str(id))
+
+    def chromadb_upsert_many(self, items: list) -> list:
+        """
+        Add or update many documents at once.
+        Each item is a dict with id, description, img_bytes (JPEG), img_width, img_height and source.
+        The images are written in parallel, the descriptions are embedded in one batch and
+        the documents are upserted in batches of ASE_BULK_BATCH_SIZE.
+        :return: List of {"id", "status", "error"} in the same order as the items.
+        """
         if self.collection is None:
             raise ValueError("ChromaDB collection is not initialized. Please check the connection settings.")
-        
-        if id is None or description is None or image is None:
-            raise ValueError("id, description and image must be provided.")
 
-        filepath = None
-        try:
-            filepath=AseServerMetadata.save_image_to_dir(image, id)
-        except Exception as e:
-            logger.error(f"[ChromaDB] Error processing image: {e}")
-            raise ValueError("Invalid image provided.") 
+        statuses = [{"id": item.get('id'), "status": "ok", "error": None} for item in items]
 
-        img_height = image.height
-        img_width = image.width
+        # Images
+        img_paths = {}
+        with ThreadPoolExecutor(max_workers=AseServerMetadata.get_ase_bulk_write_workers()) as executor:
+            futures = {executor.submit(AseServerMetadata.save_image_bytes_to_dir, item['img_bytes'], item['id']): index
+                       for index, item in enumerate(items)}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    img_paths[index] = future.result()
+                except Exception as e:
+                    statuses[index].update(status="error", error=str(e))
+
+        # Embeddings (one batch) and batched upserts
+        pending = [index for index in range(len(items)) if index in img_paths]
+        embeddings = dict(zip(pending, self.embedding_cache.embed([items[index]['description'] for index in pending]))) if pending else {}
+        batch_size = AseServerMetadata.get_ase_bulk_batch_size()
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            metadatas = [{"source": items[index].get('source') or "ase", "id": items[index]['id'], "description": items[index]['description'],
+                          "img_path": img_paths[index], "img_height": items[index]['img_height'], "img_width": items[index]['img_width']}
+                         for index in batch]
+            try:
+                self.collection.upsert(
+                    documents=[items[index]['description'] for index in batch],
+                    embeddings=[embeddings[index] for index in batch],
+                    metadatas=metadatas,
+                    ids=[str(items[index]['id']) for index in batch]
+                )
+                for index, metadata in zip(batch, metadatas):
+                    if self.vector_mirror is not None:
+                        self.vector_mirror.upsert(str(items[index]['id']), embeddings[index], metadata, items[index]['description'])
+                    self.image_variants.discard(img_paths[index])
+                    self.invalidate_rendered_ads(items[index]['id'])
+            except Exception as e:
+                logger.error(f"[ChromaDB] Error upserting a batch of {len(batch)} documents: {e}")
+                for index in batch:
+                    statuses[index].update(status="error", error=f"Could not upsert the document. Error: {e}")
+
+        self.invalidate_query_cache()
+        succeeded = sum(1 for status in statuses if status['status'] == "ok")
+        logger.info(f"[ChromaDB] {succeeded} of {len(items)} documents upserted.")
+        return statuses
 
-        try:
-            self.collection.add(
-                documents=[description],
-                metadatas=[{"source": source, "id": id, "description": description, "img_path": filepath, "img_height": img_height, "img_width": img_width}],
-                ids=[str(id)]
-            )
-            logger.info(f"[ChromaDB] Document with ID {id} added successfully.")
-        except Exception as e:
-            AseServerMetadata.remove_image_file(id)
-            logger.error(f"[ChromaDB] Error adding document with ID {id}: {e}")
-            raise ValueError(f"Could not add document with ID {id} to ChromaDB. Error: {e}")
-        
-        return True
-    
     def chromadb_remove(self, id:str):
         """
         Remove a document from ChromaDB by its ID.
@@ -547,7 +1015,12 @@ class AseServerMetadata:
 
         try:
             self.collection.delete(ids=[id])
+            if self.vector_mirror is not None:
+                self.vector_mirror.remove(str(id))
+            self.invalidate_rendered_ads(id)
+            self.invalidate_query_cache()
             try:
+                self.image_variants.discard(AseServerMetadata.get_image_filepath(int(id)))
                 AseServerMetadata.remove_image_file(int(id))
             except ValueError as e:
                 logger.info(f"{id}: Not image is associated with it.")
@@ -575,12 +1048,27 @@ class AseServerMetadata:
         if not query_texts or not isinstance(query_texts, list):
             raise ValueError("query_texts must be a non-empty list.")
 
+        # Same text -> same embedding -> same results: the embedding model is uncased, so the key is normalized
+        cache_key = (tuple(" ".join(str(text).lower().split()) for text in query_texts), n_results)
+        results = self.query_cache.get(cache_key)
+        if results is not None:
+            return results
+
         try:
-            results = self.collection.query(
-                query_texts=query_texts,
-                n_results=n_results
-            )
+            collection_version = self._collection_version
+            query_embeddings = self.embedding_cache.embed(query_texts)
+            results = None
+            if self.vector_mirror is not None:
+                self.vector_mirror.verify(self.collection)
+                results = self.vector_mirror.query(query_embeddings, n_results)
+            if results is None: # No mirror or it cannot answer: ChromaDB query
+                results = self.collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=n_results
+                )
             logger.info(f"[ChromaDB] Query executed successfully with {len(results['documents'])} results.")
+            if collection_version == self._collection_version: # Not cached if the collection changed meanwhile
+                self.query_cache.put(cache_key, results)
             return results
         except Exception as e:
             logger.error(f"[ChromaDB] Error executing query: {e}")
@@ -607,21 +1095,77 @@ class AseServerMetadata:
             logger.error(f"[ChromaDB] Error checking existence of document with ID {id}: {e}")
             return False
         
-    def chromadb_update(self, id, description: str, image: Image.Image, source: str = "ase"):
+    def chromadb_upsert(self, id, description: str, img_bytes: bytes, img_width: int, img_height: int, source: str = "ase"):
         """
-        Update a document in ChromaDB by its ID.
+        Add or update a document in one ChromaDB round trip (collection.upsert).
+        The new image is staged in a temporary file and renamed over the old one once the document is stored,
+        so concurrent readers see either the previous ad or the new one, never a missing one.
         """
         if self.collection is None:
             raise ValueError("ChromaDB collection is not initialized. Please check the connection settings.")
-        if id is None or description is None or image is None:
-            raise ValueError("id, description, and image must be provided.")
+        if id is None or description is None or img_bytes is None:
+            raise ValueError("id, description and image must be provided.")
 
-        # Remove the old document and image (if they exist)
-        self.chromadb_remove(str(id))
+        tmp_path, filepath = AseServerMetadata.stage_image_bytes(img_bytes, id)
+        previous = None
+        if os.path.exists(filepath):
+            # Kept to roll the document back if the new image cannot be put in place
+            try:
+                previous = self.collection.get(ids=[str(id)], include=['embeddings', 'metadatas', 'documents'])
+            except Exception as e:
+                AseServerMetadata.discard_staged_image(tmp_path)
+                logger.error(f"[ChromaDB] Error reading document with ID {id} before the upsert: {e}")
+                raise ValueError(f"Could not upsert document with ID {id} to ChromaDB. Error: {e}")
+
+        metadata = {"source": source or "ase", "id": id, "description": description, "img_path": filepath, "img_height": img_height, "img_width": img_width}
+        try:
+            embeddings = self.embedding_cache.embed([description])
+            self.collection.upsert(
+                documents=[description],
+                embeddings=embeddings,
+                metadatas=[metadata],
+                ids=[str(id)]
+            )
+        except Exception as e:
+            AseServerMetadata.discard_staged_image(tmp_path)
+            logger.error(f"[ChromaDB] Error upserting document with ID {id}: {e}")
+            raise ValueError(f"Could not upsert document with ID {id} to ChromaDB. Error: {e}")
+
+        try:
+            os.replace(tmp_path, filepath)
+        except Exception as e:
+            AseServerMetadata.discard_staged_image(tmp_path)
+            logger.error(f"[ChromaDB] Document with ID {id} stored but its image could not be replaced, rolling it back: {e}")
+            self.rollback_upsert(id, previous)
+            raise ValueError(f"Could not save image to {filepath}. Error: {e}")
+        finally:
+            self.image_variants.discard(filepath)
+            self.invalidate_rendered_ads(id)
+            self.invalidate_query_cache()
+
+        if self.vector_mirror is not None:
+            self.vector_mirror.upsert(str(id), embeddings[0], metadata, description)
+        logger.info(f"[ChromaDB] Document with ID {id} upserted successfully.")
+        return True
+
+    def rollback_upsert(self, id, previous: dict):
+        """
+        Undo an upsert whose image could not be stored, so the collection never points at a missing or mismatched image:
+        the previous document is stored again, or the new one is removed when the ID did not exist.
+        """
+        try:
+            if previous is not None and len(previous.get('ids', [])) > 0:
+                self.collection.upsert(ids=previous['ids'], embeddings=previous['embeddings'],
+                                       metadatas=previous['metadatas'], documents=previous['documents'])
+                if self.vector_mirror is not None:
+                    self.vector_mirror.upsert(str(id), previous['embeddings'][0], previous['metadatas'][0], previous['documents'][0])
+            else:
+                self.collection.delete(ids=[str(id)])
+                if self.vector_mirror is not None:
+                    self.vector_mirror.remove(str(id))
+        except Exception as e:
+            logger.error(f"[ChromaDB] Document with ID {id} could not be rolled back: {e}")
 
-        # Add the new/updated document and image
-        return self.chromadb_add(id, description, image, source)    
-    
     def chromadb_get(self, id:str):
         """
         Get a document with the given ID in the ChromaDB collection.
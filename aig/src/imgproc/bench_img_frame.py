@@ -0,0 +1,80 @@
+"""
+Benchmark of the add-on decoration path (price, promo, frame, logo and slogan).
+
+It compares the previous path (RGBA round trip in draw_logo and gc.collect() per request)
+with the current single-buffer path, reporting wall time and PIL image allocations per request.
+
+Usage (from aig/src, with AIG_FONT_PATH set as in the container):
+    python -m imgproc.bench_img_frame --iterations 200 --size 512
+"""
+import gc
+import io
+import os
+import time
+import argparse
+from PIL import Image
+from imgproc.img_frame import ImgDecorator
+
+def legacy_draw_logo(img, logo_img, align: str = "left", valign: str = "top", logo_percentage: float = 25, margin_px: int = 10):
+    """
+    draw_logo before the single-buffer path: RGB -> RGBA -> RGB copies of the whole image.
+    """
+    img_rgba = img.convert('RGBA')
+    logo_rgba = logo_img.convert('RGBA')
+    main_width, main_height = img_rgba.size
+    logo_rgba = logo_rgba.resize((int(main_width * (logo_percentage / 100.0)),
+                                  int(main_height * (logo_percentage / 100.0))), Image.LANCZOS)
+    img_rgba.paste(logo_rgba, (margin_px, margin_px), mask=logo_rgba)
+    return img_rgba.convert('RGB')
+
+def decorate(image: Image.Image, logo: Image.Image, legacy: bool) -> bytes:
+    img = ImgDecorator.draw_price_circle(image, "5.54 $/lb", align="right", valign="bottom", font_size=24, line_width=5, margin_percentage=10)
+    img = ImgDecorator.draw_promo_rounded_rect(img, "Buy 1, Get 50% in 2nd unit", align="center", valign="bottom", font_size=20, line_width=10, margin_percentage=3)
+    img = ImgDecorator.draw_frame_double_border(img, 2)
+    if legacy:
+        img = legacy_draw_logo(img, logo, align="left", valign="top", logo_percentage=15, margin_px=10)
+    else:
+        img = ImgDecorator.draw_logo(img, logo, align="left", valign="top", logo_percentage=15, margin_px=10)
+    img = ImgDecorator.draw_slogan(img, "Best Price in Town!", align="right", valign="top", font_size=18, line_width=20, margin_percentage=5)
+    img_io = io.BytesIO()
+    img.save(img_io, format='JPEG')
+    if legacy:
+        del img
+        gc.collect()
+    return img_io.getvalue()
+
+def pil_new_count() -> int:
+    """
+    Number of image buffers allocated by PIL so far (None when the Pillow build does not expose it).
+    """
+    try:
+        return Image.core.get_stats()['new_count']
+    except Exception:
+        return None
+
+def run(name: str, source: Image.Image, logo: Image.Image, iterations: int, legacy: bool):
+    decorate(source.copy(), logo, legacy) # Warm-up (fonts, codecs)
+    start_count = pil_new_count()
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        decorate(source.copy(), logo, legacy)
+    elapsed = time.perf_counter() - start_time
+    end_count = pil_new_count()
+
+    allocations = f"{(end_count - start_count) / iterations:.1f}" if start_count is not None else "n/a"
+    print(f"{name:<14} {elapsed / iterations * 1000:8.2f} ms/request   {allocations:>6} PIL images/request")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--size", type=int, default=512)
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    source = Image.open(os.path.join(here, "test.jpg")).convert('RGB').resize((args.size, args.size))
+    logo = Image.open(os.path.join(here, "sample_logo.png"))
+    logo.load()
+
+    print(f"{args.iterations} requests, {args.size}x{args.size} image")
+    run("legacy", source, logo, args.iterations, legacy=True)
+    run("single-buffer", source, logo, args.iterations, legacy=False)
@@ -1,10 +1,67 @@
+import io
 import os
 import textwrap
 import math
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image,ImageDraw, ImageFont, ImageColor
 from database.version import AigServerMetadata
-
-class ImgDecorator:    
+from database.cache import LruCache
+
+# Resized logos ready to paste, keyed by (id(logo), width, height)
+scaled_logo_cache = LruCache(max_entries=16, name="scaled-logos")
+# Threads decorating the images of multi-result requests (PIL releases the GIL while drawing and encoding)
+decoration_executor = ThreadPoolExecutor(max_workers=AigServerMetadata.get_decoration_workers(), thread_name_prefix="decoration")
+
+@lru_cache(maxsize=32)
+def load_font(font_path: str, font_size: int):
+    """
+    Process-wide font cache keyed by (path, size), so the TTF file is parsed once per size.
+    It falls back to the PIL default font when the font cannot be loaded.
+    """
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except Exception:
+        return ImageFont.load_default()
+
+def scale_logo(logo_img, logo_size: tuple) -> tuple:
+    """
+    Returns the logo resized to logo_size as (RGB image, alpha mask), cached per logo and target size.
+    The logo images (AIG/ASE metadata) never change, so the LANCZOS resize runs once per size.
+    """
+    key = (id(logo_img), logo_size[0], logo_size[1])
+    entry = scaled_logo_cache.get(key)
+    if entry is not None and entry[0] is logo_img: # The id can be reused once an image is released
+        return entry[1], entry[2]
+
+    logo_rgba = logo_img if logo_img.mode == 'RGBA' else logo_img.convert('RGBA')
+    logo_rgba = logo_rgba.resize(logo_size, Image.LANCZOS)
+    logo_rgb = logo_rgba.convert('RGB')
+    logo_alpha = logo_rgba.getchannel('A')
+    scaled_logo_cache.put(key, (logo_img, logo_rgb, logo_alpha), logo_size[0] * logo_size[1] * 4)
+    return logo_rgb, logo_alpha
+
+@lru_cache(maxsize=1024)
+def layout_text(text: str, font_path: str, font_size: int, line_width: int) -> tuple:
+    """
+    Wraps the text at line_width characters and measures each line with the font.
+    It returns (lines, line_widths, line_heights) as tuples; the result is memoized.
+    """
+    font = load_font(font_path, font_size)
+    lines = tuple(textwrap.wrap(text, width=line_width))
+    line_widths = []
+    line_heights = []
+    for line in lines:
+        bbox = font.getbbox(line)
+        line_widths.append(bbox[2] - bbox[0])
+        line_heights.append(bbox[3] - bbox[1])
+    return lines, tuple(line_widths), tuple(line_heights)
+
+class ImgDecorator:
+    """
+    Add-ons drawn over an advertisement image. RGB images are modified in place and returned,
+    so callers must pass a copy of any image shared between requests.
+    """
     def is_color_valid(color: str) -> bool:
         """
         Checks if the given color string is a valid color name in PIL.
@@ -82,22 +139,12 @@ class ImgDecorator:
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        font = None
-        try:
-            font = ImageFont.truetype(AigServerMetadata.get_font_path(), font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font_path = AigServerMetadata.get_font_path()
+        font = load_font(font_path, font_size)
 
         draw = ImageDraw.Draw(img)
-        lines = textwrap.wrap(price, width=line_width)
-
-        # Calculate total text block height and max width
-        line_heights = []
-        line_widths = []
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_widths.append(bbox[2] - bbox[0])
-            line_heights.append(bbox[3] - bbox[1])
+        # Wrapped lines and their sizes (memoized, the same strings recur across ads)
+        lines, line_widths, line_heights = layout_text(price, font_path, font_size, line_width)
         text_block_height = sum(line_heights)
         text_block_width = max(line_widths)
 
@@ -186,22 +233,12 @@ class ImgDecorator:
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        font = None
-        try:
-            font = ImageFont.truetype(AigServerMetadata.get_font_path(), font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font_path = AigServerMetadata.get_font_path()
+        font = load_font(font_path, font_size)
 
         draw = ImageDraw.Draw(img)
-        lines = textwrap.wrap(price, width=line_width)
-
-        # Calculate total text block height and max width
-        line_heights = []
-        line_widths = []
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_widths.append(bbox[2] - bbox[0])
-            line_heights.append(bbox[3] - bbox[1])
+        # Wrapped lines and their sizes (memoized, the same strings recur across ads)
+        lines, line_widths, line_heights = layout_text(price, font_path, font_size, line_width)
         text_block_height = sum(line_heights)
         text_block_width = max(line_widths)
 
@@ -273,21 +310,12 @@ class ImgDecorator:
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        try:
-            font = ImageFont.truetype(AigServerMetadata.get_font_path(), font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font_path = AigServerMetadata.get_font_path()
+        font = load_font(font_path, font_size)
 
         draw = ImageDraw.Draw(img)
-        lines = textwrap.wrap(text, width=line_width)
-
-        # Calculate total text block height and max width
-        line_heights = []
-        line_widths = []
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_widths.append(bbox[2] - bbox[0])
-            line_heights.append(bbox[3] - bbox[1])
+        # Wrapped lines and their sizes (memoized, the same strings recur across ads)
+        lines, line_widths, line_heights = layout_text(text, font_path, font_size, line_width)
         text_block_height = sum(line_heights)
         text_block_width = max(line_widths)
 
@@ -355,17 +383,17 @@ class ImgDecorator:
         if logo_percentage < 0 or logo_percentage > 100:
             raise ValueError("logo_percentage must be between 0 and 100")
         
-        img_rgba = img.convert('RGBA')
-        logo_rgba = logo_img.convert('RGBA')
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
 
-        # Optionally resize the logo
-        main_width, main_height = img_rgba.size
+        # Resize the logo (cached per target size)
+        main_width, main_height = img.size
         logo_size = (int(main_width* (logo_percentage / 100.0)), 
                      int(main_height * (logo_percentage / 100.0)))
-        logo_rgba = logo_rgba.resize(logo_size, Image.LANCZOS)
+        logo_rgb, logo_alpha = scale_logo(logo_img, logo_size)
 
         # Choose position 
-        logo_width, logo_height = logo_rgba.size
+        logo_width, logo_height = logo_size
         x_position = None
         if align == "center":
             x_position = main_width // 2 - logo_width // 2
@@ -384,11 +412,10 @@ class ImgDecorator:
         
         position = (x_position, y_position)
 
-        # Paste the logo using itself as mask for transparency
-        img_rgba.paste(logo_rgba, position, mask=logo_rgba)
-        img_rgb = img_rgba.convert('RGB')  # Convert back to RGB if needed
+        # Paste the logo in place using its alpha channel as mask (single composite, no RGBA copy of the image)
+        img.paste(logo_rgb, position, mask=logo_alpha)
         
-        return img_rgb
+        return img
 
     def draw_slogan(
         img, text: str,
@@ -412,21 +439,12 @@ class ImgDecorator:
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        try:
-            font = ImageFont.truetype(AigServerMetadata.get_font_path(), font_size)
-        except Exception:
-            font = ImageFont.load_default()
+        font_path = AigServerMetadata.get_font_path()
+        font = load_font(font_path, font_size)
 
         draw = ImageDraw.Draw(img)
-        lines = textwrap.wrap(text, width=line_width)
-
-        # Calculate total text block height and max width
-        line_heights = []
-        line_widths = []
-        for line in lines:
-            bbox = draw.textbbox((0, 0), line, font=font)
-            line_widths.append(bbox[2] - bbox[0])
-            line_heights.append(bbox[3] - bbox[1])
+        # Wrapped lines and their sizes (memoized, the same strings recur across ads)
+        lines, line_widths, line_heights = layout_text(text, font_path, font_size, line_width)
         text_block_height = sum(line_heights)
         text_block_width = max(line_widths)
 
@@ -465,6 +483,107 @@ class ImgDecorator:
         return img    
 
 
+class DecorationPlan:
+    """
+    Add-ons requested in a payload (price, promo, frame, logo and slogan), parsed once per request:
+    colors are validated, defaults applied and fonts loaded before any image is decorated.
+    The same plan is then applied to every image of the response.
+    """
+    def __init__(self, data: dict, logo=None):
+        self.steps = [] # (name, ImgDecorator function, keyword arguments), in drawing order
+        data = data or {}
+        font_path = AigServerMetadata.get_font_path()
+
+        price_details = data.get('price_details')
+        if price_details is not None:
+            price_in_circle = bool(price_details.get('price_in_circle', False))
+            self.add_step("price", ImgDecorator.draw_price_circle, font_path,
+                          price=price_details.get('price', ""),
+                          price_color=DecorationPlan.color(price_details.get('price_color', "white"), "white"),
+                          circle_color=DecorationPlan.color(price_details.get('price_circle_color', "black"), "black") if price_in_circle else "black",
+                          align=price_details.get('align', "center"),
+                          valign=price_details.get('valign', "bottom"),
+                          margin_percentage=float(price_details.get('marperc_from_border', 2.0)),
+                          font_size=int(price_details.get('font_size', 20)),
+                          line_width=int(price_details.get('line_width', 20)))
+
+        promo_details = data.get('promo_details')
+        if promo_details is not None:
+            self.add_step("promo", ImgDecorator.draw_promo_rounded_rect, font_path,
+                          text=promo_details.get('promo_text', ""),
+                          text_color=DecorationPlan.color(promo_details.get('text_color', "white"), "white"),
+                          rect_color=DecorationPlan.color(promo_details.get('rect_color', "black"), "black"),
+                          align=promo_details.get('align', "center"),
+                          valign=promo_details.get('valign', "bottom"),
+                          margin_percentage=float(promo_details.get('marperc_from_border', 2.0)),
+                          font_size=int(promo_details.get('font_size', 20)),
+                          line_width=int(promo_details.get('line_width', 20)),
+                          rect_padding=int(promo_details.get('rect_padding', 10)),
+                          rect_radius=int(promo_details.get('rect_radius', 20)))
+
+        frame_details = data.get('framed_details')
+        if frame_details is not None and bool(frame_details.get('activate', False)):
+            self.add_step("frame", ImgDecorator.draw_frame_double_border, None,
+                          percentageFromBorder=float(frame_details.get('marperc_from_border', 2.0)))
+
+        logo_details = data.get('logo_details')
+        if logo_details is not None and logo is not None:
+            self.add_step("logo", ImgDecorator.draw_logo, None,
+                          logo_img=logo,
+                          align=logo_details.get('align', "left"),
+                          valign=logo_details.get('valign', "top"),
+                          logo_percentage=float(logo_details.get('logo_percentage', 15.0)),
+                          margin_px=int(logo_details.get('margin_px', 10)))
+
+        slogan_details = data.get('slogan_details')
+        if slogan_details is not None:
+            self.add_step("slogan", ImgDecorator.draw_slogan, font_path,
+                          text=slogan_details.get('slogan_text', ""),
+                          text_color=DecorationPlan.color(slogan_details.get('text_color', "white"), "white"),
+                          align=slogan_details.get('align', "center"),
+                          valign=slogan_details.get('valign', "bottom"),
+                          margin_percentage=float(slogan_details.get('marperc_from_border', 2.0)),
+                          font_size=int(slogan_details.get('font_size', 20)),
+                          line_width=int(slogan_details.get('line_width', 20)))
+
+    @staticmethod
+    def color(color: str, default: str) -> str:
+        return color if ImgDecorator.is_color_valid(color) else default
+
+    def add_step(self, name: str, draw, font_path: str, **kwargs):
+        if font_path is not None and 'font_size' in kwargs:
+            load_font(font_path, kwargs['font_size']) # Loaded here, so the drawing threads only hit the cache
+        self.steps.append((name, draw, kwargs))
+
+    def is_empty(self) -> bool:
+        return len(self.steps) == 0
+
+    def apply(self, image: Image.Image) -> Image.Image:
+        """
+        Draws the add-ons over the image. It is converted to RGB once and every add-on is drawn in place.
+        """
+        img = image if image.mode == 'RGB' else image.convert('RGB')
+        for _, draw, kwargs in self.steps:
+            result = draw(img, **kwargs)
+            # A step that returns no image leaves the previous one for the next steps
+            if isinstance(result, Image.Image):
+                img = result
+        return img
+
+    def render(self, image: Image.Image, format: str = 'JPEG') -> bytes:
+        img_io = io.BytesIO()
+        self.apply(image).save(img_io, format=format)
+        return img_io.getvalue()
+
+    def render_many(self, images: list, format: str = 'JPEG') -> list:
+        """
+        Renders every image with the plan, in the same order. Several images are decorated in parallel.
+        """
+        if len(images) <= 1 or AigServerMetadata.get_decoration_workers() <= 1:
+            return [self.render(image, format) for image in images]
+        return list(decoration_executor.map(lambda image: self.render(image, format), images))
+
+
 #if __name__ == "__main__":
 #    import sys
 #    from PIL import Image
@@ -487,4 +606,4 @@ class ImgDecorator:
     #img5 = ImgDecorator.draw_logo(img4, logo, align="left", valign="top", logo_percentage=15, margin_px=10)  # Add logo to the image with text and frame
     #img6 = ImgDecorator.draw_slogan(img5, "Best Price in Town!", align="right", valign="top", font_size=18, line_width=20, margin_percentage=5)  # Add slogan to the image with logo and frame
     
-    #img6.save("./caxselling/aig/src/imgproc/output_image_from_file.jpg")  # Save the image with the frame
\ No newline at end of file
+    #img6.save("./caxselling/aig/src/imgproc/output_image_from_file.jpg")  # Save the image with the frame
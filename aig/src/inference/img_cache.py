@@ -0,0 +1,152 @@
+import os
+import json
+import hashlib
+import threading
+import uuid
+from PIL import Image
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+#AIGServer Environment
+from database.version import AigServerMetadata
+from database.cache import LruCache
+
+class T2IImageCache:
+    """
+    Content-addressed cache of raw (undecorated) generated images.
+    The key is built from every parameter that determines the generation output:
+    prompt, size, inference steps, seed, model path and device.
+    It has an in-memory LRU tier and an optional disk tier (PNG files) bounded in bytes.
+    """
+    def __new__(cls):
+        """Singleton pattern to ensure only one instance of T2IImageCache exists."""
+        if not hasattr(cls, 'instance'):
+            cls.instance = super(T2IImageCache, cls).__new__(cls)
+        return cls.instance
+
+    def __init__(self):
+        # It avoids re-initialization of the instance for the singleton pattern
+        if not hasattr(self, 'memory'):
+            self.enabled = AigServerMetadata.is_img_cache_enabled()
+            self.memory = LruCache(max_entries=AigServerMetadata.get_img_cache_mem_items(),
+                                   max_bytes=AigServerMetadata.get_img_cache_mem_bytes(), name="t2i-memory")
+            self.disk_dir = AigServerMetadata.get_img_cache_dir()
+            self.disk_max_bytes = AigServerMetadata.get_img_cache_disk_bytes()
+            self.disk_hits = 0
+            self.disk_evictions = 0
+            self._disk_bytes = 0
+            self._disk_lock = threading.Lock()
+
+            if self.enabled and self.disk_dir:
+                try:
+                    os.makedirs(self.disk_dir, exist_ok=True)
+                    self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.disk_dir)
+                                           if entry.is_file() and entry.name.endswith('.png'))
+                    logger.info(f"[AIG] Image cache on disk at {self.disk_dir} ({self._disk_bytes} bytes)")
+                except Exception as e:
+                    logger.error(f"[AIG] Image cache directory {self.disk_dir} is not usable, disk tier disabled: {e}")
+                    self.disk_dir = None
+
+    @staticmethod
+    def make_key(description: str, width: int, height: int, num_inference_steps: int, seed: int, device: str) -> str:
+        key = json.dumps([description, width, height, num_inference_steps, seed,
+                          AigServerMetadata.get_t2i_model_path(), str(device).upper()])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Image.Image:
+        """
+        Returns a copy of the cached image (callers may draw on it) or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        image = self.memory.get(key)
+        if image is None and self.disk_dir:
+            image = self._disk_get(key)
+            if image is not None:
+                self.disk_hits += 1
+                self.memory.put(key, image, image.width * image.height * len(image.getbands()))
+
+        return image.copy() if image is not None else None
+
+    def put(self, key: str, image: Image.Image):
+        if not self.enabled or image is None:
+            return
+
+        image = image.copy()
+        self.memory.put(key, image, image.width * image.height * len(image.getbands()))
+        if self.disk_dir:
+            self._disk_put(key, image)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _disk_get(self, key: str) -> Image.Image:
+        filepath = self._disk_path(key)
+        try:
+            with Image.open(filepath) as img:
+                img.load()
+                image = img.copy()
+            os.utime(filepath) # The modification time is the recency used by the eviction
+            return image
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"[AIG] Image cache entry {filepath} could not be read: {e}")
+            return None
+
+    def _disk_put(self, key: str, image: Image.Image):
+        filepath = self._disk_path(key)
+        tmppath = f"{filepath}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmppath, format='PNG')
+            size = os.path.getsize(tmppath)
+            with self._disk_lock:
+                previous = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+                os.replace(tmppath, filepath)
+                self._disk_bytes += size - previous
+                self._disk_evict()
+        except Exception as e:
+            logger.warning(f"[AIG] Image cache entry {filepath} could not be written: {e}")
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+    def _disk_evict(self):
+        """
+        Remove the least recently used files until the disk tier fits its byte budget.
+        The caller must hold the disk lock.
+        """
+        if self.disk_max_bytes <= 0 or self._disk_bytes <= self.disk_max_bytes:
+            return
+
+        entries = sorted((entry for entry in os.scandir(self.disk_dir) if entry.is_file() and entry.name.endswith('.png')),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._disk_bytes -= size
+                self.disk_evictions += 1
+            except FileNotFoundError:
+                continue
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        requests = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.disk_hits
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": requests - hits,
+            "hit_rate": (hits / requests) if requests > 0 else 0.0,
+            "memory": memory,
+            "disk": {
+                "path": self.disk_dir,
+                "hits": self.disk_hits,
+                "bytes": self._disk_bytes,
+                "max_bytes": self.disk_max_bytes,
+                "evictions": self.disk_evictions
+            }
+        }
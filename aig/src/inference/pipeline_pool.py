@@ -0,0 +1,208 @@
+import gc
+import time
+import threading
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+#AIGServer Environment
+from database.version import AigServerMetadata
+
+class PipelineSlot:
+    """
+    One compiled Text2ImagePipeline resident on a device.
+    Each slot is used by a single inference worker, so the pipeline is never shared between threads.
+    """
+    def __init__(self, device: str, index: int):
+        self.device = device
+        self.index = index
+        self.pipeline = None
+        self.loads = 0
+        self.failures = 0
+        self.load_time = None # Seconds spent in the last load (compilation included)
+        self.last_used = None
+        self.warmup_time = None # Seconds spent in the startup warm-up (load and 1-step generation)
+        self.warmup_error = None
+        self.evictions = 0
+        self.in_use = False
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f"{self.device}:{self.index}"
+
+    def is_loaded(self) -> bool:
+        return self.pipeline is not None
+
+    def get(self):
+        """
+        Returns the pipeline of the slot, loading it on first use.
+        The slot is in use (it cannot be evicted) until release() is called.
+        """
+        with self._lock:
+            if self.pipeline is None:
+                logger.info(f"[AIG] Loading Text2Image pipeline {self.name}")
+                start_time = time.time()
+                try:
+                    self.pipeline = AigServerMetadata.create_t2i_pipeline(self.device)
+                except Exception:
+                    self.failures += 1
+                    raise
+                self.load_time = time.time() - start_time
+                self.loads += 1
+                logger.info(f"[AIG] Text2Image pipeline {self.name} loaded in {self.load_time:.2f}s")
+            self.in_use = True
+            self.last_used = time.time()
+            return self.pipeline
+
+    def release(self):
+        with self._lock:
+            self.in_use = False
+            self.last_used = time.time()
+
+    def idle_time(self) -> float:
+        return (time.time() - self.last_used) if self.last_used is not None else 0.0
+
+    def unload(self, reason: str = None) -> bool:
+        """
+        Free the pipeline unless a worker is using it. It returns True when the pipeline was unloaded.
+        """
+        with self._lock:
+            if self.pipeline is None or self.in_use:
+                return False
+            logger.info(f"[AIG] Unloading Text2Image pipeline {self.name}" + (f" ({reason})" if reason else ""))
+            self.pipeline = None
+            self.evictions += 1
+            gc.collect()
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "slot": self.name,
+            "loaded": self.is_loaded(),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "in_use": self.in_use,
+            "failures": self.failures,
+            "load_time": self.load_time,
+            "warmup_time": self.warmup_time,
+            "warmup_error": self.warmup_error,
+            "last_used": self.last_used
+        }
+
+class PipelinePool:
+    """
+    Configured set of pipeline slots, AIG_POOL_DEVICES (e.g. 'GPU:1,CPU:1').
+    Devices that are not available in this host are left out of the pool.
+    """
+    @staticmethod
+    def create_slots() -> dict:
+        slots = {}
+        for device, count in AigServerMetadata.get_pool_devices().items():
+            if not AigServerMetadata.is_device_available(device):
+                logger.error(f"[AIG] Device {device} is not available, it is excluded from the pipeline pool")
+                continue
+            slots[device] = [PipelineSlot(device, index) for index in range(count)]
+
+        if len(slots) == 0:
+            logger.error("[AIG] No configured device is available, the pipeline pool falls back to CPU:1")
+            slots['CPU'] = [PipelineSlot('CPU', 0)]
+
+        logger.info(f"[AIG] Pipeline pool: {', '.join(f'{device}:{len(device_slots)}' for device, device_slots in slots.items())}")
+        return slots
+
+    @staticmethod
+    def candidates(requested_device: str, pool_devices: list) -> list:
+        """
+        Ordered list of pool devices able to serve a request: the requested device first,
+        then the fallback chain (AIG_POOL_FALLBACK). When none of them is in the pool, every pool device is a candidate.
+        """
+        chain = [requested_device] + AigServerMetadata.get_pool_fallback()
+        rdo = []
+        for device in chain:
+            if device in pool_devices and device not in rdo:
+                rdo.append(device)
+
+        return rdo if len(rdo) > 0 else list(pool_devices)
+
+class PipelineResidencyManager(threading.Thread):
+    """
+    Background thread that keeps the pipelines resident while requests keep arriving and evicts them:
+    - after AIG_MODEL_IDLE_TIMEOUT seconds without use,
+    - under host memory pressure, when MemAvailable drops below AIG_MIN_AVAILABLE_MEMORY_MB (least recently used first).
+    Nothing is evicted when AIG_KEEP_MODEL_IN_MEMORY=true. Evicted pipelines are loaded again on the next request.
+    """
+    def __init__(self, slots: list):
+        super().__init__(name="PipelineResidencyManager", daemon=True)
+        self.slots = slots
+        keep_in_memory = AigServerMetadata.should_keep_model_in_memory()
+        self.idle_timeout = 0 if keep_in_memory else AigServerMetadata.get_model_idle_timeout()
+        self.min_available_bytes = 0 if keep_in_memory else AigServerMetadata.get_min_available_memory()
+        self.idle_evictions = 0
+        self.pressure_evictions = 0
+        self.last_available_bytes = None
+
+    @staticmethod
+    def get_available_memory() -> int:
+        """
+        Returns MemAvailable (bytes) from /proc/meminfo or None when it cannot be read.
+        """
+        try:
+            with open('/proc/meminfo') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def check_interval(self) -> float:
+        if self.idle_timeout > 0:
+            return min(30.0, max(1.0, self.idle_timeout / 4))
+        return 30.0
+
+    def run(self):
+        logger.info(f"[AIG] Pipeline residency manager started (idle timeout: {self.idle_timeout}s, "
+                    f"minimum available memory: {self.min_available_bytes // (1024 * 1024)} MB)")
+        while True:
+            time.sleep(self.check_interval())
+            try:
+                self.evict_idle()
+                self.evict_under_pressure()
+            except Exception as e:
+                logger.error(f"[AIG] Pipeline residency manager. Exception: {e}")
+
+    def evict_idle(self):
+        if self.idle_timeout <= 0:
+            return
+        for slot in self.slots:
+            if slot.is_loaded() and not slot.in_use and slot.idle_time() > self.idle_timeout:
+                if slot.unload(reason=f"idle for {slot.idle_time():.0f}s"):
+                    self.idle_evictions += 1
+
+    def evict_under_pressure(self):
+        if self.min_available_bytes <= 0:
+            return
+        self.last_available_bytes = PipelineResidencyManager.get_available_memory()
+        if self.last_available_bytes is None:
+            return
+
+        candidates = sorted((slot for slot in self.slots if slot.is_loaded() and not slot.in_use),
+                            key=lambda slot: slot.last_used or 0)
+        for slot in candidates:
+            if self.last_available_bytes >= self.min_available_bytes:
+                break
+            if slot.unload(reason=f"memory pressure, {self.last_available_bytes // (1024 * 1024)} MB available"):
+                self.pressure_evictions += 1
+                self.last_available_bytes = PipelineResidencyManager.get_available_memory() or self.last_available_bytes
+
+    def stats(self) -> dict:
+        return {
+            "idle_timeout": self.idle_timeout,
+            "min_available_bytes": self.min_available_bytes,
+            "available_bytes": self.last_available_bytes,
+            "loaded": sum(1 for slot in self.slots if slot.is_loaded()),
+            "loads": sum(slot.loads for slot in self.slots),
+            "evictions": sum(slot.evictions for slot in self.slots),
+            "idle_evictions": self.idle_evictions,
+            "pressure_evictions": self.pressure_evictions
+        }
@@ -0,0 +1,482 @@
+import math
+import queue
+import itertools
+import threading
+import time
+import uuid
+from PIL import Image
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+#AIGServer Environment
+from database.version import AigServerMetadata
+from inference.img_cache import T2IImageCache
+from inference.pipeline_pool import PipelineSlot, PipelinePool, PipelineResidencyManager
+
+class T2IQueueFullError(Exception):
+    """
+    Raised when a generation job cannot be admitted because the device queue is full.
+    retry_after is the estimated number of seconds until a slot is available.
+    """
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class T2IJob:
+    """
+    Text-to-image generation job processed by a T2IWorker.
+    Lower priority values are served first; equal priorities are served in arrival order.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, description: str, device: str, width: int, height: int,
+                 num_inference_steps: int = 4, priority: int = 0, seed: int = None, payload: dict = None):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.device = str(device).upper()
+        self.requested_device = self.device
+        self.tried_devices = [] # Devices where the generation failed (for the fallback chain)
+        self.width = width
+        self.height = height
+        self.num_inference_steps = num_inference_steps
+        self.priority = priority
+        self.seed = seed
+        self.cache_key = T2IImageCache.make_key(description, width, height, num_inference_steps, seed, self.device)
+        self.cached = False
+        self.payload = payload # Request payload with the add-ons to apply once the image is generated
+        self.status = T2IJob.PENDING
+        self.cancelled = False
+        self.step = 0
+        self.image = None # Raw generated image (PIL), before any add-on is applied
+        self.result_bytes = None # Encoded image with add-ons, computed once on first read
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+        self._done = threading.Event()
+        self._progress = threading.Condition()
+
+    def route_to(self, device: str):
+        """
+        Assign the job to the pool device that will generate it. The cache key follows the device.
+        """
+        if device != self.device:
+            self.device = device
+            self.cache_key = T2IImageCache.make_key(self.description, self.width, self.height,
+                                                    self.num_inference_steps, self.seed, device)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Block until the job is finished. It returns False when the timeout expires first.
+        """
+        return self._done.wait(timeout)
+
+    def is_finished(self) -> bool:
+        return self._done.is_set()
+
+    def wait_progress(self, last_step: int = None, timeout: float = None) -> bool:
+        """
+        Block until the job moves past last_step or finishes. It returns True when the job is finished.
+        """
+        with self._progress:
+            if not self._done.is_set() and self.step == last_step:
+                self._progress.wait(timeout)
+        return self._done.is_set()
+
+    def on_step(self, step: int, num_steps: int, latent) -> bool:
+        """
+        Text2ImagePipeline callback, invoked after each diffusion step.
+        Returning False lets the pipeline continue.
+        """
+        with self._progress:
+            self.step = step + 1
+            self._progress.notify_all()
+        return False
+
+    def cancel(self) -> bool:
+        """
+        Cancel the job. A pending job is finished right away; a running one stops at the next diffusion step,
+        unless it shares the generation with jobs that are not cancelled. It returns False when the job is already finished.
+        """
+        if self.is_finished():
+            return False
+        self.cancelled = True
+        if self.status == T2IJob.PENDING:
+            self.finish(error="Cancelled")
+        return True
+
+    def finish(self, image: Image.Image = None, error: str = None):
+        with self._progress:
+            if self._done.is_set(): # Cancelled while it was being generated
+                return
+            self.image = image
+            self.error = error
+            if self.cancelled and image is None:
+                self.status = T2IJob.CANCELLED
+            else:
+                self.status = T2IJob.DONE if image is not None else T2IJob.FAILED
+            self.finished_at = time.time()
+            self._done.set()
+            self._progress.notify_all()
+
+class T2IDeviceQueue:
+    """
+    Bounded priority queue of one device, drained by one worker per pipeline slot of the device.
+    """
+    def __init__(self, device: str, slots: list, jobqueue):
+        self.device = device
+        self.jobs = queue.PriorityQueue(maxsize=AigServerMetadata.get_job_queue_size())
+        self.slots = slots
+        self.workers = [T2IWorker(self, slot, jobqueue) for slot in slots]
+        self.job_time = None # Exponential moving average of the job time (seconds)
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def busy_workers(self) -> int:
+        return sum(1 for worker in self.workers if len(worker.current_batch) > 0)
+
+    def record_job_time(self, seconds: float):
+        with self._lock:
+            self.job_time = seconds if self.job_time is None else (0.8 * self.job_time + 0.2 * seconds)
+
+    def estimated_wait(self, default_job_time: float) -> float:
+        """
+        Estimated seconds until a new job on this device is finished, from the queue depth and the measured latency.
+        """
+        job_time = self.job_time if self.job_time is not None else default_job_time
+        return job_time * (self.jobs.qsize() + self.busy_workers() + 1) / len(self.workers)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.jobs.qsize(),
+            "capacity": self.jobs.maxsize,
+            "workers": len(self.workers),
+            "busy": self.busy_workers(),
+            "avg_job_time": self.job_time,
+            "failures": self.failures,
+            "slots": [slot.stats() for slot in self.slots]
+        }
+
+class T2IWorker(threading.Thread):
+    """
+    Dedicated inference thread. It owns one pipeline slot,
+    so generate() is never called concurrently on the same pipeline.
+    Jobs arriving within the batching window are merged into as few generate() calls as possible.
+    """
+    max_retries = 3
+
+    def __init__(self, device_queue: T2IDeviceQueue, slot: PipelineSlot, jobqueue):
+        super().__init__(name=f"T2IWorker-{slot.name}", daemon=True)
+        self.device = device_queue.device
+        self.device_queue = device_queue
+        self.jobs = device_queue.jobs
+        self.slot = slot
+        self.jobqueue = jobqueue
+        self.current_batch = []
+
+    def run(self):
+        logger.info(f"[AIG] Inference worker started for {self.slot.name}")
+        if AigServerMetadata.is_warmup_enabled():
+            self.warmup()
+        while True:
+            _, _, job = self.jobs.get()
+            batch = self.collect_batch(job)
+            try:
+                self.current_batch = batch
+                self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"[AIG] Inference worker ({self.slot.name}). Exception: {e}")
+                self.device_queue.failures += 1
+                for job in batch:
+                    if not job.is_finished():
+                        self.jobqueue.fallback(job, str(e))
+            finally:
+                self.current_batch = []
+                for _ in batch:
+                    self.jobs.task_done()
+
+    def warmup(self):
+        """
+        Load the pipeline of the slot and run a throwaway 1-step generation, so the compilation
+        and the first-inference overhead are paid before the server reports readiness.
+        """
+        start_time = time.time()
+        try:
+            pipe = self.slot.get()
+            pipe.generate("warm-up", width=AigServerMetadata.get_img_width(), height=AigServerMetadata.get_img_height(),
+                          num_inference_steps=1, guidance_scale=0.0)
+            del pipe
+            self.slot.warmup_time = time.time() - start_time
+            logger.info(f"[AIG] Pipeline {self.slot.name} warmed up in {self.slot.warmup_time:.2f}s (load {self.slot.load_time:.2f}s)")
+        except Exception as e:
+            self.slot.warmup_error = str(e)
+            logger.error(f"[AIG] Warm-up of pipeline {self.slot.name} failed: {e}")
+        finally:
+            self.slot.release()
+            self.jobqueue.warmup_done()
+
+    def collect_batch(self, first_job: T2IJob) -> list:
+        """
+        Gather up to AIG_BATCH_MAX_SIZE jobs, waiting at most AIG_BATCH_MAX_WAIT_MS after the first one.
+        """
+        batch = [first_job]
+        max_size = AigServerMetadata.get_batch_max_size()
+        deadline = time.time() + AigServerMetadata.get_batch_max_wait()
+        while len(batch) < max_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    _, _, job = self.jobs.get(timeout=remaining)
+                else:
+                    _, _, job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(job)
+        return batch
+
+    @staticmethod
+    def group_batch(batch: list) -> list:
+        """
+        Group the jobs sharing the same generation parameters, keeping the arrival order of the groups.
+        """
+        groups = {}
+        for job in batch:
+            key = (job.description, job.width, job.height, job.num_inference_steps, job.seed)
+            groups.setdefault(key, []).append(job)
+        return list(groups.values())
+
+    def process_batch(self, batch: list):
+        batch = [job for job in batch if not job.is_finished()] # Cancelled while queued
+        if len(batch) == 0:
+            return
+        started_at = time.time()
+        for job in batch:
+            job.status = T2IJob.RUNNING
+            job.started_at = started_at
+
+        # The pipeline stays resident; the residency manager evicts it once idle or under memory pressure
+        pipe = self.slot.get()
+        try:
+            for group in T2IWorker.group_batch(batch):
+                self.generate_group(pipe, group)
+        finally:
+            del pipe
+            self.slot.release()
+
+        self.device_queue.record_job_time((time.time() - started_at) / len(batch))
+
+    def generate_group(self, pipe, group: list):
+        """
+        Run one generate() call for a group of jobs with identical parameters.
+        Without a seed, each job gets its own image (num_images_per_prompt); with a seed,
+        the output is deterministic, so a single image is generated and shared.
+        """
+        job = group[0]
+        num_images = len(group) if job.seed is None else 1
+        generation_config = {}
+        if job.seed is not None:
+            generation_config['rng_seed'] = job.seed
+
+        def on_step(step, num_steps, latent):
+            for member in group:
+                member.on_step(step, num_steps, latent)
+            return all(member.cancelled for member in group) # True stops the generation
+
+        image_tensor = None
+        counter = 0
+        while counter < T2IWorker.max_retries and not all(member.cancelled for member in group):
+            try:
+                # guidance_scale=0.0 intentionally disables classifier-free guidance for this turbo/OpenVINO-optimized model
+                image_tensor = pipe.generate(job.description, width=job.width, height=job.height,
+                                             num_inference_steps=job.num_inference_steps, guidance_scale=0.0, num_images_per_prompt=num_images,
+                                             callback=on_step, **generation_config)
+                if image_tensor is not None and len(image_tensor.data) >= num_images:
+                    break
+                image_tensor = None
+                counter += 1
+            except Exception as e:
+                logger.warning(f"[AIG] Image Generation attempt {counter + 1} failed on {self.slot.name}: {e}")
+                image_tensor = None
+                counter += 1
+
+        if all(member.cancelled for member in group):
+            logger.info(f"[AIG] Generation of {len(group)} cancelled job(s) stopped on {self.slot.name}")
+            for member in group:
+                member.finish(error="Cancelled")
+            return
+
+        if image_tensor is None:
+            self.device_queue.failures += 1
+            for member in group:
+                self.jobqueue.fallback(member, "Image Generation. Service is busy.")
+            return
+
+        if len(group) > 1:
+            logger.info(f"[AIG] Batched {len(group)} requests into one generation ({num_images} images) on {self.slot.name}")
+
+        for index, member in enumerate(group):
+            image = Image.fromarray(image_tensor.data[index if num_images > 1 else 0])
+            if index == 0:
+                T2IImageCache().put(member.cache_key, image)
+            member.finish(image=image if index == 0 or num_images > 1 else image.copy())
+
+class T2IJobQueue:
+    """
+    Front-end of the pipeline pool: one bounded priority queue per pool device, each one drained
+    by a worker per pipeline slot. Jobs are routed to the candidate device (requested device and
+    fallback chain) with the lowest estimated wait, and re-routed along the chain when a device fails.
+    Admission control rejects new jobs as soon as every candidate queue is full.
+    """
+    def __new__(cls):
+        """Singleton pattern to ensure only one instance of T2IJobQueue exists."""
+        if not hasattr(cls, 'instance'):
+            cls.instance = super(T2IJobQueue, cls).__new__(cls)
+        return cls.instance
+
+    def __init__(self):
+        # It avoids re-initialization of the instance for the singleton pattern
+        if not hasattr(self, '_queues'):
+            self._jobs = {} # Tracked jobs (asynchronous API), kept until their result expires
+            self._lock = threading.Lock()
+            self._sequence = itertools.count()
+            self.rejected = 0
+            self.rerouted = 0
+            self.created_at = time.time()
+            self._queues = {}
+            for device, slots in PipelinePool.create_slots().items():
+                self._queues[device] = T2IDeviceQueue(device, slots, self)
+            # Readiness: every worker warms up its pipeline before the pool is reported as ready
+            self._warmup_pending = sum(len(device_queue.workers) for device_queue in self._queues.values()) \
+                if AigServerMetadata.is_warmup_enabled() else 0
+            self.ready_at = None if self._warmup_pending > 0 else self.created_at
+            for device_queue in self._queues.values():
+                device_queue.start()
+            self.residency = PipelineResidencyManager([slot for device_queue in self._queues.values() for slot in device_queue.slots])
+            self.residency.start()
+
+    def _default_job_time(self) -> float:
+        """
+        Latency assumed for devices without measurements: the slowest measured device (or 5 s).
+        """
+        measured = [device_queue.job_time for device_queue in self._queues.values() if device_queue.job_time is not None]
+        return max(measured) if len(measured) > 0 else 5.0
+
+    def _enqueue(self, job: T2IJob, candidates: list) -> bool:
+        """
+        Put the job in the candidate queue with the lowest estimated wait. It returns False when all of them are full.
+        """
+        default_job_time = self._default_job_time()
+        ranked = sorted(candidates, key=lambda device: self._queues[device].estimated_wait(default_job_time))
+        for device in ranked:
+            try:
+                job.route_to(device)
+                self._queues[device].jobs.put_nowait((job.priority, next(self._sequence), job))
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def submit(self, job: T2IJob, track: bool = False) -> T2IJob:
+        """
+        Enqueue the job in the pool. It raises T2IQueueFullError when every candidate queue is full.
+        Jobs whose image is already cached are finished right away, without being queued.
+        Tracked jobs can be recovered later with get_job() until their result expires.
+        """
+        image = T2IImageCache().get(job.cache_key)
+        if image is not None:
+            job.cached = True
+            job.started_at = time.time()
+            job.step = job.num_inference_steps
+            job.finish(image=image)
+        else:
+            candidates = PipelinePool.candidates(job.requested_device, list(self._queues.keys()))
+            if not self._enqueue(job, candidates):
+                self.rejected += 1
+                raise T2IQueueFullError(f"Image Generation. The queues of {', '.join(candidates)} are full.",
+                                        self.retry_after(job.requested_device))
+        if track:
+            with self._lock:
+                self._purge_expired_jobs()
+                self._jobs[job.id] = job
+        return job
+
+    def fallback(self, job: T2IJob, error: str):
+        """
+        Re-route a job whose generation failed to the next device of its fallback chain.
+        The job fails when no other device is left or all their queues are full.
+        """
+        if job.cancelled:
+            job.finish(error="Cancelled")
+            return
+        job.tried_devices.append(job.device)
+        candidates = [device for device in PipelinePool.candidates(job.requested_device, list(self._queues.keys()))
+                      if device not in job.tried_devices]
+        if len(candidates) > 0:
+            job.status = T2IJob.PENDING
+            job.step = 0
+            if self._enqueue(job, candidates):
+                self.rerouted += 1
+                logger.warning(f"[AIG] Job {job.id} failed on {job.tried_devices[-1]}, re-routed to {job.device}")
+                return
+        job.finish(error=error)
+
+    def warmup_done(self):
+        with self._lock:
+            self._warmup_pending -= 1
+            if self._warmup_pending == 0:
+                self.ready_at = time.time()
+                logger.info(f"[AIG] Pipeline pool ready, warm-up took {self.ready_at - self.created_at:.2f}s")
+
+    def is_ready(self) -> bool:
+        return self.ready_at is not None
+
+    def readiness(self) -> dict:
+        return {
+            "ready": self.is_ready(),
+            "warmup_enabled": AigServerMetadata.is_warmup_enabled(),
+            "warmup_time": (self.ready_at - self.created_at) if self.ready_at is not None else None,
+            "ov_cache_dir": AigServerMetadata.get_ov_cache_dir(),
+            "slots": [slot.stats() for device_queue in self._queues.values() for slot in device_queue.slots]
+        }
+
+    def get_job(self, job_id: str) -> T2IJob:
+        with self._lock:
+            self._purge_expired_jobs()
+            return self._jobs.get(job_id)
+
+    def _purge_expired_jobs(self):
+        """
+        Forget the finished jobs older than the result TTL. The caller must hold the lock.
+        """
+        expiration = time.time() - AigServerMetadata.get_job_result_ttl()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < expiration]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def retry_after(self, device: str) -> int:
+        """
+        Estimated seconds until one of the candidate devices can accept a new job.
+        """
+        candidates = PipelinePool.candidates(device, list(self._queues.keys()))
+        default_job_time = self._default_job_time()
+        wait = min(self._queues[candidate].estimated_wait(default_job_time) for candidate in candidates)
+        return max(1, int(math.ceil(wait)))
+
+    def stats(self) -> dict:
+        return {
+            "rejected": self.rejected,
+            "rerouted": self.rerouted,
+            "tracked_jobs": len(self._jobs),
+            "residency": self.residency.stats(),
+            "devices": {device: device_queue.stats() for device, device_queue in self._queues.items()}
+        }
@@ -1,3 +1,7 @@
+import os
+import gc
+import time
+import threading
 # Flask
 from flask import Flask
 # API
@@ -5,6 +9,7 @@ from server.apis import api
 from database.version import Version_sch
 # Dependencies
 from database.version import AigServerMetadata
+from inference.t2i_queue import T2IJobQueue
 # Logging
 from datetime import datetime
 import logging
@@ -19,6 +24,24 @@ class AigServer:
         api.init_app(self.app) # Initializing APIs in App
         logger.info(f"API initialized")
 
+    @staticmethod
+    def collect_garbage_periodically(interval: float):
+        """
+        Scheduled garbage collection, so the requests do not pay a full gc.collect() each.
+        """
+        while True:
+            time.sleep(interval)
+            start_time = time.time()
+            collected = gc.collect()
+            logger.debug(f"Scheduled garbage collection: {collected} objects in {time.time() - start_time:.3f}s")
+
     def run(self, hostname : str = "0.0.0.0", pport : int = AigServerMetadata.get_rest_server_port(), pdebug : bool = False): # nosec B104
+        # The debug reloader runs this code in a watcher process too; the pipelines are only warmed up in the serving one
+        if AigServerMetadata.is_warmup_enabled() and (not pdebug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+            logger.info("Warming up the Text2Image pipeline pool")
+            T2IJobQueue() # Workers load their pipelines and run a throwaway generation before serving jobs
+        if AigServerMetadata.get_gc_interval() > 0:
+            threading.Thread(target=AigServer.collect_garbage_periodically, args=(AigServerMetadata.get_gc_interval(),),
+                             name="ScheduledGC", daemon=True).start()
         return self.app.run(host= hostname, port=pport, debug=pdebug)
     
\ No newline at end of file
@@ -1,11 +1,9 @@
 import io
 import os
-import gc
+import json
 #Flask API
-from flask import send_file
+from flask import send_file, request, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields
-# GenAI
-import openvino_genai
 from PIL import Image
 #Logging
 import time
@@ -27,7 +25,9 @@ if not logger.handlers:
 
 #AIGServer Environment
 from database.version import AigServerMetadata
-from imgproc.img_frame import ImgDecorator
+from imgproc.img_frame import DecorationPlan
+from inference.t2i_queue import T2IJob, T2IJobQueue, T2IQueueFullError
+from inference.img_cache import T2IImageCache
 
 
 api = Namespace('AIG - Inference with Added-Value Services', description='Advertise Image Generation')
@@ -92,6 +92,8 @@ minf_request_scg_frame = api.model('ModelInference_BasicRequest_Frame', {
 minf_request_sch = api.model('ModelInference_BasicRequest', {
     'description': fields.String(required=True, default=None, description="The text description to generate the image.", example="A 35mm photo with bananas, 8k"),
     'device': fields.String(required=True, default='CPU', description="The device for inferencing [CPU|GPU|NPU].", example="CPU", enum=['CPU', 'GPU', 'NPU']),
+    'priority': fields.Integer(required=False, default=0, description="Queue priority of the request. Lower values are generated first.", example=0),
+    'seed': fields.Integer(required=False, default=None, description="Random seed of the generation. Requests with the same description and seed return the same (cached) image.", example=42),
     'price_details': fields.Nested(minf_request_sch_price, required=False, description="It contains the details of the price to be shown in the image.", example={
         'price': "0.5 $/lb",
         'align': "center",
@@ -181,11 +183,62 @@ class Minf_request_scg_frame(object):
 class Minf_request_sch(object):
     description:str=None # Text description to generate the image
     device:str='GPU'
+    priority:int=0
+    seed:int=None
     price_details:Minf_request_sch_price=None
     promo_details:Minf_request_sch_promo=None
     slogan_details:Minf_request_scg_slogan=None
     frame_details:Minf_request_sch_frame=None
-    
+
+minf_job_sch = api.model('ModelInference_Job', {
+    'job_id': fields.String(required=True, description="The job ID used to poll the status and fetch the image.", example="4f7c0e0a9b2d4a53a1f8f2d7e1c3b6a9"),
+    'status': fields.String(required=True, description="Job status (pending, running, done, failed, cancelled).", example="pending", enum=[T2IJob.PENDING, T2IJob.RUNNING, T2IJob.DONE, T2IJob.FAILED, T2IJob.CANCELLED]),
+    'step': fields.Integer(required=False, description="Last diffusion step completed.", example=2),
+    'num_steps': fields.Integer(required=False, description="Number of diffusion steps of the job.", example=4),
+    'device': fields.String(required=False, description="Device serving the job (the requested one or a fallback of the pool).", example="GPU"),
+    'error': fields.String(required=False, description="Error message when the job failed.", example=None)
+})
+
+class Minf_job_sch(object):
+    job_id:str=None
+    status:str=None
+    step:int=0
+    num_steps:int=0
+    device:str=None
+    error:str=None
+
+def decoration_plan(data: dict) -> DecorationPlan:
+    """
+    Add-ons (price, promo, frame, logo and slogan) requested in the payload, ready to be drawn over the generated image.
+    """
+    logo = AigServerMetadata().get_logo() if data.get('logo_details') is not None else None
+    return DecorationPlan(data, logo=logo)
+
+def render_job(job: T2IJob) -> bytes:
+    """
+    Applies the add-ons of the job payload to the generated image and encodes it as JPEG.
+    The result is computed once and kept in the job, so later reads are served from memory.
+    """
+    with job.lock:
+        if job.result_bytes is None and job.image is not None:
+            job.result_bytes = decoration_plan(job.payload or {}).render(job.image, format='JPEG')
+        return job.result_bytes
+
+def job_status(job: T2IJob) -> dict:
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'step': job.step,
+        'num_steps': job.num_inference_steps,
+        'device': job.device,
+        'error': job.error
+    }
+
+def new_job(data: dict) -> T2IJob:
+    return T2IJob(description=data.get('description'), device=data.get('device', 'GPU'),
+                  width=AigServerMetadata.get_img_width(), height=AigServerMetadata.get_img_height(),
+                  priority=int(data.get('priority', 0) or 0), seed=data.get('seed'), payload=data)
+
 @api.route('/minf/',
            doc={"description":"It returns an image based on a text description with the requested add-ons (when applicable).",
                 "produces": ['image/jpeg']
@@ -196,7 +249,6 @@ class ModelInference_Img(Resource):
     @api.response(503, 'Accepted but server is busy with other requests')    
     @api.expect(minf_request_sch, validate=True, description="It expects the text description to generate the image and an optional offer to put over the message as a banner.")
     def post(self):
-        list=[]
         data = api.payload # 
         errorMessage=None
 
@@ -205,216 +257,183 @@ class ModelInference_Img(Resource):
             logger.error(errorMessage)
             return errorMessage, 500
         
+        start_time = time.time()
+        job = new_job(data)
         try:
-            start_time = time.time()
-            # Model
-            model = AigServerMetadata.get_t2i_model_path() # Model Path only
-            description = data.get('description')
-            device = data.get('device', 'GPU')
-
-            pipe = None
-            if str(device).upper() == AigServerMetadata.get_t2i_model_device():
-                # Use the preloaded model if the device matches
-                pipe = AigServerMetadata().get_preloaded_model()
-
-            if pipe is None:
-                pipe = openvino_genai.Text2ImagePipeline(model, device)
-                       
-            image_tensor = None
-            max_retries = 3
-            counter = 0
-            while counter < max_retries:
-                try:
-                    # guidance_scale=0.0 intentionally disables classifier-free guidance for this turbo/OpenVINO-optimized model
-                    image_tensor = pipe.generate(description, width=AigServerMetadata.get_img_width(), height=AigServerMetadata.get_img_height(), 
-                                                    num_inference_steps=4, guidance_scale=0.0, num_images_per_prompt=1)
-                    if image_tensor is not None and len(image_tensor.data) > 0:
-                        counter = max_retries  # Exit loop if image generation is successful
-                except Exception as e:
-                    image_tensor = None
-                    counter += 1
-
-            if image_tensor is None:
-                errorMessage=f"Image Generation. Service is busy."
+            T2IJobQueue().submit(job)
+        except T2IQueueFullError as e:
+            errorMessage=f"{str(e)} Retry in {e.retry_after}s."
+            logger.warning(errorMessage)
+            return errorMessage, 503, {'Retry-After': str(e.retry_after)}
+
+        try:
+            if not job.wait(AigServerMetadata.get_job_timeout()):
+                # Nobody reads the answer anymore: a queued job leaves the queue and a running one stops at the next step
+                job.cancel()
+                errorMessage=f"Image Generation. Timed out waiting for the inference worker."
                 logger.error(errorMessage)
-                return errorMessage, 503
+                return errorMessage, 503, {'Retry-After': str(T2IJobQueue().retry_after(job.requested_device))}
 
-            image = Image.fromarray(image_tensor.data[0])
+            if job.image is None:
+                errorMessage=job.error if job.error else f"Image Generation. Service is busy."
+                logger.error(errorMessage)
+                return errorMessage, 503
 
-            if image is None or not isinstance(image, Image.Image):
+            if not isinstance(job.image, Image.Image):
                 errorMessage=f"Image Generation. The generated image is not valid."
                 logger.error(errorMessage)
                 return errorMessage, 500
 
-            # Price details
-            price_details = data.get('price_details')            
-            img_postprice = None
-            if price_details is not None:
-                price:str=price_details.get('price', "")
-                align:str=price_details.get('align',"center")
-                valign:str=price_details.get('valign',"bottom")
-                marperc_from_border:float=float(price_details.get('marperc_from_border',2.0))
-                font_size:int=int(price_details.get('font_size',20))
-                line_width:int=int(price_details.get('line_width',20))
-                price_color:str=price_details.get('price_color',"white")            
-                
-                if ImgDecorator.is_color_valid(price_color) is False:
-                    price_color="white" # Default color if the provided one is not valid
-                    
-                price_in_circle:bool=price_details.get('price_in_circle',False)
-                
-                price_circle_color:str=price_details.get('price_circle_color',"black")                
-                if ImgDecorator.is_color_valid(price_circle_color) is False:
-                    price_circle_color="black"
-
-                if price_in_circle:
-                    # Draw the price circle
-                    img_postprice = ImgDecorator.draw_price_circle(image, 
-                            price= price, price_color=price_color,
-                            circle_color=price_circle_color,                             
-                            align=align, valign=valign,                             
-                            margin_percentage=marperc_from_border, 
-                            font_size=font_size, line_width=line_width)
-                else:
-                    img_postprice = ImgDecorator.draw_price_circle(image, 
-                                price= price, align=align, valign=valign, 
-                                margin_percentage=marperc_from_border, font_size=font_size,
-                                line_width=line_width, price_color=price_color)    
-            else:
-                img_postprice = image
-
-            # Promo details (Rounded Rectangle)
-            promo_details = data.get('promo_details')
-            img_postpromo = None
-            if promo_details is not None:
-                promo_text:str=promo_details.get('promo_text', "")
-                text_color:str=promo_details.get('text_color',"white")
-                
-                if ImgDecorator.is_color_valid(text_color) is False:
-                    text_color="white"
-
-                rect_color:str=promo_details.get('rect_color',"black")
-                if ImgDecorator.is_color_valid(rect_color) is False:
-                    rect_color="black"
-
-                rect_padding:int=int(promo_details.get('rect_padding',10))
-                rect_radius:int=int(promo_details.get('rect_radius',20))
-                align:str=promo_details.get('align',"center")
-                valign:str=promo_details.get('valign',"bottom")
-                marperc_from_border:float=float(promo_details.get('marperc_from_border',2.0))
-                font_size:int=int(promo_details.get('font_size',20))
-                line_width:int=int(promo_details.get('line_width',20))
-
-                img_postpromo = ImgDecorator.draw_promo_rounded_rect(img_postprice, 
-                            text=promo_text, text_color=text_color, rect_color=rect_color,
-                            align=align, valign=valign,
-                            margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width,
-                            rect_padding=rect_padding, rect_radius=rect_radius)
-            else:
-                img_postpromo = img_postprice
-
-            # Frame
-            frame_details=data.get('framed_details')
-            img_postframe = None
-            if frame_details is not None:
-                framed:bool=bool(frame_details.get('activate',False))
-                marperc_from_border:float=float(frame_details.get('marperc_from_border',2.0))
-                
-                if framed:
-                    img_postframe = ImgDecorator.draw_frame_double_border(img_postpromo,
-                                                                        percentageFromBorder=marperc_from_border)
-                else:
-                    img_postframe = img_postpromo
-            else:
-                img_postframe = img_postpromo
-
-            # Logo
-            logo_details = data.get('logo_details')
-            img_postlogo = None
-            if logo_details is not None:
-                aig_server=AigServerMetadata()
-                logo = aig_server.get_logo()
-                if logo is not None:
-                    align:str=logo_details.get('align',"left")
-                    valign:str=logo_details.get('valign',"top")
-                    logo_percentage:float=float(logo_details.get('logo_percentage',15.0))
-                    margin_px:int=int(logo_details.get('margin_px',10))
-
-                    img_postlogo = ImgDecorator.draw_logo(img_postframe, logo_img=logo,
-                                align=align, valign=valign, 
-                                logo_percentage=logo_percentage, margin_px=margin_px)
-                else:
-                    img_postlogo = img_postframe
-            else:
-                img_postlogo = img_postframe
-
-            # Slogan
-            slogan_details = data.get('slogan_details')
-            img_postslogan = None
-            if slogan_details is not None:
-                slogan_text:str=slogan_details.get('slogan_text', "")
-                text_color:str=slogan_details.get('text_color',"white")
-                if ImgDecorator.is_color_valid(text_color) is False:
-                    text_color="white"
-
-                align:str=slogan_details.get('align',"center")
-                valign:str=slogan_details.get('valign',"bottom")
-                marperc_from_border:float=float(slogan_details.get('marperc_from_border',2.0))
-                font_size:int=int(slogan_details.get('font_size',20))
-                line_width:int=int(slogan_details.get('line_width',20))
-
-                img_postslogan = ImgDecorator.draw_slogan(img_postlogo, 
-                            text=slogan_text, text_color=text_color,
-                            align=align, valign=valign,
-                            margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width)
-            else:
-                img_postslogan = img_postlogo
-
-            # Save the updated image to a BytesIO object
-            img_io = io.BytesIO()
-            img_postslogan.save(img_io, format='JPEG')  # or 'PNG'
-            img_io.seek(0)              
+            img_bytes = render_job(job)
             end_time = time.time()
-            
-            # Clean up memory - unload model if configured to do so
-            if not AigServerMetadata.should_keep_model_in_memory():
-                if pipe == AigServerMetadata().get_preloaded_model():
-                    # Only unload if using the singleton model
-                    AigServerMetadata().unload_model()
-                    logger.info(f"Image Generation. Processed in {end_time - start_time}s, model unloaded")
-                else:
-                    # Clean up temporary model instance
-                    del pipe
-                    gc.collect()
-                    logger.info(f"Image Generation. Processed in {end_time - start_time}s, temp model cleaned")
+            if job.cached:
+                logger.info(f"Image Generation. Processed in {end_time - start_time}s (cached image)")
             else:
-                logger.info(f"Image Generation. Processed in {end_time - start_time}s, model kept in memory")
-            
-            # Clean up intermediate objects
-            del image_tensor
-            del image
-            del img_postprice
-            del img_postpromo
-            del img_postframe
-            del img_postlogo
-            del img_postslogan
-            gc.collect()
+                logger.info(f"Image Generation. Processed in {end_time - start_time}s (queued {job.started_at - job.created_at:.2f}s, generated {job.finished_at - job.started_at:.2f}s)")
+
+            job.image = None # The encoded result is kept; the raw image is not needed anymore
             
             #Do not incorporate ,200 at the end because it is understod as a JSON by default (and not an image stream)
-            return send_file(img_io, mimetype='image/jpeg')
+            return send_file(io.BytesIO(img_bytes), mimetype='image/jpeg')
         except Exception as e:
             errorMessage=f"Image Generation. Exception: {str(e)}"
             logger.error(errorMessage)
-            # Clean up on error
-            if 'pipe' in locals() and pipe is not None:
-                if not AigServerMetadata.should_keep_model_in_memory():
-                    if pipe == AigServerMetadata().get_preloaded_model():
-                        AigServerMetadata().unload_model()
-                    else:
-                        del pipe
-                    gc.collect()
-        
+
         if errorMessage is not None:           
             return errorMessage, 500
                         
         return "Nothing", 200
+
+@api.route('/minf/jobs',
+           doc={"description":"It queues an image generation based on a text description with the requested add-ons (when applicable) and returns the job ID immediately."})
+class ModelInference_JobSubmit(Resource):
+    @api.response(202, 'Accepted. The job ID is returned.')
+    @api.response(500, 'Accepted but it could not be processed/recovered')    
+    @api.response(503, 'Server is busy with other requests. Retry after the Retry-After header seconds.')    
+    @api.expect(minf_request_sch, validate=True, description="It expects the text description to generate the image and an optional offer to put over the message as a banner.")
+    @api.marshal_with(minf_job_sch, description='Job details.')
+    def post(self):
+        data = api.payload #
+
+        if data.get('device') not in ['CPU', 'GPU', 'NPU']:
+            errorMessage="Device not supported. Only CPU, GPU and NPU are supported."
+            logger.error(errorMessage)
+            return {'status': T2IJob.FAILED, 'error': errorMessage}, 500
+
+        job = new_job(data)
+        try:
+            T2IJobQueue().submit(job, track=True)
+        except T2IQueueFullError as e:
+            logger.warning(f"{str(e)} Retry in {e.retry_after}s.")
+            return {'status': T2IJob.FAILED, 'error': str(e)}, 503, {'Retry-After': str(e.retry_after)}
+
+        return job_status(job), 202, {'Location': f"{request.path.rstrip('/')}/{job.id}/image"}
+
+@api.route('/minf/jobs/<string:job_id>',
+           doc={"description":"It returns the status and progress of the generation job."})
+@api.param('job_id', 'The job ID returned when the generation was submitted')
+class ModelInference_JobStatus(Resource):
+    @api.response(200, 'Success')
+    @api.response(404, 'Job not found or expired')
+    @api.marshal_with(minf_job_sch, description='Job details.')
+    def get(self, job_id):
+        job = T2IJobQueue().get_job(job_id)
+        if job is None:
+            return {'job_id': job_id, 'error': "Job not found or expired."}, 404
+
+        return job_status(job), 200
+
+    @api.response(200, 'Cancelled')
+    @api.response(404, 'Job not found or expired')
+    @api.response(409, 'The job is already finished')
+    @api.marshal_with(minf_job_sch, description='Job details.')
+    def delete(self, job_id):
+        job = T2IJobQueue().get_job(job_id)
+        if job is None:
+            return {'job_id': job_id, 'error': "Job not found or expired."}, 404
+
+        if not job.cancel():
+            return job_status(job), 409
+        logger.info(f"Image Generation. Job {job_id} cancelled ({job.status})")
+        return job_status(job), 200
+
+@api.route('/minf/jobs/<string:job_id>/image',
+           doc={"description":"It returns the generated image (JPEG) with the requested add-ons once the job is done.",
+                "produces": ['image/jpeg']})
+@api.param('job_id', 'The job ID returned when the generation was submitted')
+class ModelInference_JobResult(Resource):
+    @api.response(200, 'Success')
+    @api.response(202, 'The job is not finished yet')
+    @api.response(404, 'Job not found or expired')
+    @api.response(410, 'The job was cancelled')
+    @api.response(500, 'The job failed')
+    def get(self, job_id):
+        job = T2IJobQueue().get_job(job_id)
+        if job is None:
+            return {'job_id': job_id, 'error': "Job not found or expired."}, 404
+
+        if not job.is_finished():
+            return job_status(job), 202, {'Retry-After': '1'}
+
+        if job.status == T2IJob.CANCELLED:
+            return job_status(job), 410
+
+        if job.status == T2IJob.FAILED:
+            return job_status(job), 500
+
+        try:
+            img_bytes = render_job(job)
+        except Exception as e:
+            errorMessage=f"Image Generation. Exception: {str(e)}"
+            logger.error(errorMessage)
+            return {'job_id': job_id, 'status': T2IJob.FAILED, 'error': errorMessage}, 500
+
+        return send_file(io.BytesIO(img_bytes), mimetype='image/jpeg', download_name=f"{job_id}.jpg")
+
+@api.route('/minf/jobs/<string:job_id>/events',
+           doc={"description":"It streams the job progress (one event per diffusion step) as Server-Sent Events. The last event is 'done', 'failed' or 'cancelled'.",
+                "produces": ['text/event-stream']})
+@api.param('job_id', 'The job ID returned when the generation was submitted')
+class ModelInference_JobEvents(Resource):
+    @api.response(200, 'Success')
+    @api.response(404, 'Job not found or expired')
+    def get(self, job_id):
+        job = T2IJobQueue().get_job(job_id)
+        if job is None:
+            return {'job_id': job_id, 'error': "Job not found or expired."}, 404
+
+        image_url = f"{request.path.rsplit('/', 1)[0]}/image"
+
+        def events():
+            last_step = None
+            while True:
+                finished = job.wait_progress(last_step, timeout=15)
+                status = job_status(job)
+                if finished:
+                    event = job.status if job.status in (T2IJob.DONE, T2IJob.CANCELLED) else 'failed'
+                    if job.status == T2IJob.DONE:
+                        status['image_url'] = image_url
+                    yield f"event: {event}\ndata: {json.dumps(status)}\n\n"
+                    return
+                if status['step'] != last_step:
+                    last_step = status['step']
+                    yield f"event: progress\ndata: {json.dumps(status)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/minf/cache',
+           doc={"description":"It returns the hit/miss statistics of the generated-image cache."})
+class ModelInference_CacheStats(Resource):
+    @api.response(200, 'Success')
+    def get(self):
+        return T2IImageCache().stats(), 200
+
+@api.route('/minf/pool',
+           doc={"description":"It returns the state of the pipeline pool: queue depth, latency and loaded pipelines per device."})
+class ModelInference_PoolStats(Resource):
+    @api.response(200, 'Success')
+    def get(self):
+        return T2IJobQueue().stats(), 200
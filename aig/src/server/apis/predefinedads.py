@@ -1,7 +1,9 @@
 import io
 import os
+import json
+import uuid
 #Flask API
-from flask import send_file, request
+from flask import send_file, request, Response, stream_with_context
 from flask_restx import Namespace, Resource, fields
 from PIL import Image
 #Logging
@@ -10,7 +12,7 @@ import logging
 logger = logging.getLogger(__name__)
 #AseServer Environment
 from database.version import AseServerMetadata
-from imgproc.img_frame import ImgDecorator
+from imgproc.img_frame import DecorationPlan
 import base64
 
 api = Namespace('ASE - Advertise Searcher', description='It provides functionalities to define and search predefined ads.')
@@ -23,9 +25,15 @@ predef_ad_schema = api.model('PredefinedAd', {
     'source': fields.String(required=False, description='Source of the ad', example="Marketing Department"),
 })
 
+predef_ad_bulk_schema = api.model('PredefinedAdBulk', {
+    'ads': fields.List(fields.Nested(predef_ad_schema), required=True, description='Predefined ads to add or update (JPEG images).'),
+})
+
 predef_ad_query_schema = api.model('PredefinedAdQuery', {
     'query': fields.String(required=True, description='The query text to search for predefined ads', example="What is the ad most related to oranges?"),
-    'n_results': fields.Integer(required=True, default=1, description='Number of results to return', example=1)
+    'n_results': fields.Integer(required=True, default=1, description='Number of results to return', example=1),
+    'width': fields.Integer(required=False, description='Display width (pixels). When set, the closest pre-rendered variant is returned instead of the original image.', example=480),
+    'height': fields.Integer(required=False, description='Display height (pixels). When set, the closest pre-rendered variant is returned instead of the original image.', example=600)
 })
 
 ## Schemas
@@ -90,6 +98,8 @@ predef_request_sch = api.model('Predef_BasicRequest', {
     'query': fields.String(required=True, description='The query text to search for predefined ads', example="What is the ad most related to oranges?"),
     'n_results': fields.Integer(required=True, default=1, description='Number of results to return', example=1),
     'use_default_ad_onempty': fields.Boolean(required=True, default=True, description="It indicates whether the default ad should be returned when the query result is empty.", example="true"),
+    'width': fields.Integer(required=False, description="Display width (pixels). When set, the add-ons are drawn over the closest pre-rendered variant of the ad.", example=480),
+    'height': fields.Integer(required=False, description="Display height (pixels). When set, the add-ons are drawn over the closest pre-rendered variant of the ad.", example=600),
     'price_details': fields.Nested(predef_request_sch_price, required=False, description="It contains the details of the price to be shown in the image.", example={
         'price': "0.5 $/lb",
         'align': "center",
@@ -144,6 +154,8 @@ class Predef_ad_schema(object):
 class Predef_ad_query_schema(object):
     query:str
     n_results:int
+    width:int = None
+    height:int = None
 
 class Predef_request_sch_price(object):
     price:str=""
@@ -236,16 +248,73 @@ class PredefAdResource(Resource):
         
 
         try:
-            if server.chromadb_exists(image_id):
-                server.chromadb_update(image_id, image_description, image, img_source)
-            else:
-                server.chromadb_add(image_id,image_description, image, img_source)    
+            # Add or update in a single round trip, the received JPEG bytes are stored as they are
+            server.chromadb_upsert(image_id, image_description, img_bytes, image.width, image.height, img_source)
         except Exception as e:
             logger.error(f"Error while adding/updating predefined ad: {e}")
             return {"error": "Failed to add/update predefined ad"}, 500
         
         return {"message": "Success"}, 200
 
+@api.route('/predef/bulk',
+           doc={'description':'Add or Update many predefined ads in one request. JPEG images are supported. It reports the status of each ad.'}
+           )
+class PredefAdResourceBulk(Resource):
+    @api.response(200, 'Processed (see the status of each ad)')
+    @api.response(400, 'Invalid Parameters')
+    @api.response(500, 'Accepted but it could not be processed')    
+    @api.expect(predef_ad_bulk_schema, validate=True, description='Add/Update many predefined ads.')
+    def post(self):
+        data = api.payload
+        ads = data.get('ads', None)
+        if not ads:
+            return {"error": "ads field is required"}, 400
+
+        server = AseServerMetadata()
+        statuses = [None] * len(ads)
+        items = []
+        positions = [] # Index in ads of each valid item
+        used_ids = set()
+        for index, ad in enumerate(ads):
+            image_id = ad.get('id', None)
+            if image_id is None:
+                # If no ID is provided, generate a new one (not repeated in this request)
+                image_id = server.get_ase_img_id()
+                while image_id in used_ids:
+                    image_id = server.get_ase_img_id()
+            if image_id in used_ids:
+                statuses[index] = {"id": image_id, "status": "error", "error": "Repeated ID in the request"}
+                continue
+
+            if not ad.get('imgb64', None) or not ad.get('description', None):
+                statuses[index] = {"id": image_id, "status": "error", "error": "imgb64 and description fields are required"}
+                continue
+            try:
+                img_bytes = base64.b64decode(ad.get('imgb64'))
+                image = Image.open(io.BytesIO(img_bytes)) # Only the header is read
+            except Exception as e:
+                statuses[index] = {"id": image_id, "status": "error", "error": f"Invalid base64 image: {e}"}
+                continue
+            if image.format not in ['JPEG']:
+                statuses[index] = {"id": image_id, "status": "error", "error": "Unsupported image format. Only JPEG is allowed."}
+                continue
+
+            used_ids.add(image_id)
+            items.append({"id": image_id, "description": ad.get('description'), "img_bytes": img_bytes,
+                          "img_width": image.width, "img_height": image.height, "source": ad.get('source', None)})
+            positions.append(index)
+
+        if len(items) > 0:
+            try:
+                for index, status in zip(positions, server.chromadb_upsert_many(items)):
+                    statuses[index] = status
+            except Exception as e:
+                logger.error(f"Error while adding/updating predefined ads in bulk: {e}")
+                return {"error": "Failed to add/update predefined ads"}, 500
+
+        succeeded = sum(1 for status in statuses if status['status'] == "ok")
+        return {"succeeded": succeeded, "failed": len(statuses) - succeeded, "results": statuses}, 200
+
 @api.route('/predef/<string:id>',
            doc={'description':'It gets or removes the predefined ad with the given ID.'}
            )
@@ -277,59 +346,33 @@ class PredefAdResourceDeleteGet(Resource):
             logger.error(f"[ASE-Chromadb] Predefined ad with ID {id} not found.")
             item.description = f"Predefined ad with ID {id} not found."
             return item, 404
-        item = None
         try:        
-            results=server.chromadb_get(id)
-            if not results:
+            doc_metadata = get_ad_metadata(server, id)
+            if doc_metadata is None:
+                logger.error(f"[ASE-Chromadb Result] Metadata for ID {id} not found.")
                 item.description = f"Predefined ad with ID {id} not found."
                 return item, 404
-                
-            if 'metadatas' not in results or 'ids' not in results :
-                item.description=f"[ASE-Chromadb Result] 'metadatas' or 'ids' not found in results: {results}"
-                logger.error(f"[ASE-Chromadb Result] 'metadatas' or 'ids' not found in results: {results}")
-                return {"error": "Incomplete Response from the Vector DB"}, 500
-
-            ids = results.get('ids',[])
-            metadatas = results.get('metadatas',[])
-
-            for query_index, (id_list, metadata_list) in enumerate (zip(ids, metadatas)):
-                for doc_index, doc_id in enumerate(id_list):
-                    id_int = None
-                    try:
-                        id_int = int(doc_id)
-                    except Exception as e:
-                        continue # when id is not int, discard from result and move to the next one
-                    
-                    # Get the metadata for the document    
-                    doc_metadata = metadata_list #metadata_list is the dictionary of metadata for the document
-                    if doc_metadata is None:
-                        logger.error(f"[ASE-Chromadb Result] Metadata for ID {id_int} is None.")
-                        item.description = f"Metadata for ID {id_int} is None."
-                        return item, 404
-                    
-
-                    description = doc_metadata.get('description',None)
-                    img_path = doc_metadata.get('img_path',None)
-                    source = doc_metadata.get('source', None)
-                    # Get the image from the server
-
-                    img = server.get_image_file_from_path(img_path)
-                    img_b64 = None
-                    if img is not None:
-                        buffered = io.BytesIO()                        
-                        img.save(buffered, format="JPEG")
-                        img_b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    # Check if all required fields are present
-                    # and add to the records list
-                    if img_b64 is not None and id_int is not None and description is not None:
-                        item = Predef_ad_schema()
-                        item.id = id_int
-                        item.description = description
-                        item.source = source if source else None
-                        item.imgb64 = img_b64                        
-                    else:
-                        logger.error(f"[ASE-Chromadb Result] Incomplete Record. id: {id_int} description: {description} image_path: {img_path}")
-                        item.description = f"Incomplete Record. id: {id_int} description: {description} image_path: {img_path}"
+
+            id_int = None
+            try:
+                id_int = int(id)
+            except Exception as e:
+                pass
+
+            description = doc_metadata.get('description',None)
+            img_path = doc_metadata.get('img_path',None)
+            source = doc_metadata.get('source', None)
+            # The stored JPEG is returned as it is (no decoding/re-encoding)
+            img_bytes = AseServerMetadata.read_image_bytes(img_path)
+            # Check if all required fields are present
+            if img_bytes is not None and id_int is not None and description is not None:
+                item.id = id_int
+                item.description = description
+                item.source = source if source else None
+                item.imgb64 = base64.b64encode(img_bytes).decode('utf-8')
+            else:
+                logger.error(f"[ASE-Chromadb Result] Incomplete Record. id: {id_int} description: {description} image_path: {img_path}")
+                item.description = f"Incomplete Record. id: {id_int} description: {description} image_path: {img_path}"
         except Exception as e:
             item = Predef_ad_schema()
             item.description=f"Error: {e}"
@@ -337,6 +380,189 @@ class PredefAdResourceDeleteGet(Resource):
 
         return item, 200
 
+def get_ad_metadata(server: AseServerMetadata, id) -> dict:
+    """
+    Returns the metadata of the predefined ad with the given ID or None when it is not found.
+    """
+    results = server.chromadb_get(id)
+    if not results or 'metadatas' not in results or 'ids' not in results:
+        return None
+
+    for doc_id, doc_metadata in zip(results.get('ids', []), results.get('metadatas', [])):
+        if str(doc_id) == str(id):
+            return doc_metadata
+    return None
+
+def query_matches(server: AseServerMetadata, query: str, n_results: int) -> list:
+    """
+    Query the predefined ads and return the matches within the distance threshold,
+    as a list of (id, metadata, distance) sorted by distance. Ads with a non-integer ID are discarded.
+    """
+    results=server.chromadb_querytxt(query, n_results=n_results)
+    if results is None or len(results) == 0:
+        return []
+
+    if 'metadatas' not in results or 'ids' not in results or 'distances' not in results:                    
+        logger.error(f"[ASE-Chromadb Result] 'distances', 'metadatas' or 'ids' not found in results: {results}")
+        raise ValueError("Incomplete Response from the Vector DB")
+
+    matches = []
+    for id_list, metadata_list, distance_list in zip(results.get('ids',[]), results.get('metadatas',[]), results.get('distances',[])):
+        for doc_index, doc_id in enumerate(id_list):
+            doc_distance = distance_list[doc_index]
+            if doc_distance is None or doc_distance > AseServerMetadata.get_ase_distance_threshold():
+                continue
+            try:
+                id_int = int(doc_id)
+            except Exception as e:
+                continue # when id is not int, discard from result and move to the next one
+            matches.append((id_int, metadata_list[doc_index], doc_distance))
+
+    return sorted(matches, key=lambda match: match[2])
+
+def has_addons(data: dict) -> bool:
+    """
+    Check if the request asks for any add-on to be drawn over the stored ads.
+    """
+    framed_details = data.get('framed_details')
+    if framed_details is not None and framed_details.get('activate', False):
+        return True
+    return any(data.get(field) is not None for field in ('price_details', 'promo_details', 'logo_details', 'slogan_details'))
+
+addon_fields = ('price_details', 'promo_details', 'framed_details', 'logo_details', 'slogan_details')
+
+def rendered_ad_key(ad_id, img_path: str, data: dict) -> tuple:
+    """
+    Key of the rendered-ad cache. A decorated ad only depends on the stored image (path, which identifies the size variant,
+    and modification time) and on the add-on parameters (canonical JSON). None when the image cannot be found.
+    """
+    try:
+        mtime_ns = os.stat(img_path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+    addons = json.dumps({field: data.get(field) for field in addon_fields}, sort_keys=True, separators=(',', ':'))
+    return (str(ad_id), img_path, mtime_ns, addons, 'JPEG')
+
+def cached_or_image(server: AseServerMetadata, cache_key: tuple, img_path: str):
+    """
+    Returns the rendered JPEG bytes when they are cached, otherwise the image to decorate.
+    """
+    rendered = server.rendered_ad_cache.get(cache_key) if cache_key is not None else None
+    if rendered is not None:
+        return rendered
+    return server.get_image_file_from_path(img_path)
+
+def default_ad_entry(server: AseServerMetadata, data: dict) -> tuple:
+    """
+    Returns the (cache key, rendered bytes or image copy) of the default ad. Add-ons are drawn in place, so the image is copied.
+    """
+    cache_key = rendered_ad_key("default", AseServerMetadata.get_ase_default_ad_img(), data)
+    rendered = server.rendered_ad_cache.get(cache_key) if cache_key is not None else None
+    return (cache_key, rendered if rendered is not None else server.default_ad_image.copy())
+
+def display_size(data: dict) -> tuple:
+    """
+    Returns the (width, height) of the display requested by the client, None for each one not defined.
+    """
+    sizes = []
+    for field in ('width', 'height'):
+        try:
+            value = int(data.get(field)) if data.get(field) is not None else None
+        except (TypeError, ValueError):
+            value = None
+        sizes.append(value if value is not None and value > 0 else None)
+    return tuple(sizes)
+
+def stored_size(doc_metadata: dict) -> tuple:
+    """
+    Returns the (width, height) of the stored image from the ad metadata, None when they are not recorded.
+    """
+    try:
+        return (int(doc_metadata.get('img_width')), int(doc_metadata.get('img_height')))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def stored_ad_paths(server: AseServerMetadata, query: str, n_results: int, use_default_ad_onempty: bool, width: int = None, height: int = None) -> list:
+    """
+    Returns the image paths of the ads matching the query, or the default ad when there is no match (if requested).
+    With a display size, each path is the closest pre-rendered variant of the ad.
+    """
+    try:
+        paths = [server.image_variants.get_path(doc_metadata.get('img_path'), width, height, stored_size(doc_metadata)) for _, doc_metadata, _ in query_matches(server, query, n_results)
+                 if doc_metadata.get('img_path') is not None and os.path.exists(doc_metadata.get('img_path'))]
+    except ValueError:
+        paths = []
+
+    if len(paths) == 0 and use_default_ad_onempty and os.path.exists(AseServerMetadata.get_ase_default_ad_img()):
+        paths.append(AseServerMetadata.get_ase_default_ad_img())
+    return paths
+
+def gather_ad_entries(server: AseServerMetadata, data: dict, query: str, n_results: int, use_default_ad_onempty: bool) -> list:
+    """
+    Returns the ads matching the query as a list of (cache key, rendered bytes or image to decorate), with the default ad
+    when there is no match (if requested). Rendered ads come from the rendered-ad cache; otherwise the image to decorate
+    is the closest pre-rendered variant of the ad for the display size.
+    """
+    try:
+        matches = query_matches(server, query, n_results)
+    except ValueError:
+        matches = []
+
+    entries = []
+    for doc_id, doc_metadata, _ in matches:
+        img_path = server.image_variants.get_path(doc_metadata.get('img_path', None), *display_size(data), stored_size(doc_metadata))
+        cache_key = rendered_ad_key(doc_id, img_path, data)
+        img = cached_or_image(server, cache_key, img_path)
+        if img is not None and isinstance(img, (Image.Image, bytes)):
+            entries.append((cache_key, img))
+
+    if len(entries) == 0 and use_default_ad_onempty and isinstance(server.default_ad_image, Image.Image):
+        entries.append(default_ad_entry(server, data))
+    return entries
+
+def render_ad_entries(server: AseServerMetadata, data: dict, entries: list) -> list:
+    """
+    Returns the JPEG bytes of the entries gathered by gather_ad_entries. The add-ons are parsed once and drawn
+    (in parallel) over the images not found in the rendered-ad cache, and the results are stored in the cache.
+    """
+    rendered = [image for _, image in entries]
+    pending = [index for index, image in enumerate(rendered) if isinstance(image, Image.Image)]
+    if len(pending) == 0:
+        return rendered
+
+    plan = DecorationPlan(data, logo=server.get_logo() if data.get('logo_details') is not None else None)
+    for index, img_bytes in zip(pending, plan.render_many([rendered[index] for index in pending], format='JPEG')):
+        cache_key = entries[index][0]
+        if cache_key is not None:
+            server.rendered_ad_cache.put(cache_key, img_bytes, len(img_bytes))
+        rendered[index] = img_bytes
+    return rendered
+
+@api.route('/predef/<string:id>/image',
+           doc={'description':'It returns the stored image of the predefined ad with the given ID as it is (JPEG).',
+                "produces": ['image/jpeg']
+                })
+@api.param('id', 'The unique identifier of the predefined ad')
+@api.param('width', 'Display width (pixels). When set, the closest pre-rendered variant is returned.', type=int)
+@api.param('height', 'Display height (pixels). When set, the closest pre-rendered variant is returned.', type=int)
+class PredefAdResourceImage(Resource):
+    @api.response(200, 'Success')
+    @api.response(404, 'Not found')
+    @api.response(500, 'Accepted but it could not be recovered')    
+    def get(self,id):
+        server = AseServerMetadata()
+        try:
+            doc_metadata = get_ad_metadata(server, id)
+            img_path = doc_metadata.get('img_path', None) if doc_metadata is not None else None
+            if img_path is None or not os.path.exists(img_path):
+                return {"error": f"Predefined ad with ID {id} not found."}, 404
+
+            width, height = display_size(request.args)
+            # File response: the WSGI server can stream it with sendfile (zero-copy)
+            return send_file(server.image_variants.get_path(img_path, width, height, stored_size(doc_metadata)), mimetype='image/jpeg', conditional=True, max_age=0)
+        except Exception as e:
+            logger.error(f"Error while getting the predefined ad image {id}: {e}")
+            return {"error": "Failed to get the predefined ad image"}, 500
 
 @api.route('/predef/query',
            doc={'description':'Query predefined ads. It returns the most similar predefined ads based on the query text.'}
@@ -356,55 +582,27 @@ class PredefAdResourceQuery(Resource):
         if not query:
             return {"error": "query field is required"}, 400
 
+        width, height = display_size(data)
         records=[]                
         server = AseServerMetadata()
         try:
-            results=server.chromadb_querytxt(query, n_results=n_results)
-            if results is None or len(results) == 0:
-                return {"error": "No results found"}, 404
-
-            if 'metadatas' not in results or 'ids' not in results or 'distances' not in results:                    
-                logger.error(f"[ASE-Chromadb Result] 'distances', 'metadatas' or 'ids' not found in results: {results}")
-                return {"error": "Incomplete Response from the Vector DB"}, 500
-
-            ids = results.get('ids',[])
-            metadatas = results.get('metadatas',[])
-            distances = results.get('distances',[])
-
-            for query_index, (id_list, metadata_list, distance_list) in enumerate (zip(ids, metadatas,distances)):
-                for doc_index, doc_id in enumerate(id_list):
-                    doc_distance = distance_list[doc_index]                            
-
-                    if doc_distance is not None and doc_distance <= AseServerMetadata.get_ase_distance_threshold():
-                        id_int = None
-                        try:
-                            id_int = int(doc_id)
-                        except Exception as e:
-                            continue # when id is not int, discard from result and move to the next one
-
-                        # Get the metadata for the document    
-                        doc_metadata = metadata_list[doc_index]                    
-                        description = doc_metadata.get('description',None)
-                        img_path = doc_metadata.get('img_path',None)
-                        img_source = doc_metadata.get('source', None)
-                        # Get the image from the server
-                        img = server.get_image_file_from_path(img_path)
-                        img_b64 = None
-                        if img is not None and isinstance(img, Image.Image):
-                            buffered = io.BytesIO()
-                            img.save(buffered, format="JPEG")
-                            img_b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                        # Check if all required fields are present
-                        # and add to the records list
-                        if img_b64 is not None and id_int is not None and description is not None:
-                            item = Predef_ad_schema()
-                            item.id = id_int
-                            item.description = description
-                            item.imgb64 = img_b64
-                            item.source = img_source if img_source else None
-                            records.append(item)
-                        else:
-                            logger.error(f"[ASE-Chromadb Result] Incomplete Record. id: {id_int} description: {description} image_path: {img_path}")
+            for id_int, doc_metadata, doc_distance in query_matches(server, query, n_results):
+                description = doc_metadata.get('description',None)
+                img_path = doc_metadata.get('img_path',None)
+                img_source = doc_metadata.get('source', None)
+                # The stored JPEG (or its variant for the display size) is returned as it is (no decoding/re-encoding)
+                img_bytes = AseServerMetadata.read_image_bytes(server.image_variants.get_path(img_path, width, height, stored_size(doc_metadata)))
+                # Check if all required fields are present
+                # and add to the records list
+                if img_bytes is not None and description is not None:
+                    item = Predef_ad_schema()
+                    item.id = id_int
+                    item.description = description
+                    item.imgb64 = base64.b64encode(img_bytes).decode('utf-8')
+                    item.source = img_source if img_source else None
+                    records.append(item)
+                else:
+                    logger.error(f"[ASE-Chromadb Result] Incomplete Record. id: {id_int} description: {description} image_path: {img_path}")
 
         except Exception as e:
             logger.error(f"Error while querying predefined ad: {e}")
@@ -412,6 +610,71 @@ class PredefAdResourceQuery(Resource):
         
         return records, 200
 
+@api.route('/predef/query/images',
+           doc={'description':'Query predefined ads. It returns the stored images of the most similar predefined ads as multipart/mixed (one image/jpeg part per ad, most similar first).',
+                "produces": ['multipart/mixed']
+                })
+class PredefAdResourceQueryImages(Resource):
+    @api.response(200, 'Success')
+    @api.response(404, 'No content found for the query')
+    @api.response(500, 'Accepted but it could not be processed/recovered')    
+    @api.expect(predef_ad_query_schema, validate=True, description='Query the catalog and return the images of the most similar ads.')
+    def post(self):
+        data = api.payload
+        query = data.get('query', None)
+        n_results = data.get('n_results', 1)
+        if not query:
+            return {"error": "query field is required"}, 400
+
+        width, height = display_size(data)
+        server = AseServerMetadata()
+        try:
+            parts = [(id_int, doc_metadata.get('img_path', None), stored_size(doc_metadata), doc_distance)
+                     for id_int, doc_metadata, doc_distance in query_matches(server, query, n_results)]
+            parts = [(id_int, server.image_variants.get_path(img_path, width, height, img_size), doc_distance)
+                     for id_int, img_path, img_size, doc_distance in parts if img_path is not None and os.path.exists(img_path)]
+        except Exception as e:
+            logger.error(f"Error while querying predefined ad images: {e}")
+            return {"error": "Failed to query predefined ad"}, 500
+
+        if len(parts) == 0:
+            return {"error": "No results found"}, 404
+
+        boundary = uuid.uuid4().hex
+        def multipart():
+            for id_int, img_path, doc_distance in parts:
+                try:
+                    img_file = open(img_path, 'rb')
+                except FileNotFoundError:
+                    continue # Removed after the query
+                with img_file:
+                    yield (f"--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Length: {os.fstat(img_file.fileno()).st_size}\r\n"
+                           f"X-Ad-Id: {id_int}\r\nX-Ad-Distance: {doc_distance}\r\n\r\n").encode('utf-8')
+                    while True:
+                        chunk = img_file.read(64 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+                yield b"\r\n"
+            yield f"--{boundary}--\r\n".encode('utf-8')
+
+        return Response(stream_with_context(multipart()), mimetype=f"multipart/mixed; boundary={boundary}")
+
+@api.route('/predef/query/cache',
+           doc={'description':'It returns the hit/miss statistics of the query results cache, the query embedding cache, the vector mirror, the image variants and the rendered ads.'}
+           )
+class PredefAdResourceQueryCache(Resource):
+    @api.response(200, 'Success')
+    def get(self):
+        server = AseServerMetadata()
+        return {
+            "query": server.query_cache.stats(),
+            "embeddings": server.embedding_cache.stats() if server.embedding_cache is not None else None,
+            "vector_mirror": server.vector_mirror.stats() if server.vector_mirror is not None else None,
+            "image_variants": server.image_variants.stats(),
+            "rendered_ads": server.rendered_ad_cache.stats()
+        }, 200
+
 @api.route('/predef/query/ad',
            doc={"description":"It looks for a similar ads based on text description and returns it (Base64-encoded) with the requested add-ons (when applicable) as a list."
                 })
@@ -442,208 +705,37 @@ class Predefined_Adhocad_Img(Resource):
         predef_use_default_ad_onempty = data.get('use_default_ad_onempty', True)
         if predef_use_default_ad_onempty is None:
             predef_use_default_ad_onempty = True
+
+        if not has_addons(data):
+            # Without add-ons, the stored JPEG files are returned as they are (no decoding/re-encoding)
+            try:
+                records = []
+                for img_path in stored_ad_paths(AseServerMetadata(), predef_query, predef_n_results, predef_use_default_ad_onempty, *display_size(data)):
+                    img_bytes = AseServerMetadata.read_image_bytes(img_path)
+                    if img_bytes is not None:
+                        item = Predef_ad_schema()
+                        item.imgb64 = base64.b64encode(img_bytes).decode('utf-8')
+                        records.append(item)
+                return records, 200
+            except Exception as e:
+                errorMessage=f"Predefined ad query. Exception: {str(e)}"
+                logger.error(errorMessage)
+                return errorMessage, 500
         
         server = None
         pipeline_imgs=[]
         pipeline_processed_imgs_b64=[]
         try:
             server = AseServerMetadata()
-                        
-            results=server.chromadb_querytxt(predef_query, n_results=predef_n_results)
-            if results is None or len(results) == 0:
-                if predef_use_default_ad_onempty and server.default_ad_image is not None and \
-                    isinstance(server.default_ad_image, Image.Image):
-                    pipeline_imgs.append(server.default_ad_image)
-                else:
-                    return [], 200
-            else:
-                if 'metadatas' not in results or 'ids' not in results or 'distances' not in results:                    
-                    if predef_use_default_ad_onempty and server.default_ad_image is not None and \
-                        isinstance(server.default_ad_image, Image.Image):
-                        pipeline_imgs.append(server.default_ad_image)
-                    else:
-                        return [], 200
-                else:
-                    ids = results.get('ids',[])
-                    metadatas = results.get('metadatas',[])
-                    distances = results.get('distances',[])
-
-                    for query_index, (id_list, metadata_list, distance_list) in enumerate (zip(ids, metadatas,distances)):
-                        for doc_index, doc_id in enumerate(id_list):
-                            doc_distance = distance_list[doc_index]
-
-                            if doc_distance is not None and doc_distance <= AseServerMetadata.get_ase_distance_threshold():
-                                # Get the metadata for the document    
-                                doc_metadata = metadata_list[doc_index]                                                
-                                img_path = doc_metadata.get('img_path',None)
-                                # Get the image from the server
-                                img = server.get_image_file_from_path(img_path)
-                                if img is not None and isinstance(img, Image.Image):
-                                    # Ensure the image is a valid PIL Image
-                                    pipeline_imgs.append(img)
-
+            pipeline_imgs = gather_ad_entries(server, data, predef_query, predef_n_results, predef_use_default_ad_onempty)
             if len(pipeline_imgs) == 0:
-                if predef_use_default_ad_onempty and server.default_ad_image is not None and isinstance(server.default_ad_image, Image.Image):
-                    pipeline_imgs.append(server.default_ad_image)
-                else:
-                    return [], 200
+                return [], 200
+
+            for img_bytes in render_ad_entries(server, data, pipeline_imgs):
+                item = Predef_ad_schema()
+                item.imgb64 = base64.b64encode(img_bytes).decode('utf-8')
+                pipeline_processed_imgs_b64.append(item)
 
-            for image in pipeline_imgs:
-                if image is None or not isinstance(image, Image.Image):
-                    continue  # Skip if the image is None or not a valid PIL Image
-
-                # Price details                
-                price_details = data.get('price_details')            
-                img_postprice = None
-                if price_details is not None:
-                    price:str=price_details.get('price', "")
-                    align:str=price_details.get('align',"center")
-                    valign:str=price_details.get('valign',"bottom")
-                    marperc_from_border:float=float(price_details.get('marperc_from_border',2.0))
-                    font_size:int=int(price_details.get('font_size',20))
-                    line_width:int=int(price_details.get('line_width',20))
-                    price_color:str=price_details.get('price_color',"white")            
-                    
-                    if ImgDecorator.is_color_valid(price_color) is False:
-                        price_color="white" # Default color if the provided one is not valid
-                        
-                    price_in_circle:bool=price_details.get('price_in_circle',False)
-                    
-                    price_circle_color:str=price_details.get('price_circle_color',"black")                
-                    if ImgDecorator.is_color_valid(price_circle_color) is False:
-                        price_circle_color="black"
-
-                    if price_in_circle:
-                        # Draw the price circle
-                        img_postprice = ImgDecorator.draw_price_circle(image, 
-                                price= price, price_color=price_color,
-                                circle_color=price_circle_color,                             
-                                align=align, valign=valign,                             
-                                margin_percentage=marperc_from_border, 
-                                font_size=font_size, line_width=line_width)
-                    else:
-                        img_postprice = ImgDecorator.draw_price_circle(image, 
-                                    price= price, align=align, valign=valign, 
-                                    margin_percentage=marperc_from_border, font_size=font_size,
-                                    line_width=line_width, price_color=price_color)    
-                    
-                    if img_postprice is None or not isinstance(img_postprice, Image.Image):
-                        img_postprice = image # Back to the original image if the price circle could not be drawn
-                else:
-                    img_postprice = image
-
-                # Promo details (Rounded Rectangle)
-                promo_details = data.get('promo_details')
-                img_postpromo = None
-                if promo_details is not None:
-                    promo_text:str=promo_details.get('promo_text', "")
-                    text_color:str=promo_details.get('text_color',"white")
-                    
-                    if ImgDecorator.is_color_valid(text_color) is False:
-                        text_color="white"
-
-                    rect_color:str=promo_details.get('rect_color',"black")
-                    if ImgDecorator.is_color_valid(rect_color) is False:
-                        rect_color="black"
-
-                    rect_padding:int=int(promo_details.get('rect_padding',10))
-                    rect_radius:int=int(promo_details.get('rect_radius',20))
-                    align:str=promo_details.get('align',"center")
-                    valign:str=promo_details.get('valign',"bottom")
-                    marperc_from_border:float=float(promo_details.get('marperc_from_border',2.0))
-                    font_size:int=int(promo_details.get('font_size',20))
-                    line_width:int=int(promo_details.get('line_width',20))
-
-                    img_postpromo = ImgDecorator.draw_promo_rounded_rect(img_postprice, 
-                                text=promo_text, text_color=text_color, rect_color=rect_color,
-                                align=align, valign=valign,
-                                margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width,
-                                rect_padding=rect_padding, rect_radius=rect_radius)
-                    
-                    if img_postpromo is None or not isinstance(img_postpromo, Image.Image):
-                        img_postpromo = img_postprice # Back to the original image if the promo could not be drawn
-                else:
-                    img_postpromo = img_postprice
-
-                # Frame
-                frame_details=data.get('framed_details')
-                img_postframe = None
-                if frame_details is not None:
-                    framed:bool=bool(frame_details.get('activate',False))
-                    marperc_from_border:float=float(frame_details.get('marperc_from_border',2.0))
-                    
-                    if framed:
-                        img_postframe = ImgDecorator.draw_frame_double_border(img_postpromo,
-                                                                            percentageFromBorder=marperc_from_border)
-                    else:
-                        img_postframe = img_postpromo
-
-                    if img_postframe is None or not isinstance(img_postframe, Image.Image):
-                        img_postframe = img_postpromo # Back to the original image if the frame could not be drawn
-                else:
-                    img_postframe = img_postpromo
-
-                # Logo
-                logo_details = data.get('logo_details')
-                img_postlogo = None
-                if logo_details is not None:
-                    logo = server.get_logo()
-                    if logo is not None:
-                        align:str=logo_details.get('align',"left")
-                        valign:str=logo_details.get('valign',"top")
-                        logo_percentage:float=float(logo_details.get('logo_percentage',15.0))
-                        margin_px:int=int(logo_details.get('margin_px',10))
-
-                        img_postlogo = ImgDecorator.draw_logo(img_postframe, logo_img=logo,
-                                    align=align, valign=valign, 
-                                    logo_percentage=logo_percentage, margin_px=margin_px)
-                    else:
-                        img_postlogo = img_postframe
-
-                    if img_postlogo is None or not isinstance(img_postlogo, Image.Image):
-                        img_postlogo = img_postframe #Back to the original image if the logo could not be drawn
-                else:
-                    img_postlogo = img_postframe
-
-                # Slogan
-                slogan_details = data.get('slogan_details')
-                img_postslogan = None
-                if slogan_details is not None:
-                    slogan_text:str=slogan_details.get('slogan_text', "")
-                    text_color:str=slogan_details.get('text_color',"white")
-                    if ImgDecorator.is_color_valid(text_color) is False:
-                        text_color="white"
-
-                    align:str=slogan_details.get('align',"center")
-                    valign:str=slogan_details.get('valign',"bottom")
-                    marperc_from_border:float=float(slogan_details.get('marperc_from_border',2.0))
-                    font_size:int=int(slogan_details.get('font_size',20))
-                    line_width:int=int(slogan_details.get('line_width',20))
-
-                    img_postslogan = ImgDecorator.draw_slogan(img_postlogo, 
-                                text=slogan_text, text_color=text_color,
-                                align=align, valign=valign,
-                                margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width)
-                    
-                    if img_postslogan is None or not isinstance(img_postslogan, Image.Image):
-                        img_postslogan = img_postlogo # Back to the original image if the slogan could not be drawn
-                else:
-                    img_postslogan = img_postlogo
-
-                # Save the updated image to a BytesIO object
-                if img_postslogan is not None and isinstance(img_postslogan, Image.Image):
-                    buffered = io.BytesIO()
-                    img_postslogan.save(buffered, format='JPEG')  # or 'PNG'
-                    im_b64= base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    
-                    if(im_b64 is not None):
-                        item = Predef_ad_schema()
-                        item.imgb64 = im_b64
-                        pipeline_processed_imgs_b64.append(item)
-                else:
-                    errorMessage = f"Processed image is None or not a valid PIL Image. Type: {str(type(img_postslogan))}"
-                    logger.error(errorMessage)
-                    
         except Exception as e:
             errorMessage=f"Image Generation. Exception: {str(e)}"
             logger.error(errorMessage)
@@ -674,210 +766,30 @@ class Predefined_Adhocad_Img(Resource):
         predef_use_default_ad_onempty = data.get('use_default_ad_onempty', True)
         if predef_use_default_ad_onempty is None:
             predef_use_default_ad_onempty = True
+
+        if not has_addons(data):
+            # Without add-ons, the stored JPEG file is streamed as it is (no decoding/re-encoding)
+            try:
+                paths = stored_ad_paths(AseServerMetadata(), predef_query, predef_n_results, predef_use_default_ad_onempty, *display_size(data))
+                if len(paths) == 0:
+                    return [], 200
+                return send_file(paths[0], mimetype='image/jpeg', download_name='ad_image.jpg')
+            except Exception as e:
+                errorMessage=f"Predefined ad query. Exception: {str(e)}"
+                logger.error(errorMessage)
+                return errorMessage, 500
         
         server = None
         pipeline_imgs=[]
         try:
             server = AseServerMetadata()
-                        
-            results=server.chromadb_querytxt(predef_query, n_results=predef_n_results)
-            if results is None or len(results) == 0:
-                if predef_use_default_ad_onempty and server.default_ad_image is not None and \
-                    isinstance(server.default_ad_image, Image.Image):
-                    pipeline_imgs.append(server.default_ad_image)
-                else:
-                    return [], 200
-            else:
-                if 'metadatas' not in results or 'ids' not in results or 'distances' not in results:                    
-                    if predef_use_default_ad_onempty and server.default_ad_image is not None and \
-                        isinstance(server.default_ad_image, Image.Image):
-                        pipeline_imgs.append(server.default_ad_image)
-                    else:
-                        return [], 200
-                else:
-                    ids = results.get('ids',[])
-                    metadatas = results.get('metadatas',[])
-                    distances = results.get('distances',[])                    
-
-                    for query_index, (id_list, metadata_list, distance_list) in enumerate (zip(ids, metadatas,distances)):
-                        for doc_index, doc_id in enumerate(id_list):
-                            doc_distance = distance_list[doc_index]                            
-
-                            if doc_distance is not None and doc_distance <= AseServerMetadata.get_ase_distance_threshold():
-                                # Get the metadata for the document    
-                                doc_metadata = metadata_list[doc_index]                    
-                                img_path = doc_metadata.get('img_path',None)
-                                # Get the image from the server
-                                img = server.get_image_file_from_path(img_path)
-                                if img is not None and isinstance(img, Image.Image):
-                                    # Ensure the image is a valid PIL Image
-                                    pipeline_imgs.append(img)
-
+            pipeline_imgs = gather_ad_entries(server, data, predef_query, predef_n_results, predef_use_default_ad_onempty)
             if len(pipeline_imgs) == 0:
-                if predef_use_default_ad_onempty and server.default_ad_image is not None and isinstance(server.default_ad_image, Image.Image):
-                    # If the default ad image is valid, append it
-                    pipeline_imgs.append(server.default_ad_image)
-                else:
-                    return [], 200
+                return [], 200
+
+            img_bytes = render_ad_entries(server, data, pipeline_imgs[:1])[0]
+            return send_file(io.BytesIO(img_bytes), mimetype='image/jpeg', download_name='ad_image.jpg')
 
-            for image in pipeline_imgs:
-                if image is None or not isinstance(image, Image.Image):
-                    continue  # Skip if the image is None or not a valid PIL Image
-
-                # Price details
-                price_details = data.get('price_details')            
-                img_postprice = None
-
-                if price_details is not None:
-                    price:str=price_details.get('price', "")
-                    align:str=price_details.get('align',"center")
-                    valign:str=price_details.get('valign',"bottom")
-                    marperc_from_border:float=float(price_details.get('marperc_from_border',2.0))
-                    font_size:int=int(price_details.get('font_size',20))
-                    line_width:int=int(price_details.get('line_width',20))
-                    price_color:str=price_details.get('price_color',"white")            
-                    
-                    if ImgDecorator.is_color_valid(price_color) is False:
-                        price_color="white" # Default color if the provided one is not valid
-                        
-                    price_in_circle:bool=price_details.get('price_in_circle',False)
-                    
-                    price_circle_color:str=price_details.get('price_circle_color',"black")                
-                    if ImgDecorator.is_color_valid(price_circle_color) is False:
-                        price_circle_color="black"
-
-                    if price_in_circle:
-                        # Draw the price circle
-                        img_postprice = ImgDecorator.draw_price_circle(image, 
-                                price= price, price_color=price_color,
-                                circle_color=price_circle_color,                             
-                                align=align, valign=valign,                             
-                                margin_percentage=marperc_from_border, 
-                                font_size=font_size, line_width=line_width)                        
-                    else:
-                        img_postprice = ImgDecorator.draw_price_circle(image, 
-                                    price= price, align=align, valign=valign, 
-                                    margin_percentage=marperc_from_border, font_size=font_size,
-                                    line_width=line_width, price_color=price_color)    
-                    
-                    if img_postprice is None or not isinstance(img_postprice, Image.Image):
-                        img_postprice = image # Back to the original image if the price circle could not be drawn
-                else:
-                    img_postprice = image                        
-                        
-                # Promo details (Rounded Rectangle)
-                promo_details = data.get('promo_details')
-                img_postpromo = None
-                if promo_details is not None:
-                    promo_text:str=promo_details.get('promo_text', "")
-                    text_color:str=promo_details.get('text_color',"white")
-                    
-                    if ImgDecorator.is_color_valid(text_color) is False:
-                        text_color="white"
-
-                    rect_color:str=promo_details.get('rect_color',"black")
-                    if ImgDecorator.is_color_valid(rect_color) is False:
-                        rect_color="black"
-
-                    rect_padding:int=int(promo_details.get('rect_padding',10))
-                    rect_radius:int=int(promo_details.get('rect_radius',20))
-                    align:str=promo_details.get('align',"center")
-                    valign:str=promo_details.get('valign',"bottom")
-                    marperc_from_border:float=float(promo_details.get('marperc_from_border',2.0))
-                    font_size:int=int(promo_details.get('font_size',20))
-                    line_width:int=int(promo_details.get('line_width',20))
-
-                    img_postpromo = ImgDecorator.draw_promo_rounded_rect(img_postprice, 
-                                text=promo_text, text_color=text_color, rect_color=rect_color,
-                                align=align, valign=valign,
-                                margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width,
-                                rect_padding=rect_padding, rect_radius=rect_radius)
-
-                    if img_postpromo is None or not isinstance(img_postpromo, Image.Image):
-                        img_postpromo = img_postprice # Back to the original image if the promo could not be drawn
-                else:
-                    img_postpromo = img_postprice
-
-                # Frame
-                frame_details=data.get('framed_details')
-                img_postframe = None
-                if frame_details is not None:
-                    framed:bool=bool(frame_details.get('activate',False))
-                    marperc_from_border:float=float(frame_details.get('marperc_from_border',2.0))
-                    
-                    if framed:
-                        img_postframe = ImgDecorator.draw_frame_double_border(img_postpromo,
-                                                                            percentageFromBorder=marperc_from_border)
-                    else:
-                        img_postframe = img_postpromo
-
-                    if img_postframe is None or not isinstance(img_postframe, Image.Image):
-                        img_postframe = img_postpromo # Back to the original image if the frame could not be drawn
-                else:
-                    img_postframe = img_postpromo
-
-                # Logo
-                logo_details = data.get('logo_details')
-                img_postlogo = None
-                if logo_details is not None:
-                    logo = server.get_logo()
-                    if logo is not None:
-                        align:str=logo_details.get('align',"left")
-                        valign:str=logo_details.get('valign',"top")
-                        logo_percentage:float=float(logo_details.get('logo_percentage',15.0))
-                        margin_px:int=int(logo_details.get('margin_px',10))
-
-                        img_postlogo = ImgDecorator.draw_logo(img_postframe, logo_img=logo,
-                                    align=align, valign=valign, 
-                                    logo_percentage=logo_percentage, margin_px=margin_px)
-                    else:
-                        img_postlogo = img_postframe
-
-                    if img_postlogo is None or not isinstance(img_postlogo, Image.Image):
-                        img_postlogo = img_postframe #Back to the original image if the logo could not be drawn
-                else:
-                    img_postlogo = img_postframe
-
-                # Slogan
-                slogan_details = data.get('slogan_details')
-                img_postslogan = None
-                if slogan_details is not None:
-                    slogan_text:str=slogan_details.get('slogan_text', "")
-                    text_color:str=slogan_details.get('text_color',"white")
-
-                    if ImgDecorator.is_color_valid(text_color) is False:
-                        text_color="white"
-
-                    align:str=slogan_details.get('align',"center")
-                    valign:str=slogan_details.get('valign',"bottom")
-                    marperc_from_border:float=float(slogan_details.get('marperc_from_border',2.0))
-                    font_size:int=int(slogan_details.get('font_size',20))
-                    line_width:int=int(slogan_details.get('line_width',20))
-
-                    img_postslogan = ImgDecorator.draw_slogan(img_postlogo, 
-                                text=slogan_text, text_color=text_color,
-                                align=align, valign=valign,
-                                margin_percentage=marperc_from_border, font_size=font_size, line_width=line_width)
-
-                    if img_postslogan is None or not isinstance(img_postslogan, Image.Image):
-                        img_postslogan = img_postlogo # Back to the original image if the slogan could not be drawn
-                else:
-                    img_postslogan = img_postlogo
-
-                if img_postslogan is None:
-                    img_postslogan = image  # Fallback to the original image if no modifications were made
-
-                # Save the updated image to a BytesIO object
-                if img_postslogan is not None and isinstance(img_postslogan, Image.Image):                
-                    img_io = io.BytesIO()
-                    img_postslogan.save(img_io, format='JPEG')  # or 'PNG'                
-                    img_io.seek(0)  # Move to the beginning of the BytesIO object
-                    
-                    return send_file(img_io, mimetype='image/jpeg', download_name='ad_image.jpg')
-                else:
-                    errorMessage = f"Processed image is None or not a valid PIL Image. Type: {str(type(img_postslogan))}"
-                    logger.error(errorMessage)
-                    return errorMessage, 500
 
         except Exception as e:
             errorMessage=f"Image Generation. Exception: {str(e)}"
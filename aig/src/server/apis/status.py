@@ -1,4 +1,6 @@
 from flask_restx import Namespace, Resource, fields
+#AIGServer Environment
+from inference.t2i_queue import T2IJobQueue
 
 api = Namespace('AIG - Status', description='Status related operations')
 
@@ -33,3 +35,12 @@ class HStatus(Resource):
             curr.status="ok"
 
         return curr
+
+@api.route('/ready',
+           doc={"description":"It replies 200 once the Text2Image pipelines are warmed up (503 while warming up), with the load and warm-up timings."})
+class Readiness(Resource):
+    @api.response(200, 'Ready')
+    @api.response(503, 'Warming up')
+    def get(self):
+        readiness = T2IJobQueue().readiness()
+        return readiness, 200 if readiness['ready'] else 503
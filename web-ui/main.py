@@ -9,26 +9,73 @@ import cv2
 import time
 import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Flask, render_template, Response, jsonify, request
 import logging
 from datetime import datetime
 import paho.mqtt.client as mqtt
 import json
-from queue import Queue
 import numpy as np
 from io import BytesIO
 import csv
 import base64
 import random
+import uuid
+from collections import OrderedDict
 
 AIG_SERVER_URL = os.getenv('AIG_SERVER_URL', 'http://aig-server:5003')
 AIG_DYNAMIC_AD_ENDPOINT = f"{AIG_SERVER_URL}/aig/minf/"
+AIG_DYNAMIC_AD_JOBS_ENDPOINT = f"{AIG_SERVER_URL}/aig/minf/jobs"
+AIG_DYNAMIC_AD_TIMEOUT = 400 # Maximum time (seconds) to wait for a dynamic ad
+AIG_DYNAMIC_AD_POLL_INTERVAL = 0.5 # Seconds between job status polls
+AIG_READY_ENDPOINT = f"{AIG_SERVER_URL}/aig/ready"
+# Queue the dynamic ad while the pre-defined ad is looked up (cancelled when a pre-defined ad is found)
+AIG_SPECULATIVE_GENERATION = os.getenv('AIG_SPECULATIVE_GENERATION', 'false').lower() == 'true'
 AIG_PREDEFINED_AD_STORE_ENDPOINT = f"{AIG_SERVER_URL}/ase/predef/"
+AIG_PREDEFINED_AD_BULK_ENDPOINT = f"{AIG_SERVER_URL}/ase/predef/bulk"
 AIG_PREDEFINED_AD_QUERY_ENDPOINT = f"{AIG_SERVER_URL}/ase/predef/query/ad"
+AD_EVENTS_KEEPALIVE = 15 # Seconds between keep-alive comments on idle ad event streams
+AD_PUBLISHED_VERSIONS = 4 # Pushed ads that can still be fetched by version, for displays that fetch after a newer ad is published
+AIG_HTTP_POOL_SIZE = 8 # Keep-alive connections kept open to the AIG server
+AIG_HTTP_RETRIES = 2 # Retries of a failed connection (and of failed idempotent requests) to the AIG server
+AIG_HTTP_BACKOFF = 0.1 # Backoff factor (seconds) between retries
+AIG_CONNECT_TIMEOUT = 1 # Seconds to open a connection to the AIG server, the read timeouts depend on the endpoint
+AIG_READY_TIMEOUT = (AIG_CONNECT_TIMEOUT, 2)
+AIG_PREDEFINED_AD_BULK_TIMEOUT = (AIG_CONNECT_TIMEOUT, 120)
+AIG_PREDEFINED_AD_QUERY_TIMEOUT = (AIG_CONNECT_TIMEOUT, 5)
+AIG_DYNAMIC_AD_SUBMIT_TIMEOUT = (AIG_CONNECT_TIMEOUT, 5)
+AIG_DYNAMIC_AD_POLL_TIMEOUT = (AIG_CONNECT_TIMEOUT, 10)
+AD_CACHE_MAX_ENTRIES = 256 # Ads kept per (product, association, display size)
+AD_CACHE_TTL = 600 # Seconds a cached ad is shown again before it is fetched or generated anew
+AD_PREFETCH_INTERVAL = 60 # Seconds between prefetch passes over the product associations
+AD_PREFETCH_IDLE_WAIT = 1 # Seconds the prefetcher waits while an ad is being generated or a detection is pending
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def create_aig_session():
+    """
+    HTTP session shared by every call to the AIG server: keep-alive connections from a bounded pool.
+    Failed connections are retried with backoff; read failures only for idempotent methods, so a POST
+    (e.g. a dynamic ad job) is never sent twice.
+    """
+    retry = Retry(total=AIG_HTTP_RETRIES,
+                  connect=AIG_HTTP_RETRIES,
+                  read=AIG_HTTP_RETRIES,
+                  status=AIG_HTTP_RETRIES,
+                  backoff_factor=AIG_HTTP_BACKOFF,
+                  status_forcelist=(502, 504),
+                  allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AIG_HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+aig_session = create_aig_session()
+
 app = Flask(__name__)
 
 AIG_SERVER_ACTIVE = False
@@ -39,6 +86,8 @@ product_associations = {}
 def load_product_associations(csv_path):
     """Load product associations from CSV file into dictionary"""
     global product_associations
+    pre_defined_ads = []
+    pre_defined_products = []
     try:
         with open(csv_path, 'r') as file:
             reader = csv.DictReader(file)
@@ -63,7 +112,6 @@ def load_product_associations(csv_path):
                 pre_defined_ad = row.get('pre_defined_ad_image', None)
                 if pre_defined_ad:
                     try:
-                        logger.info(f"Saving pre-defined ad for {primary_product}: {pre_defined_ad}")
                         # Read the pre-defined ad image from file
                         pre_defined_ad_path = os.path.join('/app/pre-defined-ads', pre_defined_ad)
                         if os.path.exists(pre_defined_ad_path):
@@ -72,32 +120,50 @@ def load_product_associations(csv_path):
                         else:
                             logger.warning(f"Pre-defined ad file not found: {pre_defined_ad_path}")
                             continue
-                        
-                        aig_payload = {
-                            "description": f"{primary_product} and {row['associated_cross_sell']}",
-                            "imgb64": pre_defined_ad_data,
-                            "source": "Provisioning Script"
-                            }
-                        aig_response = requests.post(
-                                AIG_PREDEFINED_AD_STORE_ENDPOINT,
-                                headers={
-                                    'accept': 'application/json',
-                                    'Content-Type': 'application/json'
-                                },
-                                json=aig_payload,
-                                timeout=5
-                            )
-                        if aig_response.status_code == 200:
-                            logger.info(f"Successfully stored pre-defined ad for {primary_product}")
-                        else:
-                            logger.warning(f"Failed to store pre-defined ad for {primary_product}: {aig_response.status_code}")
                     except Exception as e:
-                        logger.error(f"Error storing pre-defined ad for {primary_product}: {str(e)}")
+                        logger.error(f"Error reading pre-defined ad for {primary_product}: {str(e)}")
+                        continue
+
+                    pre_defined_ads.append({
+                        "description": f"{primary_product} and {row['associated_cross_sell']}",
+                        "imgb64": pre_defined_ad_data,
+                        "source": "Provisioning Script"
+                        })
+                    pre_defined_products.append(primary_product)
+
+        store_pre_defined_ads(pre_defined_ads, pre_defined_products)
         return True
     except Exception as e:
         logger.error(f"Failed to load product associations: {str(e)}")
         return False
 
+def store_pre_defined_ads(pre_defined_ads, pre_defined_products):
+    """Store all the pre-defined ads in the AIG server with a single bulk request"""
+    if len(pre_defined_ads) == 0:
+        return
+    try:
+        logger.info(f"Saving {len(pre_defined_ads)} pre-defined ads")
+        aig_response = aig_session.post(
+                AIG_PREDEFINED_AD_BULK_ENDPOINT,
+                headers={
+                    'accept': 'application/json',
+                    'Content-Type': 'application/json'
+                },
+                json={"ads": pre_defined_ads},
+                timeout=AIG_PREDEFINED_AD_BULK_TIMEOUT
+            )
+        if aig_response.status_code != 200:
+            logger.warning(f"Failed to store pre-defined ads: {aig_response.status_code}")
+            return
+
+        for product, result in zip(pre_defined_products, aig_response.json().get('results', [])):
+            if result.get('status') == 'ok':
+                logger.info(f"Successfully stored pre-defined ad for {product}")
+            else:
+                logger.warning(f"Failed to store pre-defined ad for {product}: {result.get('error')}")
+    except Exception as e:
+        logger.error(f"Error storing pre-defined ads: {str(e)}")
+
 # MQTT Configuration
 MQTT_BROKER = os.getenv('MQTT_BROKER', 'ia-mqtt-broker')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
@@ -108,8 +174,98 @@ mqtt_messages = []
 mqtt_messages_lock = threading.Lock()
 
 
-# Queue for processing MQTT messages
-message_queue = Queue()
+DETECTION_MAX_AGE = 5 # Seconds since a product was last detected after which no ad is generated for it
+
+class DetectionMailbox:
+    """
+    Hands the detected products from the MQTT callback to the Ad_Generator thread.
+    It keeps only the newest pending label: labels that arrive while an ad is being generated
+    replace each other, so the generator always starts with the product currently in front of the camera.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None
+        self.last_seen = {} # label -> time of its last detection
+        self.dropped = 0
+
+    def seen(self, label):
+        """Record a detection of the label (every message, even when it is not queued)"""
+        with self.condition:
+            self.last_seen[label] = time.time()
+
+    def put(self, label):
+        with self.condition:
+            self.last_seen[label] = time.time()
+            if self.pending is not None and self.pending != label:
+                self.dropped += 1
+                logger.info(f"Detection of {self.pending} replaced by {label} before an ad was generated")
+            self.pending = label
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Block until a label is pending (or the timeout expires) and return it.
+        Labels not detected in the last DETECTION_MAX_AGE seconds are dropped and None is returned.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.pending is not None, timeout=timeout):
+                return None
+            label = self.pending
+            self.pending = None
+            if time.time() - self.last_seen.get(label, 0) > DETECTION_MAX_AGE:
+                self.dropped += 1
+                logger.info(f"Detection of {label} is stale, the product is not in view anymore")
+                return None
+            return label
+
+    def has_pending(self):
+        with self.condition:
+            return self.pending is not None
+
+# Newest product detected, waiting for its ad
+detection_mailbox = DetectionMailbox()
+
+class AdCache:
+    """
+    Ads already shown or prefetched, keyed by (product, association index, display width, display height).
+    Entries expire after ttl seconds; above max_entries the least recently shown ad is dropped.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (time stored, JPEG bytes), least recently shown first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, key):
+        """Whether a fresh ad is cached for the key (it does not count as shown)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() - entry[0] <= self.ttl
+
+    def put(self, key, ad):
+        with self.lock:
+            self.entries[key] = (time.time(), ad)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# Ads of the products detected before (and prefetched ones)
+ad_cache = AdCache(AD_CACHE_MAX_ENTRIES, AD_CACHE_TTL)
 
 class Ad_Generator(threading.Thread):
     """Process messages from queue in a separate thread"""
@@ -124,6 +280,9 @@ class Ad_Generator(threading.Thread):
         self.last_known_height = 600 # Default height until received from browser
         self.last_known_width = 480 # Default width until received from browser
         self.list_of_clients = []
+        self.published_ad = None # (version, JPEG bytes, generation time) of the last pushed ad, the version is part of its URL
+        self.published_versions = OrderedDict() # version -> (version, JPEG bytes, generation time) of the last pushed ads, oldest first
+        self.ad_condition = threading.Condition()
     def run(self):
         """Main thread loop to process messages from queue"""
         self.running = True
@@ -131,19 +290,15 @@ class Ad_Generator(threading.Thread):
         
         while self.running:
             try:
-                global message_queue
-                if not message_queue.empty():
-                    item = message_queue.get(timeout=1)
-                    if not self.ad_generating_in_progress:
-                        global product_associations
-                        associations = product_associations.get(item, None)
-                        # Prepare the API payload for AIG server
-                        if not associations:
-                            logger.warning(f"No associations found for product: {item}. Using default ad parameters.")
-                        self.generate_advertisement(item, associations, check_predefined=True, dummy_ad=False)
-                    message_queue.task_done()
-                else:
-                    time.sleep(0.1)
+                # Blocks until a product is detected; the timeout only lets the loop see stop()
+                item = detection_mailbox.get(timeout=1)
+                if item is not None and not self.ad_generating_in_progress:
+                    global product_associations
+                    associations = product_associations.get(item, None)
+                    # Prepare the API payload for AIG server
+                    if not associations:
+                        logger.warning(f"No associations found for product: {item}. Using default ad parameters.")
+                    self.generate_advertisement(item, associations, check_predefined=True)
             except Exception as e:
                 logger.error(f"Error in Ad_Generator thread: {str(e)}")
                 time.sleep(1)
@@ -159,173 +314,290 @@ class Ad_Generator(threading.Thread):
             v = min(v, max_val)
         return v
                 
-    def generate_advertisement(self, label, associations, check_predefined=False, dummy_ad=False):
+    def build_ad_payloads(self, label, associations, association_index, width, height):
+        """
+        Build the AIG payloads of an association of the product, with the add-ons scaled to the display size.
+        Returns the dynamic ad payload and the pre-defined ad query payload.
+        """
+        background_prompt = "perfectly dead-center, surrounded by vast white negative space, minimalist composition with wide margins, " \
+                            "isolated on a pure white seamless background, high-key studio lighting, 8k, crisp detail, sharp focus"
+        description = associations[association_index]['dynamic_ad_prompt'] + background_prompt \
+            if associations else f"A high-quality 35mm photo featuring {label}, 8k resolution with height {height} and width {width}"
+
+        pre_defined_ad_description = f"{label} and {associations[association_index]['associated_cross_sell']}"  if associations else f"{label}"
+        
+        base_dim = min(width, height)
+        scale = base_dim / 1080.0
+
+        factor = {
+            "small": 0.04,
+            "normal": 0.05,
+            "large": 0.06
+        } 
+
+        aig_payload = {
+            "description": description,                
+            # ---------------- PRICE (BOTTOM RIGHT)
+            "price_details": {
+                "price": ("$" + associations[association_index]['price'] + associations[association_index]["unit"]) if associations else "0.5 $/lb",
+
+                "align": "right",
+                "valign": "bottom",
+
+                # same as working JSON → scaled
+                "marperc_from_border": 2,
+                "font_size": 18,
+                "line_width": (len(associations[association_index]['price']) + 1) if associations else 5,
+
+                "price_color": "white",
+                "price_in_circle": True,
+                "price_circle_color": "black"
+            },
+            # ---------------- PROMO (BOTTOM CENTER)
+            "promo_details": {
+                "promo_text": associations[association_index]['promo_details'] if associations else "Special Offer - Check out our latest deals!",
+                "text_color": "white",
+                "rect_color": "black",
+                "rect_padding": max(10, min(30, len(associations[association_index]['promo_details']) // 4)) if associations else 20,
+                "rect_radius": 8,
+
+                "align": "center",
+                "valign": "bottom",
+
+                # 👇 PROMO must be ABOVE frame
+                "marperc_from_border": 3,
+
+                "font_size": self.scaled(factor["normal"] * base_dim, 1.0, min_val=12, max_val=18),
+                "line_width": self.scaled(factor["small"] * base_dim, 1.0, min_val=12, max_val=18)
+            },
+
+            # ---------------- LOGO (TOP LEFT)
+            "logo_details": {
+                "align": "left",
+                "valign": "top",
+                "logo_percentage": self.scaled(25, scale, min_val=15, max_val=35),
+                "margin_px": self.scaled(10, scale, min_val=6, max_val=30)
+            },
+
+            # ---------------- SLOGAN (ABOVE PROMO)
+            "slogan_details": {
+                "slogan_text": associations[association_index]['slogan']
+                    if associations else "Freshness You Can Trust",
+
+                "text_color": "white",
+                "align": "right",
+                "valign": "top",
+
+                # 👇 MUST be higher than promo
+                "marperc_from_border": 2,
+
+                "font_size":  self.scaled(factor["normal"] * base_dim, 1.0, min_val=12, max_val=18),
+                "line_width": self.scaled(factor["small"] * base_dim, 1.0, min_val=12, max_val=18)
+            },
+
+            # ---------------- FRAME
+            "framed_details": {
+                "activate": True,
+                "marperc_from_border": self.scaled(2, scale, min_val=1, max_val=4)
+            }
+        }
+        dynamic_payload = dict(aig_payload, description=description, device="GPU")
+        predefined_payload = dict(aig_payload,
+                                  query=pre_defined_ad_description,
+                                  n_results=1,
+                                  use_default_ad_onempty=False,
+                                  # The ad is rendered over the stored variant closest to the panel size
+                                  width=width,
+                                  height=height)
+        return dynamic_payload, predefined_payload
+
+    def generate_advertisement(self, label, associations, check_predefined=False):
         """Process individual message from queue"""
         try:
-
+            self.ad_generating_in_progress = True
             logger.info(f"Detected object: {label}, {len(associations) if associations else 0} associations found")
             association_index = random.randint(0, len(associations) - 1) if associations else 0
-            background_prompt = "perfectly dead-center, surrounded by vast white negative space, minimalist composition with wide margins, " \
-                                "isolated on a pure white seamless background, high-key studio lighting, 8k, crisp detail, sharp focus"
-            description = associations[association_index]['dynamic_ad_prompt'] + background_prompt \
-                if associations else f"A high-quality 35mm photo featuring {label}, 8k resolution with height {self.last_known_height} and width {self.last_known_width}"
-
-            pre_defined_ad_description = f"{label} and {associations[association_index]['associated_cross_sell']}"  if associations else f"{label}"
-            
-            base_dim = min(self.last_known_width, self.last_known_height)
-            scale = base_dim / 1080.0
-
-            factor = {
-                "small": 0.04,
-                "normal": 0.05,
-                "large": 0.06
-            } 
-
-            aig_payload = {
-                "description": description,                
-                # ---------------- PRICE (BOTTOM RIGHT)
-                "price_details": {
-                    "price": ("$" + associations[association_index]['price'] + associations[association_index]["unit"]) if associations else "0.5 $/lb",
-
-                    "align": "right",
-                    "valign": "bottom",
-
-                    # same as working JSON → scaled
-                    "marperc_from_border": 2,
-                    "font_size": 18,
-                    "line_width": (len(associations[association_index]['price']) + 1) if associations else 5,
-
-                    "price_color": "white",
-                    "price_in_circle": True,
-                    "price_circle_color": "black"
-                },
-                # ---------------- PROMO (BOTTOM CENTER)
-                "promo_details": {
-                    "promo_text": associations[association_index]['promo_details'] if associations else "Special Offer - Check out our latest deals!",
-                    "text_color": "white",
-                    "rect_color": "black",
-                    "rect_padding": max(10, min(30, len(associations[association_index]['promo_details']) // 4)) if associations else 20,
-                    "rect_radius": 8,
-
-                    "align": "center",
-                    "valign": "bottom",
-
-                    # 👇 PROMO must be ABOVE frame
-                    "marperc_from_border": 3,
-
-                    "font_size": self.scaled(factor["normal"] * base_dim, 1.0, min_val=12, max_val=18),
-                    "line_width": self.scaled(factor["small"] * base_dim, 1.0, min_val=12, max_val=18)
-                },
-
-                # ---------------- LOGO (TOP LEFT)
-                "logo_details": {
-                    "align": "left",
-                    "valign": "top",
-                    "logo_percentage": self.scaled(25, scale, min_val=15, max_val=35),
-                    "margin_px": self.scaled(10, scale, min_val=6, max_val=30)
-                },
-
-                # ---------------- SLOGAN (ABOVE PROMO)
-                "slogan_details": {
-                    "slogan_text": associations[association_index]['slogan']
-                        if associations else "Freshness You Can Trust",
-
-                    "text_color": "white",
-                    "align": "right",
-                    "valign": "top",
-
-                    # 👇 MUST be higher than promo
-                    "marperc_from_border": 2,
+            width, height = self.last_known_width, self.last_known_height
+            start_time = time.time()
 
-                    "font_size":  self.scaled(factor["normal"] * base_dim, 1.0, min_val=12, max_val=18),
-                    "line_width": self.scaled(factor["small"] * base_dim, 1.0, min_val=12, max_val=18)
-                },
+            cache_key = (label, association_index, width, height)
+            cached_ad = ad_cache.get(cache_key)
+            if cached_ad is not None:
+                self.last_generated_ad = cached_ad
+                self.time_taken_last_generated_ad = f"Cached ad shown in {time.time() - start_time:.2f} seconds"
+                self.list_of_clients = []  # Reset client list to force refresh
+                self.publish_advertisement()
+                logger.info(f"Advertisement for product: {label} served from the cache")
+                return
 
-                # ---------------- FRAME
-                "framed_details": {
-                    "activate": True,
-                    "marperc_from_border": self.scaled(2, scale, min_val=1, max_val=4)
-                }
-            }
+            dynamic_payload, predefined_payload = self.build_ad_payloads(label, associations, association_index, width, height)
             logger.info(f"Generating advertisement for product: {label} ")
             
             # Make API call to AIG server
-            aig_response = None
-            start_time = time.time()
+            status_code = None
             data_available_predefined = False
             recvd_img = False
 
+            speculative_job_id = None
+            if check_predefined and AIG_SPECULATIVE_GENERATION:
+                # The generation runs on the AIG server while the pre-defined ad is looked up
+                speculative_job_id, status_code = self.submit_dynamic_advertisement(dynamic_payload)
+
             if check_predefined:
-                logger.info(f"Checking for pre-defined advertisement for product: {label} {pre_defined_ad_description}")
-                aig_payload["query"] = pre_defined_ad_description
-                aig_payload["n_results"] = 1
-                aig_payload["use_default_ad_onempty"] = False
-                aig_response = requests.post(
-                    AIG_PREDEFINED_AD_QUERY_ENDPOINT,
-                    headers={
-                        'accept': 'application/json',
-                        'Content-Type': 'application/json'
-                    },
-                    json=aig_payload,
-                    timeout=5
-                )
-
-                if aig_response.status_code == 200:
-                    logger.debug(f"Pre-defined advertisement query successful for product: {label}")
-                    content = aig_response.json()
-                    
-                    if len(content) > 0:
-                        content_b64 = content[0].get('imgb64', None)
-                        if content_b64:
-                            data_available_predefined = True
-                            recvd_img = True
-                            decoded_bytes = base64.b64decode(content_b64)
-                            self.last_generated_ad  = decoded_bytes
-                            logger.info(f"Pre-defined advertisement found for product: {label}")
+                logger.info(f"Checking for pre-defined advertisement for product: {label} {predefined_payload['query']}")
+                ad_bytes, status_code = self.fetch_predefined_advertisement(predefined_payload)
+                if ad_bytes is not None:
+                    data_available_predefined = True
+                    recvd_img = True
+                    self.last_generated_ad = ad_bytes
+                    logger.info(f"Pre-defined advertisement found for product: {label}")
+                    if speculative_job_id is not None:
+                        self.cancel_dynamic_advertisement(speculative_job_id)
                 else:
-                    logger.error(f"AIG pre-defined ad query server error: {aig_response.status_code} (took {time.time() - start_time:.2f} seconds)")
-            
+                    logger.info(f"Pre-defined advertisement query for product: {label} returned no ad (status {status_code}, took {time.time() - start_time:.2f} seconds)")
+
             if not data_available_predefined:
                 logger.info(f"Pre-defined advertisement not found for product: {label}, Generating dynamic advertisement.")
-                aig_payload["description"] = description
-                aig_payload["device"] = "GPU"
-                aig_response = requests.post(
-                    AIG_DYNAMIC_AD_ENDPOINT,
-                    headers={
-                        'accept': 'application/json',
-                        'Content-Type': 'application/json'
-                    },
-                    json=aig_payload,
-                    timeout=400
-                )
-                if aig_response.status_code == 200:
-                    self.last_generated_ad = aig_response.content
+                if speculative_job_id is not None:
+                    ad_bytes, status_code = self.wait_dynamic_advertisement(speculative_job_id)
+                else:
+                    ad_bytes, status_code = self.fetch_dynamic_advertisement(dynamic_payload)
+                if ad_bytes is not None:
+                    self.last_generated_ad = ad_bytes
                     recvd_img = True
             
             elapsed_time = time.time() - start_time
             
-            if recvd_img and not dummy_ad:
+            if recvd_img:
                 if data_available_predefined:
                     self.time_taken_last_generated_ad = f"Pre-defined ad fetched in {elapsed_time:.2f} seconds"
                 else:
                     self.time_taken_last_generated_ad = f"Dynamic ad generated in {elapsed_time:.2f} seconds"
+                ad_cache.put(cache_key, self.last_generated_ad)
                 self.list_of_clients = []  # Reset client list to force refresh
+                self.publish_advertisement()
                 logger.info(f"Advertisement generated successfully for product: {label} (took {elapsed_time:.2f} seconds)")
             else:
                 self.last_generated_ad = None
-                if not dummy_ad: 
-                    logger.error(f"AIG server error: {aig_response.status_code} (took {elapsed_time:.2f} seconds)")
+                logger.error(f"AIG server error: {status_code} (took {elapsed_time:.2f} seconds)")
 
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
+        finally:
+            self.ad_generating_in_progress = False
+            ad_prefetcher.hint(label)
+
+    def fetch_predefined_advertisement(self, predefined_payload):
+        """
+        Query the pre-defined ads with the add-ons of the payload.
+        Returns the JPEG bytes of the best match (or None) and the HTTP status code.
+        """
+        try:
+            aig_response = aig_session.post(
+                AIG_PREDEFINED_AD_QUERY_ENDPOINT,
+                headers={
+                    'accept': 'application/json',
+                    'Content-Type': 'application/json'
+                },
+                json=predefined_payload,
+                timeout=AIG_PREDEFINED_AD_QUERY_TIMEOUT
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"AIG pre-defined ad query failed: {str(e)}")
+            return None, None
+
+        if aig_response.status_code != 200:
+            logger.error(f"AIG pre-defined ad query server error: {aig_response.status_code}")
+            return None, aig_response.status_code
+
+        content = aig_response.json()
+        if len(content) > 0 and content[0].get('imgb64', None):
+            return base64.b64decode(content[0]['imgb64']), aig_response.status_code
+        return None, aig_response.status_code
+
+    def submit_dynamic_advertisement(self, aig_payload):
+        """
+        Submit a dynamic ad generation job to the AIG server.
+        Returns the job ID (or None when it is rejected) and the HTTP status code.
+        """
+        try:
+            aig_response = aig_session.post(
+                AIG_DYNAMIC_AD_JOBS_ENDPOINT,
+                headers={
+                    'accept': 'application/json',
+                    'Content-Type': 'application/json'
+                },
+                json=aig_payload,
+                timeout=AIG_DYNAMIC_AD_SUBMIT_TIMEOUT
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"AIG dynamic ad job could not be submitted: {str(e)}")
+            return None, None
+        if aig_response.status_code != 202:
+            logger.warning(f"AIG dynamic ad job rejected: {aig_response.status_code} (Retry-After: {aig_response.headers.get('Retry-After')})")
+            return None, aig_response.status_code
+
+        return aig_response.json().get('job_id'), aig_response.status_code
+
+    def wait_dynamic_advertisement(self, job_id):
+        """
+        Poll a dynamic ad job until the image is ready.
+        Each poll is a short request, so a dropped connection does not lose the generated image.
+        Returns the JPEG bytes (or None) and the last HTTP status code.
+        """
+        deadline = time.time() + AIG_DYNAMIC_AD_TIMEOUT
+        status_code = None
+        while time.time() < deadline:
+            time.sleep(AIG_DYNAMIC_AD_POLL_INTERVAL)
+            try:
+                job_response = aig_session.get(f"{AIG_DYNAMIC_AD_JOBS_ENDPOINT}/{job_id}/image", timeout=AIG_DYNAMIC_AD_POLL_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"AIG dynamic ad job {job_id} poll failed, retrying: {str(e)}")
+                continue
+
+            status_code = job_response.status_code
+            if status_code == 200:
+                return job_response.content, status_code
+            if status_code != 202:
+                logger.error(f"AIG dynamic ad job {job_id} failed: {status_code} {job_response.text}")
+                return None, status_code
+
+        logger.error(f"AIG dynamic ad job {job_id} timed out after {AIG_DYNAMIC_AD_TIMEOUT} seconds")
+        self.cancel_dynamic_advertisement(job_id)
+        return None, status_code
+
+    def cancel_dynamic_advertisement(self, job_id):
+        """Cancel a dynamic ad job that is not needed anymore, so the AIG server can serve other requests"""
+        try:
+            response = aig_session.delete(f"{AIG_DYNAMIC_AD_JOBS_ENDPOINT}/{job_id}", timeout=AIG_DYNAMIC_AD_SUBMIT_TIMEOUT)
+            logger.info(f"AIG dynamic ad job {job_id} cancelled (status {response.status_code})")
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"AIG dynamic ad job {job_id} could not be cancelled: {str(e)}")
+
+    def fetch_dynamic_advertisement(self, aig_payload):
+        """
+        Submit a dynamic ad generation job to the AIG server and wait until the image is ready.
+        Returns the JPEG bytes (or None) and the last HTTP status code.
+        """
+        job_id, status_code = self.submit_dynamic_advertisement(aig_payload)
+        if job_id is None:
+            return None, status_code
+        return self.wait_dynamic_advertisement(job_id)
         
-    def get_current_advertisement(self, height=None, width=None, client_id=None):
-        """Return the current advertisement being displayed, optionally resized"""
-        # Update last known dimensions
+    def update_display_size(self, height=None, width=None):
+        """Record the display size reported by a browser; the prefetcher re-warms the cache when it changes"""
+        changed = (height and height != self.last_known_height) or (width and width != self.last_known_width)
         if height:
             self.last_known_height = height
         if width:
             self.last_known_width = width
+        if changed:
+            ad_prefetcher.display_resized()
+
+    def get_current_advertisement(self, height=None, width=None, client_id=None):
+        """Return the current advertisement being displayed, optionally resized"""
+        # Update last known dimensions
+        self.update_display_size(height, width)
         
         # Return None if no ad has been generated yet
         if self.last_generated_ad is None or client_id is None:
@@ -337,6 +609,31 @@ class Ad_Generator(threading.Thread):
         # Client already received this ad
         return None, 0
     
+    def publish_advertisement(self):
+        """Give the new ad a version and wake up the displays waiting on the push channel"""
+        with self.ad_condition:
+            self.published_ad = (uuid.uuid4().hex, self.last_generated_ad, self.time_taken_last_generated_ad)
+            self.published_versions[self.published_ad[0]] = self.published_ad
+            while len(self.published_versions) > AD_PUBLISHED_VERSIONS:
+                self.published_versions.popitem(last=False)
+            self.ad_condition.notify_all()
+
+    def wait_for_advertisement(self, known_version, timeout):
+        """
+        Wait until there is an ad with a version different from known_version (or the timeout expires).
+        Returns (version, generation time) of the current ad, or (None, None) when there is nothing new.
+        """
+        with self.ad_condition:
+            self.ad_condition.wait_for(lambda: self.published_ad is not None and self.published_ad[0] != known_version, timeout=timeout)
+            if self.published_ad is None or self.published_ad[0] == known_version:
+                return None, None
+            return self.published_ad[0], self.published_ad[2]
+
+    def get_published_advertisement(self, version):
+        """(version, JPEG bytes, generation time) of one of the last pushed ads, or None when it is not kept anymore"""
+        with self.ad_condition:
+            return self.published_versions.get(version)
+
     def stop(self):
         """Stop the processor thread"""
         self.running = False
@@ -345,6 +642,97 @@ class Ad_Generator(threading.Thread):
 # Global message processor instance
 ad_generator_Obj = Ad_Generator()
 
+class AdPrefetcher(threading.Thread):
+    """
+    Warms the ad cache while no ad is being generated: the pre-defined ad of every association
+    of every primary product, at the current display size. A pass starts when a display reports
+    its size (and again when it changes), every AD_PREFETCH_INTERVAL seconds and after each detection.
+    After a detection, the associations of that product and of its cross-sell items
+    (when they are primary products too) are fetched first.
+    Dynamic ads are not prefetched, the GPU stays free for the detected products.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.running = False
+        self.condition = threading.Condition()
+        self.priority = [] # Products to warm before the others
+        self.pass_due = False # The display size changed, the cache is warmed again for the new size
+        self.prefetched = 0
+        logger.info("AdPrefetcher thread initialized")
+
+    def run(self):
+        """Prefetch pass every AD_PREFETCH_INTERVAL seconds, or as soon as the display size changes or a detection gives a hint"""
+        self.running = True
+        logger.info("AdPrefetcher thread started")
+        while self.running:
+            try:
+                # The first pass waits for a display, so it does not warm the default size
+                with self.condition:
+                    self.condition.wait_for(lambda: self.pass_due or len(self.priority) > 0 or not self.running, timeout=AD_PREFETCH_INTERVAL)
+                    labels, self.priority = self.priority, []
+                    self.pass_due = False
+                if not self.running:
+                    break
+                self.prefetch(labels + [label for label in product_associations if label not in labels])
+            except Exception as e:
+                logger.error(f"Error in AdPrefetcher thread: {str(e)}")
+                time.sleep(1)
+
+    def hint(self, label):
+        """A product was detected: its associations and cross-sell items are the likely next ads"""
+        cross_sells = [association['associated_cross_sell'] for association in product_associations.get(label, [])]
+        with self.condition:
+            self.priority = [product for product in dict.fromkeys([label] + cross_sells) if product in product_associations]
+            self.condition.notify()
+
+    def display_resized(self):
+        """The display size changed: the cached keys of the previous size miss, a new pass starts"""
+        with self.condition:
+            self.pass_due = True
+            self.condition.notify()
+
+    def interrupted(self):
+        with self.condition:
+            return not self.running or self.pass_due or len(self.priority) > 0
+
+    def prefetch(self, labels):
+        """Fetch the pre-defined ads missing from the cache. It stops when a new hint arrives or the display size changes."""
+        width, height = ad_generator_Obj.last_known_width, ad_generator_Obj.last_known_height
+        prefetched = 0
+        for label in labels:
+            associations = product_associations.get(label, [])
+            for association_index in range(len(associations)):
+                cache_key = (label, association_index, width, height)
+                if ad_cache.contains(cache_key):
+                    continue
+                # Detected products go first
+                while ad_generator_Obj.ad_generating_in_progress or detection_mailbox.has_pending():
+                    if self.interrupted():
+                        return
+                    time.sleep(AD_PREFETCH_IDLE_WAIT)
+                if self.interrupted():
+                    return
+
+                _, predefined_payload = ad_generator_Obj.build_ad_payloads(label, associations, association_index, width, height)
+                ad_bytes, _ = ad_generator_Obj.fetch_predefined_advertisement(predefined_payload)
+                if ad_bytes is not None:
+                    ad_cache.put(cache_key, ad_bytes)
+                    prefetched += 1
+        if prefetched > 0:
+            self.prefetched += prefetched
+            logger.info(f"Prefetched {prefetched} pre-defined ads for {width}x{height} ({self.prefetched} in total)")
+
+    def stop(self):
+        """Stop the prefetcher thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        logger.info("AdPrefetcher thread stopping")
+
+# Global ad prefetcher instance
+ad_prefetcher = AdPrefetcher()
+
 class MQTTSubscriber:
     """MQTT Subscriber Client for Digital Signage"""
     
@@ -394,7 +782,6 @@ class MQTTSubscriber:
             
             # Try to parse as JSON
             try:
-                global message_queue
                 message_data = json.loads(payload)
                 # Put message in queue for processing
                 
@@ -405,8 +792,9 @@ class MQTTSubscriber:
                     label = tensor.get('label', 'unknown')  
                     if confidence is not None and confidence > 0.5:
                         # logger.debug(f"Detected object: {label} with confidence: {confidence}")
+                        detection_mailbox.seen(label)
                         if label not in self.list_of_processed_products[-3:]:
-                            message_queue.put(label)
+                            detection_mailbox.put(label)
                             self.last_processed_item = label
                             self.list_of_processed_products.append(label)
                     else:
@@ -469,6 +857,55 @@ def get_current_advertisement():
         return jsonify({'status': 'ok'}), 204
 
 
+@app.route('/advertisement/events', methods=['GET'])
+def advertisement_events():
+    """
+    Server-Sent Events stream: an 'ad' event (URL of the ad image and generation time) is pushed
+    as soon as a new ad is ready, so displays do not need to poll.
+    """
+    global ad_generator_Obj
+
+    width = request.args.get('width', type=int)
+    height = request.args.get('height', type=int)
+    ad_generator_Obj.update_display_size(height, width)
+    # Sent by the browser when it reconnects, the ad it already has is not pushed again
+    known_version = request.headers.get('Last-Event-ID')
+
+    def events():
+        version = known_version
+        yield f"retry: 2000\n\n"
+        while True:
+            new_version, time_taken = ad_generator_Obj.wait_for_advertisement(version, AD_EVENTS_KEEPALIVE)
+            if new_version is None:
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+            payload = json.dumps({'url': f"/advertisement/{version}.jpg", 'generation_time': time_taken})
+            yield f"id: {version}\nevent: ad\ndata: {payload}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/advertisement/<string:version>.jpg', methods=['GET'])
+def advertisement_image(version):
+    """Image of the ad with the given version. The URL changes with every ad, so it is cached by the browser"""
+    global ad_generator_Obj
+
+    published_ad = ad_generator_Obj.get_published_advertisement(version)
+    if published_ad is None or published_ad[1] is None:
+        return jsonify({'status': 'not found'}), 404
+    return Response(
+        published_ad[1],
+        mimetype='image/jpeg',
+        headers={
+            'Cache-Control': 'public, max-age=86400, immutable',
+            'ETag': version,
+            'X-Generation-Time': published_ad[2]
+        }
+    )
+
+
 # Initialize the application
 def initialize_app():
     """Initialize the video streaming application"""
@@ -493,11 +930,14 @@ def initialize_app():
         logger.info("Message processor thread started successfully")
     except Exception as e:
         logger.error(f"Failed to start message processor thread: {str(e)}")
-    
-    #Generating test advertisement to warm up AIG server
-    logger.info("Warming up AIG server by generating a test advertisement...")
-    ad_generator_Obj.generate_advertisement("test_product", None, dummy_ad=True)
 
+    # Start the ad prefetcher once the pre-defined ads are stored
+    try:
+        ad_prefetcher.start()
+        logger.info("Ad prefetcher thread started successfully")
+    except Exception as e:
+        logger.error(f"Failed to start ad prefetcher thread: {str(e)}")
+    
     # Initialize MQTT subscriber
     try:
         mqtt_subscriber = MQTTSubscriber(MQTT_BROKER, MQTT_PORT, MQTT_TOPIC)
@@ -521,14 +961,16 @@ if __name__ == '__main__':
         flask_thread.start()
         logger.info("Flask server started in separate thread")
     
-        # Check if AIG server is up
-        logger.info(f"Checking AIG server availability at {AIG_SERVER_URL}")
+        # Check if AIG server is up and its pipelines are warmed up
+        logger.info(f"Checking AIG server readiness at {AIG_READY_ENDPOINT}")
         while True:
             try:
-                response = requests.get(f"{AIG_SERVER_URL}", timeout=2)
+                response = aig_session.get(AIG_READY_ENDPOINT, timeout=AIG_READY_TIMEOUT)
                 if response.status_code == 200:
-                    logger.info("AIG server is up and running")
+                    logger.info(f"AIG server is up and running (warm-up took {response.json().get('warmup_time')} seconds)")
                     break
+                elif response.status_code == 503:
+                    logger.info("AIG server is warming up...")
                 else:
                     logger.warning(f"AIG server responded with status code: {response.status_code}")
             except requests.exceptions.RequestException as e:
@@ -558,6 +1000,13 @@ if __name__ == '__main__':
                 logger.info("Message processor thread stopped")
             except Exception as e:
                 logger.error(f"Error stopping message processor: {str(e)}")
+
+        # Clean up ad prefetcher thread
+        try:
+            ad_prefetcher.stop()
+            logger.info("Ad prefetcher thread stopped")
+        except Exception as e:
+            logger.error(f"Error stopping ad prefetcher: {str(e)}")
         
         # Clean up MQTT subscriber
         if mqtt_subscriber: